@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from Benchmarks.pipeline import record
+
+# Import time of the pipeline modules, every module in a fresh interpreter (python -X importtime). Heavy libraries
+# are only imported where they are used, --check fails if a module pulls one in at import or got slower than
+# threshold x the last run recorded in the output file:
+#   python -m Benchmarks.imports --output imports.jsonl --check
+
+MODULES = ['utils', 'IOHandlers.carmaker', 'Discretizers.fastdiscretizer', 'Discretizers.tensordiscretizer',
+           'Discretizers.adaptivediscretizer', 'Discretizers.samplingdiscretizer', 'Discretizers.screeningdiscretizer', 'Runners.carmaker', 'Runners.pool', 'Runners.tcl', 'PngHandlers.yolo',
+           'ScoreCalculators.iou', 'Evaluaters.GCI', 'Evaluaters.sensitivity', 'MetadataStores.sqlite', 'MetadataStores.dedup',
+           'Pipelines.streaming', 'Surrogates.grid']
+HEAVY = ['scipy', 'SALib', 'matplotlib', 'pandas', 'asammdf', 'torch', 'cv2']
+_TOP_LEVEL = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\S+)$') # nested imports are indented further
+
+
+def import_time(module, repeat=3):
+    # (seconds, heavy libraries loaded), the fastest of repeat interpreters
+    code = f'import sys, {module}; print(" ".join(name for name in {HEAVY!r} if name in sys.modules))'
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 capture_output=True, text=True, check=True)
+        seconds = _cumulative(process.stderr, module)
+        best = seconds if best is None else min(best, seconds)
+    return best, process.stdout.split()
+
+def benchmark(modules=MODULES, repeat=3):
+    return [dict(zip(('module', 'seconds', 'heavy'), (module, *import_time(module, repeat)))) for module in modules]
+
+def check(results, output=None, threshold=1.5, slack=0.05):
+    # problems of the results: heavy imports, and modules more than threshold x (and slack seconds) slower than the last recorded run
+    problems = [f'{row["module"]} imports {", ".join(row["heavy"])}' for row in results if row['heavy']]
+    if output and os.path.exists(output):
+        with open(output) as output_file:
+            entries = [json.loads(line) for line in output_file if line.strip()]
+        before = {row['module']: row['seconds'] for row in entries[-1]['results']} if entries else {}
+        for row in results:
+            if row['module'] in before and row['seconds'] > threshold * before[row['module']] + slack:
+                problems.append(f'{row["module"]} {before[row["module"]]:.3f} s -> {row["seconds"]:.3f} s')
+    return problems
+
+def print_results(results):
+    for row in results:
+        print(f'{row["module"]:35s} {row["seconds"]:7.3f} s {" ".join(row["heavy"])}')
+
+
+def _cumulative(importtime, module):
+    # cumulative time of the top level import of module
+    for line in importtime.splitlines():
+        match = _TOP_LEVEL.match(line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1e6
+    raise ValueError(f'{module} not in the import time output')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='imports.jsonl')
+    parser.add_argument('--check', action='store_true', help='exit with 1 on heavy imports or regressions')
+    args = parser.parse_args()
+    results = benchmark(args.modules, args.repeat)
+    print_results(results)
+    problems = check(results, args.output)
+    record(results, args.output, {'repeat': args.repeat})
+    for problem in problems:
+        print(problem)
+    if args.check and problems:
+        sys.exit(1)
@@ -0,0 +1,185 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from Discretizers.fastdiscretizer import FastDiscretizer
+from Discretizers.tensordiscretizer import TensorDiscretizer
+from Evaluaters.GCI import GCIEvaluater
+from IOHandlers.carmaker import CarMakerHandler
+from MetadataStores.journal import StageJournal
+from MetadataStores.sqlite import SqliteStore
+from MetadataStores.tomlfiles import TomlStore
+from PngHandlers.yolo import ResidentYoloHandler
+from Runners.carmaker import CarMakerRunner
+from Runners.fakecarmaker import FakeCarMaker
+from ScoreCalculators import camera
+from ScoreCalculators.iou import IouScoreCalculator
+
+# End-to-end timing of the modules against Runners.fakecarmaker, without CarMaker or a license. Every stage of every
+# grid is timed, one JSON line per benchmark run is appended to the output file so versions can be compared:
+#   python -m Benchmarks.pipeline --levels 5 --dims 1 2 --output benchmarks.jsonl
+#   python -m Benchmarks.pipeline --compare benchmarks.jsonl
+# Without --weights the detector is replaced by a fixed box per png, then 'evaluate_pngs' only measures the journal
+# and the label files.
+
+STAGES = ('generate_instances', 'simulate_movies', 'evaluate_pngs', 'parse_results', 'evaluation')
+STORES = {'toml': TomlStore, 'sqlite': SqliteStore}
+OUT_QUANTS = ['Vhcl.Fr1.x', 'Vhcl.Fr1.y', 'Vhcl.Fr1.z']
+CAMERA_NAME = 'Benchmark'
+SYNTHETIC_BOX = np.array([[0, 0.5, 0.55, 0.1, 0.1, 0.9]]) # cls, x_center, y_center, width, height, conf
+_DISTANCE = re.compile(r'^Traffic\.0\.Init\.Road = (\S+)', re.M)
+
+
+def benchmark(levels=4, dims=(1,), repeat=1, store='toml', sim_time=0.0, weights=None, samples=100, tcp_cmd_port=10240, log_level=2):
+    # [{'dims', 'grid', 'instances', stage: seconds}], the fastest of repeat runs, every run in a new directory
+    rows = {}
+    for _ in range(repeat):
+        for dim in dims:
+            for row in _run_study(levels, dim, STORES[store], sim_time, weights, samples, tcp_cmd_port, log_level):
+                best = rows.setdefault((dim, row['grid']), row)
+                for stage in STAGES:
+                    best[stage] = min(best[stage], row[stage])
+    return list(rows.values())
+
+def record(results, output, config):
+    entry = {'time': str(datetime.now()), 'commit': _commit(), 'python': platform.python_version(),
+             'platform': platform.platform(), 'config': config, 'results': results}
+    with open(output, 'a') as output_file:
+        output_file.write(json.dumps(entry) + '\n')
+    return entry
+
+def compare(output, baseline=-2, current=-1, threshold=1.2):
+    # seconds of every stage in two recorded runs of the output file, slower than threshold x baseline is marked
+    with open(output) as output_file:
+        entries = [json.loads(line) for line in output_file if line.strip()]
+    old, new = entries[baseline], entries[current]
+    print(f'baseline {old["commit"][:10]} {old["time"]}  current {new["commit"][:10]} {new["time"]}')
+    old_rows = {(row['dims'], row['grid']): row for row in old['results']}
+    slower = []
+    for row in new['results']:
+        before = old_rows.get((row['dims'], row['grid']))
+        if before is None:
+            continue
+        for stage in STAGES:
+            ratio = row[stage] / before[stage] if before[stage] else float('nan')
+            mark = ' <' if ratio > threshold and row[stage] > 0.01 else ''
+            if mark:
+                slower.append((row['dims'], row['grid'], stage))
+            print(f'dims {row["dims"]} grid {row["grid"]:2d} {stage:18s} {before[stage]:9.3f} s -> {row[stage]:9.3f} s  x{ratio:5.2f}{mark}')
+    return slower
+
+def print_results(results):
+    print(f'{"dims":>4s} {"grid":>4s} {"instances":>9s} ' + ' '.join(f'{stage:>18s}' for stage in STAGES))
+    for row in results:
+        print(f'{row["dims"]:4d} {row["grid"]:4d} {row["instances"]:9d} ' + ' '.join(f'{row[stage]:16.3f} s' for stage in STAGES))
+
+
+def _run_study(levels, dim, store, sim_time, weights, samples, tcp_cmd_port, log_level):
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        handler = _write_study(work_dir, dim)
+        camera.CAMERA_CFG = os.path.join(work_dir, 'Camera.cfg')
+        discretizer = FastDiscretizer if dim == 1 else TensorDiscretizer
+        para_range = next(iter(handler.params.values()))
+        fake = FakeCarMaker(tcp_cmd_port, project_path=work_dir, sim_time=sim_time, signals=_signals, samples=samples).start()
+        try:
+            runner = CarMakerRunner(launch=False, tcp_cmd_port=tcp_cmd_port, log_level=log_level)
+            rows = []
+            for grid_ID in range(1, levels + 1):
+                row = {'dims': dim, 'grid': grid_ID}
+                with _timed(row, 'generate_instances'):
+                    instances, grid_path = discretizer.generate_instances(handler, grid_ID, store=store)
+                row['instances'] = len(instances)
+                with _timed(row, 'simulate_movies'):
+                    runner.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+                with _timed(row, 'evaluate_pngs'):
+                    if weights:
+                        ResidentYoloHandler.evaluate_pngs(grid_path, weights=weights, store=store)
+                    else:
+                        _detect_synthetic(grid_path, store)
+                with _timed(row, 'parse_results'):
+                    IouScoreCalculator.parse_results(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+                with _timed(row, 'evaluation'):
+                    if grid_ID >= 3:
+                        GCIEvaluater.evaluation(grid_path, para_range, store=store)
+                rows.append(row)
+            return rows
+        finally:
+            fake.stop()
+            GCIEvaluater.clear_cache()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _write_study(work_dir, dim):
+    # testrun with dim traffic objects, the distance of the first one is what the camera sees
+    testrun_dir = os.path.join(work_dir, 'Data', 'TestRun', 'benchmark')
+    os.makedirs(testrun_dir)
+    testrun_path = os.path.join(testrun_dir, 'distance')
+    with open(testrun_path, 'w') as testrun_file:
+        testrun_file.write('#INFOFILE1.1 - Do not remove this line!\nFileIdent = CarMaker-TestRun 8\n')
+        testrun_file.write(''.join(f'Traffic.{i}.Init.Road = 50 0\n' for i in range(dim)))
+    param_path = os.path.join(work_dir, 'distance.param')
+    with open(param_path, 'w') as param_file:
+        param_file.write(''.join(f"'Traffic.{i}.Init.Road[0]' = '10, 200'\n" for i in range(dim)))
+    with open(os.path.join(work_dir, 'Camera.cfg'), 'w') as camera_file:
+        camera_file.write(f'FileIdent = IPGMovie-Camera 1\nCamera.0.Name = {CAMERA_NAME}\nCamera.0.Pos = 1.5 0 1.3\n'
+                          'Camera.0.dist = 0.3\nCamera.0.rot = 0 0 0\n')
+    return CarMakerHandler(testrun_path, param_path)
+
+def _signals(testrun_path, out_quants, samples):
+    # the object drives from its start distance towards the camera, 1 m high
+    with open(testrun_path) as testrun_file:
+        distance = float(_DISTANCE.search(testrun_file.read()).group(1))
+    signals = {'Vhcl.Fr1.x': np.linspace(distance, distance / 2, samples), 'Vhcl.Fr1.y': np.zeros(samples), 'Vhcl.Fr1.z': np.ones(samples)}
+    return {quant: signals.get(quant, np.zeros(samples)) for quant in out_quants}
+
+def _detect_synthetic(grid_path, store):
+    with StageJournal(store.from_grid_path(grid_path), 'yolo_result') as journal:
+        for key, instance in journal.pending(grid_path):
+            journal.commit(key, {'results': {'yolov5': ResidentYoloHandler._write_detections(instance, SYNTHETIC_BOX)}})
+
+@contextlib.contextmanager
+def _timed(row, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        row[stage] = time.perf_counter() - start
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, default=4, help='grids 1 to levels of every study')
+    parser.add_argument('--dims', type=int, nargs='+', default=[1], help='varied parameters, one study each')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--store', choices=sorted(STORES), default='toml')
+    parser.add_argument('--simtime', type=float, default=0.0, help='seconds a fake simulation takes')
+    parser.add_argument('--weights', default=None, help='YOLOv5 weights, a fixed box per png without')
+    parser.add_argument('--samples', type=int, default=100, help='samples of every ERG signal')
+    parser.add_argument('--cmdport', type=int, default=10240)
+    parser.add_argument('--output', default='benchmarks.jsonl')
+    parser.add_argument('--compare', metavar='OUTPUT', default=None, help='compare the last two runs of OUTPUT instead')
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.compare)
+    else:
+        config = {'levels': args.levels, 'dims': args.dims, 'repeat': args.repeat, 'store': args.store,
+                  'sim_time': args.simtime, 'weights': args.weights, 'samples': args.samples}
+        results = benchmark(args.levels, args.dims, args.repeat, args.store, args.simtime, args.weights, args.samples, args.cmdport)
+        print_results(results)
+        record(results, args.output, config)
@@ -0,0 +1,61 @@
+from Discretizers.discretizer_base import Basediscretizer
+from MetadataStores.tomlfiles import TomlStore
+from datetime import datetime
+from fractions import Fraction
+import math
+
+class AdaptiveDiscretizer(Basediscretizer):
+    # h-refinement of the first parameter. The grid is a set of leaf cells [level, index], cell (L, j) spans
+    # [j/2**L, (j+1)/2**L] of the parameter range and grid points are the cell edges. Grid k splits only the cells
+    # next to the points where the evaluation of grid k-1 found |GCI| > gci_threshold or an observed order p
+    # outside p_range. p is only checked where |GCI| > p_fraction * gci_threshold, below that the differences
+    # are round-off. Grids without evaluation (or without previous grid) are refined uniformly.
+    # The leaf cells are kept in 'cells' of the grid properties.
+
+    @classmethod
+    def generate_instances(cls, io_handler, grid_ID, target_path_pattern='%p%/%f_%y-%m-%d-%H-%M_%g%/%f.%x%e', store=TomlStore,
+                           gci_threshold=0.01, p_range=(1.5, 2.5), p_fraction=0.1, workers=1, testruns='write'):
+        date = datetime.now()
+        metadata = store(cls._study_dir(io_handler, target_path_pattern, grid_ID, date))
+        xpath, bound = next(iter(io_handler.params.items()))
+        cells = cls._refine(metadata, grid_ID, bound, gci_threshold, p_range, p_fraction)
+        edges = sorted({Fraction(j + side, 2**level) for level, j in cells for side in (0, 1)})
+        params_list = [{xpath: float(bound[0] + (bound[1] - bound[0]) * edge)} for edge in edges]
+        positions = [str(edge) for edge in edges]
+        instances, grid_path = cls._generate_grid(io_handler, grid_ID, params_list, positions, metadata, target_path_pattern, date, workers, testruns)
+        metadata.update_grid(grid_path, {'properties': {'cells': cells}})
+        return instances, grid_path
+
+    @classmethod
+    def _refine(cls, metadata, grid_ID, bound, gci_threshold, p_range, p_fraction):
+        previous = metadata.grid_path(grid_ID - 1)
+        if grid_ID == 1 or previous not in metadata.grid_paths():
+            return cls._uniform_cells(grid_ID)
+        grid = metadata.read_grid(previous)
+        cells = grid['properties'].get('cells', cls._uniform_cells(grid_ID - 1))
+        evaluation = grid['evaluation']
+        if evaluation['GCI'] == '':
+            return [child for cell in cells for child in cls._split(cell)]
+        flagged = set()
+        for x, p, GCI in zip(evaluation['points_x'], evaluation['p'], evaluation['GCI']):
+            # nan p means the coarser grids gave the same value, only GCI tells something there
+            outside = not math.isnan(p) and not p_range[0] <= p <= p_range[1]
+            if abs(GCI) > gci_threshold or (outside and abs(GCI) > p_fraction * gci_threshold):
+                flagged.add(Fraction((x - bound[0]) / (bound[1] - bound[0])).limit_denominator(2**20))
+        refined = []
+        for level, j in cells:
+            if Fraction(j, 2**level) in flagged or Fraction(j + 1, 2**level) in flagged:
+                refined += cls._split([level, j])
+            else:
+                refined.append([level, j])
+        return refined
+
+    @staticmethod
+    def _uniform_cells(grid_ID):
+        # grid k of the uniform discretizers, 2**(k-1) cells
+        return [[grid_ID - 1, j] for j in range(2**(grid_ID - 1))]
+
+    @staticmethod
+    def _split(cell):
+        level, j = cell
+        return [[level + 1, 2 * j], [level + 1, 2 * j + 1]]
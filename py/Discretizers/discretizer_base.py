@@ -2,65 +2,157 @@ from genericpath import exists
 import utils
 from datetime import datetime
 from abc import abstractmethod
+from fractions import Fraction
+import json
 import os
-import toml
+import numpy as np
+from IOHandlers.testruns import TestrunStore
+from MetadataStores.base import instance_key
+from MetadataStores.tomlfiles import TomlStore
+import tracing
 
 class Basediscretizer():
 
     @classmethod
-    def generate_instances(cls, io_handler, grid_ID, target_path_pattern='%p%/%f_%y-%m-%d-%H-%M_%g%/%f.%x%e', ):
-        discrete_params = [2**(grid_ID-1)+1]
+    def generate_instances(cls, io_handler, grid_ID, target_path_pattern='%p%/%f_%y-%m-%d-%H-%M_%g%/%f.%x%e', store=TomlStore, levels=None, workers=1, testruns='write'):
+        discrete_params = cls._discrete_params(io_handler.params, grid_ID, levels)
         params_list = cls._discrete(io_handler.params, discrete_params)
-        paths = cls._write_batch(io_handler, params_list, target_path_pattern, grid_ID)
-        instances = [{'instance_path': path, 'instance_parameters': params} for path, params in zip(paths, params_list)]
-        testrun_dir_path = os.path.dirname(instances[0]['instance_path'])
-        cls._write_instances(testrun_dir_path, params_list, paths, io_handler)
-        grid_path = cls._write_grid(testrun_dir_path, grid_ID, params_list)
-        return instances, grid_path
+        positions = cls._positions(discrete_params)
+        date = datetime.now()
+        metadata = store(cls._study_dir(io_handler, target_path_pattern, grid_ID, date))
+        return cls._generate_grid(io_handler, grid_ID, params_list, positions, metadata, target_path_pattern, date, workers, testruns)
+
+    @staticmethod
+    def _study_dir(io_handler, target_path_pattern, grid_ID, date):
+        testrun_dir_path = os.path.dirname(utils.create_path(target_path_pattern, io_handler.data_file_path, 0, date, grid_ID))
+        return os.path.dirname(testrun_dir_path)
+
+    @classmethod
+    def _generate_grid(cls, io_handler, grid_ID, params_list, positions, metadata, target_path_pattern, date, workers=1, testruns='write', chunk_size=16384):
+        # grid k contains every point of grid k-1, only points at new positions get a testrun.
+        # testruns: 'write' writes them now, 'lazy' and 'temporary' only when they are simulated (see TestrunStore)
+        # The points are handled in chunks of (n, n_params) arrays, {xpath: value} dicts are only built for testruns that are written.
+        base_testrun = TestrunStore.write_base(metadata, io_handler, testruns)
+        known, foreign = cls._known_positions(metadata, io_handler.params)
+        points = params_list if hasattr(params_list, 'names') else ParameterSample(list(params_list[0]), [list(parameter.values()) for parameter in params_list])
+        span = np.ptp(np.array(list(io_handler.params.values()), dtype=float)[:, :2], axis=1)
+        keys, new_paths = [], {}
+        for start in range(0, len(points), chunk_size):
+            chunk_positions = positions[start:start + chunk_size]
+            values = points.values(start, start + chunk_size)
+            # a known position is only linked if its instance has the values of the point
+            linked = [id for id, position in enumerate(chunk_positions) if position in known]
+            if linked:
+                linked_values = np.array([json.loads(known[chunk_positions[id]]) for id in linked], dtype=float)
+                same = np.isclose(linked_values, values[linked], rtol=1e-9, atol=1e-9 * span).all(axis=1)
+                linked = set(np.array(linked, dtype=np.int64)[same].tolist())
+            new = np.array([id for id in range(len(chunk_positions)) if id not in linked], dtype=np.int64)
+            if len(new):
+                new_points = ParameterSample(points.names, values[new])
+                cls._check_foreign(metadata, new_points, foreign, io_handler)
+                paths = cls._write_batch(io_handler, new_points, target_path_pattern, grid_ID, ids=(new + start).tolist(), date=date, workers=workers, write=testruns == 'write')
+                new_positions = [chunk_positions[id] for id in new.tolist()]
+                known.update(zip(new_positions, cls._write_instances(metadata, new_points, paths, io_handler, new_positions, base_testrun)))
+                new_paths.update(zip((new + start).tolist(), paths))
+            keys += [known[position] for position in chunk_positions]
+        grid_path = cls._write_grid(metadata, grid_ID, points.names, keys)
+        return GridInstances(params_list, keys, new_paths, metadata), grid_path
+
+    @staticmethod
+    def _discrete_params(params, grid_ID, levels=None):
+        # number of points of every varied parameter, refinement level k has 2**(k-1)+1 points
+        return [2**(grid_ID-1)+1]
 
     @classmethod
     @abstractmethod
     def _discrete(cls, params, discrete_params):
         pass
 
+    @staticmethod
+    def _positions(discrete_params):
+        # exact position of every grid point in the unit cube, in the order of _discrete, e.g. '1/4' or '1/2,0'
+        return GridPositions(discrete_params)
+
+    @staticmethod
+    def _signature(params):
+        # parameters and bounds the positions refer to. The study is the directory of the testrun, so every .param
+        # file of the testrun shares it and gets its own positions.
+        return ';'.join(f'{xpath}={float(bounds[0])!r},{float(bounds[1])!r}' for xpath, bounds in params.items())
+
+    @staticmethod
+    def _signature_names(signature):
+        return [item.rsplit('=', 1)[0] for item in signature.split(';')]
+
+    @staticmethod
+    def _position_indexes(properties):
+        # {signature: {position: instance key}}. Positions recorded without signature are matched again by their values.
+        return {signature: dict(index) for signature, index in properties.get('positions', {}).items() if isinstance(index, dict)}
+
     @classmethod
-    def _write_batch(cls, io_handler, params_list, target_path_pattern, grid_ID):
-        paths = []
-        for id, params in enumerate(params_list):
-            target_path = utils.create_path(target_path_pattern, io_handler.data_file_path, id, datetime.now(), grid_ID)
-            io_handler._write_instance(params, target_path)
-            paths.append(target_path)
+    def _known_positions(cls, metadata, params):
+        # {position: instance key} of the points of the study with these parameters and bounds, and the keys of
+        # instances of other parameters. Instances of the same parameters with other bounds, or of studies written
+        # before positions were recorded, are matched by their parameter values, which are exact enough to recover
+        # the dyadic positions.
+        signature = cls._signature(params)
+        indexes = cls._position_indexes(metadata.read_properties())
+        known = dict(indexes.get(signature, {}))
+        names = cls._signature_names(signature)
+        same = {key for other, index in indexes.items() if cls._signature_names(other) == names for key in index.values()}
+        foreign = {key for index in indexes.values() for key in index.values()} - same
+        indexed = foreign | set(known.values())
+        bounds = list(params.values())
+        for key in metadata.instance_keys():
+            values = json.loads(key) if key not in indexed else []
+            if len(values) == len(bounds):
+                position = [Fraction((value - bound[0]) / (bound[1] - bound[0])).limit_denominator(2**20) if bound[1] != bound[0] else 0
+                            for value, bound in zip(values, bounds)]
+                known.setdefault(','.join(map(str, position)), key)
+        return known, foreign
+
+    @staticmethod
+    def _check_foreign(metadata, params_list, foreign, io_handler):
+        # instance keys are the parameter values, a point of other parameters with the same values can not be told apart
+        for parameter_cb in params_list.values().tolist():
+            if instance_key(parameter_cb) in foreign:
+                raise ValueError(f'{metadata.study_dir} already has an instance {instance_key(parameter_cb)} of other parameters '
+                                 f'than {list(io_handler.params)}, generate {io_handler.param_file_path} into its own directory')
+
+    @classmethod
+    def _write_batch(cls, io_handler, params_list, target_path_pattern, grid_ID, ids=None, date=None, workers=1, write=True):
+        date = date if date else datetime.now()
+        ids = ids if ids is not None else range(len(params_list))
+        paths = utils.create_paths(target_path_pattern, io_handler.data_file_path, ids, date, grid_ID)
+        if write:
+            with tracing.span(f'{type(io_handler).__name__}.write_instances', 'io', count=len(paths)):
+                io_handler.write_instances(params_list, paths, workers)
         return paths
 
     @classmethod
-    def _write_instances(cls, testrun_dir_path, params_list, paths, io_handler):
-        instances_path = os.path.dirname(testrun_dir_path) + '\\instances.toml'
-        if not os.path.exists(os.path.dirname(testrun_dir_path) + '\\instances'):
-            os.mkdir(os.path.dirname(testrun_dir_path) + '\\instances')
-        if not os.path.exists(instances_path):
-            with open(instances_path,'w+') as toml_file:
-                data = {
-                "title": "instances",
-                'properties':{
-                'path': os.path.dirname(testrun_dir_path) + '\\instances.toml'
-                },
-                'instances':{}
-            }    
-        else:
-            with open(instances_path,'r+') as toml_file:
-                data = toml.load(instances_path, _dict=dict)
-        data['properties']['parameters'] = {key for key,_ in params_list[0].items()}
-        data['properties']['time'] = str(datetime.now())    
-        for path, parameter in zip(paths, params_list):
-            parameter_cb = []
-            for key,value in parameter.items():
-                parameter_cb.append(value)
-            check_keys = list(data['instances'].keys()) # to make it hashable
-            if str(parameter_cb) not in check_keys:
-                data['instances'][str(parameter_cb)] = os.path.dirname(os.path.dirname(path)) + r'\\instances\\' + str(parameter_cb) + r'.toml'
-                cls._write_instance(parameter_cb, path, io_handler)
-        with open(instances_path,'w+') as toml_file:
-            toml.dump(data, toml_file)
+    def _write_instances(cls, metadata, params_list, paths, io_handler, positions=None, base_testrun=None):
+        # params_list: ParameterSample of the points, written in one add_instances. Returns the instance key of every point.
+        # Instances without testrun keep the base testrun and parameters they are rendered from (see TestrunStore)
+        properties = {'parameters': list(io_handler.params), 'time': str(datetime.now())}
+        if positions is not None:
+            properties['positions'] = cls._position_indexes(metadata.read_properties())
+            known = properties['positions'].setdefault(cls._signature(io_handler.params), {})
+        check_keys = set(metadata.instance_keys())
+        new_instances = {}
+        keys = []
+        for index, (path, parameter_cb) in enumerate(zip(paths, params_list.values().tolist())):
+            key = instance_key(parameter_cb)
+            keys.append(key)
+            if positions is not None:
+                known[positions[index]] = key
+            if key not in check_keys and key not in new_instances:
+                new_instances[key] = cls._write_instance(parameter_cb, path, io_handler)
+                if base_testrun is not None:
+                    new_instances[key]['properties'].update(base_testrun=base_testrun, parameters=params_list.names)
+                if positions is not None:
+                    new_instances[key]['properties']['position'] = positions[index]
+        metadata.write_properties(properties)
+        metadata.add_instances(new_instances)
+        return keys
 
     @staticmethod 
     def _write_instance(parameter_cb, path, io_handler):
@@ -83,34 +175,103 @@ class Basediscretizer():
         data['results']['ipgresult'] = ''
         data['results']['yolov5'] = ''
         data['results']['safetyscore'] = ''
-        with open(instance_path,'w+') as toml_file:
-            toml.dump(data, toml_file)
+        return data
 
     @staticmethod
-    def _write_grid(testrun_dir_path, grid_ID, params_list):
-        grid_path = os.path.dirname(testrun_dir_path) + '\\grid{:02}.toml'.format(grid_ID)
-        instances_path = os.path.dirname(testrun_dir_path) + '\\instances.toml'
-        with open(instances_path, 'r') as toml_file:
-            instances = toml.load(toml_file)
-            instances_path_dic = instances['instances']
-    
-        with open(grid_path,'w+') as toml_file:
-            data = {
-            "title": os.path.basename(grid_path),
-            'properties':{},
-            'instances':{},
-            'evaluation':{}
-            }
-            data['properties']['parameters'] = {key for key,_ in params_list[0].items()}
-            data['properties']['time'] = str(datetime.now())
-            data['evaluation']['p'] = ''
-            data['evaluation']['GCI'] = ''
-            data['evaluation']['p_sum'] = ''
-            data['evaluation']['points_x'] = ''
-            for parameter in params_list:
-                parameter_cb = []
-                for key, value in parameter.items():
-                    parameter_cb.append(value)
-                    data['instances'][str(parameter_cb)] = instances_path_dic[str(parameter_cb)]
-            toml.dump(data, toml_file)
-        return grid_path
\ No newline at end of file
+    def _write_grid(metadata, grid_ID, names, keys):
+        grid_path = metadata.grid_path(grid_ID)
+        data = {
+        "title": os.path.basename(grid_path),
+        'properties':{},
+        'instances':{},
+        'evaluation':{}
+        }
+        data['properties']['parameters'] = list(names)
+        data['properties']['time'] = str(datetime.now())
+        data['evaluation']['p'] = ''
+        data['evaluation']['GCI'] = ''
+        data['evaluation']['p_sum'] = ''
+        data['evaluation']['points_x'] = ''
+        for key in keys:
+            data['instances'][key] = metadata.instance_path(key)
+        metadata.write_grid(grid_path, data)
+        return grid_path
+
+
+class GridInstances():
+    # [{'instance_path': ..., 'instance_parameters': ...}] of a grid, built on access.
+    # Paths of points linked from coarser grids are only read from the metadata when they are needed.
+    def __init__(self, params_list, keys, new_paths, metadata):
+        self._params_list = params_list
+        self._keys = keys
+        self._new_paths = new_paths
+        self._metadata = metadata
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, id):
+        if id < 0:
+            id += len(self)
+        if not 0 <= id < len(self):
+            raise IndexError('grid instance index out of range')
+        path = self._new_paths.get(id)
+        if path is None:
+            path = self._metadata.read_instance(self._keys[id])['properties']['path']
+        return {'instance_path': path, 'instance_parameters': self._params_list[id]}
+
+    def __iter__(self):
+        for id in range(len(self)):
+            yield self[id]
+
+
+class ParameterSample():
+    # Points as one (n, n_params) array, sample[id] builds the {xpath: value} dict of one point
+    def __init__(self, names, values):
+        self.names = list(names)
+        self.array = np.asarray(values, dtype=float).reshape(-1, len(self.names))
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, id):
+        id = int(id)
+        if id < 0:
+            id += len(self)
+        if not 0 <= id < len(self):
+            raise IndexError('sample index out of range')
+        return dict(zip(self.names, self.array[id].tolist()))
+
+    def __iter__(self):
+        for row in self.array.tolist():
+            yield dict(zip(self.names, row))
+
+    def values(self, start=0, stop=None):
+        return self.array[start:stop]
+
+
+class GridPositions():
+    # Positions of the points of a tensor-product grid ('1/2,0'), built from the index of the point along every
+    # axis. The fractions are only formatted once per axis.
+    def __init__(self, discrete_params):
+        self.axes = [[str(Fraction(i, n - 1)) if n > 1 else '0' for i in range(n)] for n in discrete_params]
+        self.shape = tuple(discrete_params)
+
+    def __len__(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def __getitem__(self, id):
+        if isinstance(id, slice):
+            start, stop, step = id.indices(len(self))
+            indices = np.stack(np.unravel_index(np.arange(start, stop, step, dtype=np.int64), self.shape), axis=1)
+            return [','.join(axis[index] for axis, index in zip(self.axes, row)) for row in indices.tolist()]
+        id = int(id)
+        if id < 0:
+            id += len(self)
+        if not 0 <= id < len(self):
+            raise IndexError('position index out of range')
+        return ','.join(axis[index] for axis, index in zip(self.axes, np.unravel_index(id, self.shape)))
+
+    def __iter__(self):
+        for start in range(0, len(self), 65536):
+            yield from self[start:start + 65536]
@@ -1,8 +1,6 @@
-from SALib.sample import fast_sampler
-
 from Discretizers.discretizer_base import Basediscretizer
 import numpy as np
-import copy
+import itertools
 
 class FastDiscretizer(Basediscretizer):
 
@@ -30,19 +28,7 @@ def create_discrete_problem(params):
     return problem
 
 def create_param_values(problem, discrete_params):
-    param_values = []
-    for i, (bound, discrete_param) in enumerate(zip(problem['bounds'], discrete_params)):
-        aa = np.linspace(bound[0],bound[1], discrete_param)
-        aa = list(map(float, aa))
-        if i == 0:
-            for item1 in aa:
-                param_values.append([item1])
-
-        if i > 0:
-            param_values_sum = copy.deepcopy(param_values)
-            for item2 in param_values_sum:
-                param_values.remove(item2)
-                for item1 in aa:
-                    cc = item2 + [item1]
-                    param_values.append(cc)
-    return param_values
\ No newline at end of file
+    # Cartesian product, the first parameter varies slowest
+    axes = [list(map(float, np.linspace(bound[0], bound[1], discrete_param)))
+            for bound, discrete_param in zip(problem['bounds'], discrete_params)]
+    return [list(values) for values in itertools.product(*axes)]
@@ -0,0 +1,90 @@
+from Discretizers.discretizer_base import Basediscretizer, ParameterSample
+from MetadataStores.tomlfiles import TomlStore
+from datetime import datetime
+import warnings
+import numpy as np
+import utils
+
+class SamplingDiscretizer(Basediscretizer):
+    # Samples of all parameters instead of a tensor grid, so the number of simulations does not grow with the number
+    # of parameters. Grid k has base_samples * 2**(k-1) points, or 'samples'. 'sobol', 'halton' (scrambled, scipy.stats.qmc)
+    # and 'random' are sequences: grid k starts with the points of grid k-1 and only the new ones get a testrun.
+    # 'lhs' draws a new Latin hypercube for every sample size.
+    # distributions: {xpath: scipy.stats distribution or 'norm(50, 5)'}, truncated to the bounds of the param file.
+    # Parameters without one are uniform between their bounds. A study keeps its method, seed and distributions,
+    # samples are only reused by param files with the same parameters and bounds.
+    METHODS = ('sobol', 'halton', 'lhs', 'random')
+
+    @classmethod
+    def generate_instances(cls, io_handler, grid_ID, target_path_pattern='%p%/%f_%y-%m-%d-%H-%M_%g%/%f.%x%e', store=TomlStore,
+                           method='sobol', base_samples=16, samples=None, seed=0, distributions=None, workers=1, testruns='write'):
+        if method not in cls.METHODS:
+            raise ValueError(f'unknown sampling method {method}, use one of {cls.METHODS}')
+        n = samples if samples is not None else base_samples * 2**(grid_ID - 1)
+        date = datetime.now()
+        metadata = store(cls._study_dir(io_handler, target_path_pattern, grid_ID, date))
+        cls._check_sampling(metadata, method, seed, distributions)
+        params_list = ParameterSample(io_handler.params, sample(io_handler.params, n, method, seed, distributions))
+        # position of a point in the sequence, an lhs point only belongs to the hypercube of its size
+        prefix = f'{method}:{seed}:' if method != 'lhs' else f'{method}:{seed}:{n}:'
+        positions = [prefix + str(id) for id in range(n)]
+        return cls._generate_grid(io_handler, grid_ID, params_list, positions, metadata, target_path_pattern, date, workers, testruns)
+
+    @staticmethod
+    def _check_sampling(metadata, method, seed, distributions):
+        # points of earlier grids are only reused if they come from the same sequence
+        sampling = {'method': method, 'seed': seed, 'distributions': {xpath: distribution_spec(dist) for xpath, dist in (distributions or {}).items()}}
+        previous = metadata.read_properties().get('sampling')
+        if previous is not None and previous != sampling:
+            raise ValueError(f'{metadata.study_dir} was sampled with {previous}, not {sampling}')
+        metadata.write_properties({'sampling': sampling})
+
+
+def sample(params, n, method='sobol', seed=0, distributions=None):
+    # (n, n_params) values, rows in sequence order, so the first rows of n + m samples are the n samples
+    from scipy.stats import qmc
+    d = len(params)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning) # Sobol' balance is only exact for powers of 2
+        if method == 'sobol':
+            unit = qmc.Sobol(d, seed=seed).random(n)
+        elif method == 'halton':
+            unit = qmc.Halton(d, seed=seed).random(n)
+        elif method == 'lhs':
+            unit = qmc.LatinHypercube(d, seed=seed).random(n)
+        else:
+            unit = np.random.default_rng(seed).random((n, d))
+    return scale(unit, params, distributions)
+
+def scale(unit, params, distributions=None):
+    # points of the unit cube to parameter values: linear between the bounds, or through the inverse cdf of the
+    # distribution restricted to the bounds
+    distributions = distributions or {}
+    bounds = np.array(list(params.values()), dtype=float)[:, :2]
+    values = bounds[:, 0] + unit * (bounds[:, 1] - bounds[:, 0])
+    for dim, xpath in enumerate(params):
+        if xpath in distributions:
+            dist = distribution(distributions[xpath])
+            low, high = dist.cdf(bounds[dim])
+            values[:, dim] = np.clip(dist.ppf(low + unit[:, dim] * (high - low)), *bounds[dim])
+    return values
+
+def distribution(dist):
+    # frozen scipy.stats distribution of 'name(arg, ..., key=value)', e.g. 'norm(50, 5)' or 'truncnorm(-1, 1, loc=50)'
+    if not isinstance(dist, str):
+        return dist
+    name, arguments = dist.strip().rstrip(')').split('(', 1)
+    args, kwds = [], {}
+    for argument in filter(None, (argument.strip() for argument in arguments.split(','))):
+        if '=' in argument:
+            key, value = argument.split('=', 1)
+            kwds[key.strip()] = float(value)
+        else:
+            args.append(float(argument))
+    return utils.DISTRIBUTIONS[name.strip()](*args, **kwds)
+
+def distribution_spec(dist):
+    # inverse of distribution(), stored in the study properties
+    dist = distribution(dist)
+    arguments = [repr(float(arg)) for arg in dist.args] + [f'{key}={float(value)!r}' for key, value in dist.kwds.items()]
+    return f'{dist.dist.name}({",".join(arguments)})'
@@ -0,0 +1,44 @@
+from Discretizers.discretizer_base import Basediscretizer, ParameterSample
+from Discretizers.fastdiscretizer import create_discrete_problem
+from MetadataStores.base import instance_key
+from MetadataStores.tomlfiles import TomlStore
+from datetime import datetime
+import os
+
+class ScreeningDiscretizer(Basediscretizer):
+    # Cheap sample of all parameters for SensitivityEvaluater, before the expensive grids are generated.
+    # 'morris' draws 'samples' trajectories of elementary effects (samples * (n_params + 1) points), 'fast' the search
+    # curves of FAST (samples * n_params points, samples > 4 * M**2). The study goes into its own directory
+    # ('screening' next to the testrun). The order of the samples, which the analysis needs, and the SALib problem are
+    # kept in 'screening' of the grid properties.
+    METHODS = ('morris', 'fast')
+
+    @classmethod
+    def generate_instances(cls, io_handler, grid_ID=1, target_path_pattern='%p%/screening%/%f_%y-%m-%d-%H-%M_%g%/%f.%x%e', store=TomlStore,
+                           method='morris', samples=10, num_levels=4, M=4, seed=0, workers=1, testruns='write'):
+        if method not in cls.METHODS:
+            raise ValueError(f'unknown screening method {method}, use one of {cls.METHODS}')
+        problem = create_discrete_problem(io_handler.params)
+        params_list = ParameterSample(problem['names'], screening_sample(problem, method, samples, num_levels, M, seed))
+        date = datetime.now()
+        study_dir = cls._study_dir(io_handler, target_path_pattern, grid_ID, date)
+        os.makedirs(study_dir, exist_ok=True)
+        metadata = store(study_dir)
+        # position of a point in the sample, num_levels and M change the sample as well
+        setting = num_levels if method == 'morris' else M
+        positions = [f'{method}:{seed}:{samples}:{setting}:{id}' for id in range(len(params_list))]
+        instances, grid_path = cls._generate_grid(io_handler, grid_ID, params_list, positions, metadata, target_path_pattern, date, workers, testruns)
+        screening = {'method': method, 'samples': samples, 'num_levels': num_levels, 'M': M, 'seed': seed,
+                     'names': problem['names'], 'bounds': problem['bounds'],
+                     'keys': [instance_key(parameter.values()) for parameter in params_list]} # one per sample, in SALib order
+        metadata.update_grid(grid_path, {'properties': {'screening': screening}})
+        return instances, grid_path
+
+
+def screening_sample(problem, method='morris', samples=10, num_levels=4, M=4, seed=0):
+    # (n, n_params) values in the order SALib analyzes them
+    if method == 'morris':
+        from SALib.sample import morris
+        return morris.sample(problem, samples, num_levels=num_levels, seed=seed)
+    from SALib.sample import fast_sampler
+    return fast_sampler.sample(problem, samples, M=M, seed=seed)
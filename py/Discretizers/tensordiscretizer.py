@@ -0,0 +1,59 @@
+from Discretizers.discretizer_base import Basediscretizer
+import numpy as np
+
+class TensorDiscretizer(Basediscretizer):
+    # Tensor-product grid over all parameters of the param file, every parameter with its own refinement level.
+    # levels: {xpath: level} or [level, ...] in param file order, missing parameters use grid_ID.
+
+    @staticmethod
+    def _discrete_params(params, grid_ID, levels=None):
+        if levels is None:
+            levels = {}
+        if not isinstance(levels, dict):
+            levels = dict(zip(params, levels))
+        return [2**(levels.get(xpath, grid_ID)-1)+1 for xpath in params]
+
+    @classmethod
+    def _discrete(cls, params, discrete_params):
+        return ParameterGrid(params, discrete_params)
+
+
+class ParameterGrid():
+    # Points of a tensor-product grid in the order of itertools.product (first parameter varies slowest).
+    # Only the axes are stored: grid[id] builds the {xpath: value} dict of one point,
+    # values() / chunks() return the points as (n, n_params) arrays, which is what generate_instances reads.
+    def __init__(self, params, discrete_params):
+        self.names = list(params)
+        self.axes = [np.linspace(bound[0], bound[1], discrete_param) for bound, discrete_param in zip(params.values(), discrete_params)]
+        self.names = self.names[:len(self.axes)]
+        self.shape = tuple(len(axis) for axis in self.axes)
+
+    def __len__(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def __getitem__(self, id):
+        id = int(id)
+        if id < 0:
+            id += len(self)
+        if not 0 <= id < len(self):
+            raise IndexError('grid index out of range')
+        indices = np.unravel_index(id, self.shape)
+        return {name: float(axis[index]) for name, axis, index in zip(self.names, self.axes, indices)}
+
+    def __iter__(self):
+        for values in self.chunks():
+            for row in values.tolist():
+                yield dict(zip(self.names, row))
+
+    def indices(self, start=0, stop=None):
+        # (n, n_params) integer index of every point along each axis
+        stop = len(self) if stop is None else min(stop, len(self))
+        return np.stack(np.unravel_index(np.arange(start, stop, dtype=np.int64), self.shape), axis=1)
+
+    def values(self, start=0, stop=None):
+        indices = self.indices(start, stop)
+        return np.stack([axis[indices[:, dim]] for dim, axis in enumerate(self.axes)], axis=1)
+
+    def chunks(self, size=65536):
+        for start in range(0, len(self), size):
+            yield self.values(start, start + size)
@@ -1,83 +1,111 @@
 from Evaluaters.base import Baseevaluater
+from MetadataStores.base import grid_name
+from MetadataStores.tomlfiles import TomlStore
 
-import math
-import toml
-import os
 import numpy as np
-import matplotlib.pyplot as plt 
-from scipy.interpolate import interp1d 
 
 class GCIEvaluater(Baseevaluater):
+    _scores = {} # (store, study_dir, instance key) -> (version, (x, safety score)) of scored instances, shared by all grids of a study
+
+    @classmethod
+    def _evaluation(cls, grid_path, para_range:list, store=TomlStore):
+        metadata = store.from_grid_path(grid_path)
+        grid_num = cls._grid_num(grid_path)
+        points = [cls._parse_toml(metadata.grid_path(num), metadata) for num in (grid_num-2, grid_num-1, grid_num)]
+        p_set, GCI_set, p_sum, points_x = cls._evaluate_level(points, grid_num, para_range)
+        cls._add_toml(grid_path, p_set, GCI_set, p_sum, points_x, metadata)
+
+    @classmethod
+    def evaluation_all(cls, grid_path, para_range:list, store=TomlStore):
+        # evaluates grid03 up to grid_path in one pass, every grid is read once
+        metadata = store.from_grid_path(grid_path)
+        grid_num = cls._grid_num(grid_path)
+        points = {num: cls._parse_toml(metadata.grid_path(num), metadata) for num in range(1, grid_num + 1)}
+        for num in range(3, grid_num + 1):
+            p_set, GCI_set, p_sum, points_x = cls._evaluate_level([points[num-2], points[num-1], points[num]], num, para_range)
+            cls._add_toml(metadata.grid_path(num), p_set, GCI_set, p_sum, points_x, metadata)
+
+    @classmethod
+    def clear_cache(cls):
+        cls._scores.clear()
+
+    @classmethod
+    def invalidate(cls, metadata, keys):
+        # forget the scores of instances that were scored again
+        prefix = (type(metadata).__name__, metadata.study_dir)
+        for key in keys:
+            cls._scores.pop(prefix + (key,), None)
+
+    @staticmethod
+    def _grid_num(grid_path):
+        return int(grid_name(grid_path).split('grid')[1][0:2])
+
     @classmethod
-    def _evaluation(cls, grid_path, para_range:list):
-        path03 = grid_path
-        path_dir = os.path.dirname(path03)
-        path_base = os.path.basename(path03)
-        grid_num = int(path_base.split('grid')[1][0:2])
-        path_base02 = 'grid' + '{:02}'.format(grid_num-1) + '.toml'
-        path_base01 = 'grid' + '{:02}'.format(grid_num-2) + '.toml'
-        path02 = os.path.join(path_dir, path_base02) 
-        path01 = os.path.join(path_dir, path_base01)
-        path_set = [path01, path02, path03]
+    def _evaluate_level(cls, points, grid_num, para_range):
+        # points: (x, y) of grid k-2, k-1 and k, interpolated on the 2**(k-1)+1 points of uniform grid k
         n = 2**(grid_num-1)+1
-        points = []
         points_intp = []
-        for path in path_set:
-            points.append(cls._parse_toml(path))
         for point in points:
             points_x, points_y = cls._interpolation(point[0], point[1], n, para_range)
             points_intp.append(points_y)
-        p_set, GCI_set, p_sum, points_x = cls.points_GCI(points_intp, points_x)
-        cls._add_toml(grid_path, p_set, GCI_set, p_sum, points_x)
-        
+        return cls.points_GCI(points_intp, points_x, present=points[2][0])
+
+    @classmethod
+    def _parse_toml(cls, grid_path, metadata):
+        # x and safety score of the grid instances, sorted by x. Scored instances are only read again once they were written.
+        prefix = (type(metadata).__name__, metadata.study_dir)
+        keys = list(metadata.read_grid(grid_path)['instances'])
+        versions = metadata.instance_versions(keys)
+        points = []
+        for key in keys:
+            cached = cls._scores.get(prefix + (key,))
+            if cached is not None and cached[0] == versions[key]:
+                point = cached[1]
+            else:
+                instance = metadata.read_instance(key)
+                point = (instance['properties']['parameter_cb'][0], float(instance['results']['safetyscore']))
+                if instance['properties']['sc_result'] == 1 and versions[key] is not None:
+                    cls._scores[prefix + (key,)] = (versions[key], point)
+                else:
+                    cls._scores.pop(prefix + (key,), None)
+            points.append(point)
+        return cls._sorted(points)
+
     @staticmethod
-    def _parse_toml(grid_path):
-        with open(grid_path) as toml_file:
-            x = []
-            y = []
-            grid = toml.load(toml_file)
-            for key, value in grid['instances'].items():
-                with open(value, 'r') as toml_file:
-                    instance = toml.load(toml_file)
-                    x.append(instance['properties']['parameter_cb'][0])
-                    y.append(float(instance['results']['safetyscore'])) 
-        return x, y
+    def _sorted(points):
+        x, y = np.array(points, dtype=float).reshape(-1, 2).T
+        order = np.argsort(x, kind='stable')
+        return x[order], y[order]
 
     @staticmethod
-    def _add_toml(grid_path, p_set, GCI_set, p_sum, points_x):
-        with open(grid_path) as toml_file:
-            grid = toml.load(toml_file)
-        with open(grid_path, 'w+') as toml_file:
-            grid['evaluation']['p'] = p_set
-            grid['evaluation']['GCI'] = GCI_set
-            grid['evaluation']['p_sum'] = p_sum
-            grid['evaluation']['points_x'] = points_x
-            toml.dump(grid, toml_file)
+    def _add_toml(grid_path, p_set, GCI_set, p_sum, points_x, metadata):
+        metadata.update_grid(grid_path, {'evaluation': {'p': p_set, 'GCI': GCI_set, 'p_sum': p_sum, 'points_x': points_x}})
 
     @staticmethod
     def _interpolation(x, y, n, para_range):
-        fx = interp1d(x, y, kind='linear')
+        # piecewise linear like interp1d, x has to be sorted
         xInterp = np.linspace(para_range[0], para_range[1],n) ######
-        yInterp = fx(xInterp)
+        yInterp = np.interp(xInterp, x, y)
         return xInterp, yInterp
-    
+
     @classmethod
-    def points_GCI(cls, points_y, points_x):
-        GCI_set = []
-        p_set = []
-        p_sum = cls.asy_range(sum(points_y[0]), sum(points_y[1]), sum(points_y[2]))
-        for i in range(1, len(points_y[0]), 2):
-            p = cls.asy_range(points_y[0][i], points_y[1][i], points_y[2][i])
-            GCI = cls.GCI(points_y[2][i], points_y[1][i], p)
-            p_set.append(p)
-            GCI_set.append(GCI)
-        points_x = [float(i) for i in points_x[1::2]]
-        return p_set, GCI_set, p_sum, points_x
+    def points_GCI(cls, points_y, points_x, present=None):
+        # points_y: values of grid k-2, k-1 and k on the points of grid k, evaluated at the new points of grid k.
+        # present: x of grid k, new points it does not contain (adaptive grids) are skipped
+        points_y = np.asarray(points_y, dtype=float)
+        points_x = np.asarray(points_x, dtype=float)
+        new = np.arange(1, points_y.shape[1], 2)
+        if present is not None:
+            new = new[_contains(np.asarray(present, dtype=float), points_x[new])]
+        f3, f2, f1 = points_y[:, new]
+        p_set = observed_order(f3, f2, f1)
+        GCI_set = f1 - f2
+        p_sum = cls.asy_range(*points_y.sum(axis=1))
+        return p_set.tolist(), GCI_set.tolist(), p_sum, points_x[new].tolist()
 
     @staticmethod
     def asy_range(f3, f2, f1):
-        p = math.log(abs(f3-f2)/abs(f2-f1))/math.log(2)
-        return float(p)
+        return float(observed_order(f3, f2, f1))
     
     @staticmethod
     def GCI(f_h, f_rh, p, fs=1.25):
@@ -87,5 +115,23 @@ class GCIEvaluater(Baseevaluater):
         except:
             GCI = 0
         return float(GCI)
-    
-                    
\ No newline at end of file
+
+
+def observed_order(f3, f2, f1):
+    # p = ln(|f3-f2|/|f2-f1|)/ln(2), nan where two grids give the same value (the order is undefined there)
+    d32 = np.abs(np.subtract(f3, f2, dtype=float))
+    d21 = np.abs(np.subtract(f2, f1, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.log2(d32 / d21)
+    return np.where((d32 == 0) | (d21 == 0), np.nan, p)
+
+def _contains(values, x, rtol=1e-05, atol=1e-08):
+    # for every x, is there a close value (np.isclose) in values
+    if not len(values):
+        return np.zeros(len(x), dtype=bool)
+    values = np.sort(values)
+    padded = np.concatenate([values[:1], values, values[-1:]])
+    index = np.searchsorted(values, x) + 1 # padded[index - 1] <= x <= padded[index]
+    below = np.abs(x - padded[index - 1]) <= atol + rtol * np.abs(padded[index - 1])
+    above = np.abs(x - padded[index]) <= atol + rtol * np.abs(padded[index])
+    return below | above
@@ -1,14 +1,16 @@
 from abc import abstractmethod
 import os
 import toml
+import tracing
 
 class Baseevaluater():
     def __init__(self) -> None:
         pass
     
     @classmethod    
-    def evaluation(cls, grid_path, para_range):
-        cls._evaluation(grid_path, para_range)
+    def evaluation(cls, grid_path, para_range, **evaluater_kwargs):
+        with tracing.span(f'{cls.__name__}.evaluation', 'evaluation'):
+            cls._evaluation(grid_path, para_range, **evaluater_kwargs)
     
     @classmethod
     @abstractmethod
@@ -0,0 +1,69 @@
+from Evaluaters.base import Baseevaluater
+from MetadataStores.tomlfiles import TomlStore
+
+import numpy as np
+import toml
+import warnings
+
+class SensitivityEvaluater(Baseevaluater):
+    # Sensitivity of the safety score to every parameter, from a scored ScreeningDiscretizer grid. '[evaluation]' of
+    # the grid gets 'mu_star', 'sigma' and 'mu_star_conf' (morris) or 'S1' and 'ST' (fast), and 'importance': mu_star or
+    # ST relative to the most influential parameter. ST also counts interactions, so FAST keeps more parameters than
+    # morris when the score jumps (a detection is lost). para_range is not used.
+
+    @classmethod
+    def _evaluation(cls, grid_path, para_range=None, store=TomlStore, num_resamples=100):
+        metadata = store.from_grid_path(grid_path)
+        screening = metadata.read_grid(grid_path)['properties']['screening']
+        problem = {'num_vars': len(screening['names']), 'names': screening['names'], 'bounds': screening['bounds']}
+        instances = metadata.grid_instances(grid_path)
+        unscored = [key for key, instance in instances.items() if instance['properties']['sc_result'] != 1]
+        if unscored:
+            raise ValueError(f'{len(unscored)} instances of {grid_path} are not scored yet, e.g. {unscored[0]}')
+        keys = screening['keys']
+        X = np.array([instances[key]['properties']['parameter_cb'] for key in keys], dtype=float)
+        Y = np.array([float(instances[key]['results']['safetyscore']) for key in keys])
+        if screening['method'] == 'morris':
+            from SALib.analyze import morris
+            result = morris.analyze(problem, X, Y, num_resamples=num_resamples, num_levels=screening['num_levels'], seed=screening['seed'])
+            evaluation = {field: np.asarray(result[field], dtype=float) for field in ('mu_star', 'sigma', 'mu_star_conf')}
+            index = evaluation['mu_star']
+        else:
+            from SALib.analyze import fast
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning) # about S1_conf and ST_conf, which are not kept
+                result = fast.analyze(problem, Y, M=screening['M'], num_resamples=num_resamples, seed=screening['seed'])
+            evaluation = {field: np.asarray(result[field], dtype=float) for field in ('S1', 'ST')}
+            index = evaluation['ST']
+        index = np.nan_to_num(np.abs(index))
+        evaluation['importance'] = index / index.max() if index.max() > 0 else np.zeros_like(index)
+        evaluation = {field: values.tolist() for field, values in evaluation.items()}
+        metadata.update_grid(grid_path, {'evaluation': dict(evaluation, sensitivity=screening['method'], names=screening['names'])})
+
+    @staticmethod
+    def importance(grid_path, store=TomlStore):
+        # {xpath: importance} of an evaluated screening grid, most influential first
+        evaluation = store.from_grid_path(grid_path).read_grid(grid_path)['evaluation']
+        return dict(sorted(zip(evaluation['names'], evaluation['importance']), key=lambda item: -item[1]))
+
+    @classmethod
+    def influential(cls, grid_path, threshold=0.1, store=TomlStore):
+        return [xpath for xpath, importance in cls.importance(grid_path, store).items() if importance >= threshold]
+
+    @classmethod
+    def levels(cls, grid_path, max_level, threshold=0.1, store=TomlStore):
+        # {xpath: level} for TensorDiscretizer: the most influential parameter gets max_level, the others less in
+        # proportion to their importance, parameters below threshold level 1 (their bounds only)
+        return {xpath: 1 + round((max_level - 1) * importance) if importance >= threshold else 1
+                for xpath, importance in cls.importance(grid_path, store).items()}
+
+    @classmethod
+    def write_param_file(cls, grid_path, param_file_path, threshold=0.1, store=TomlStore):
+        # .param file with the influential parameters only, the others keep their value of the testrun
+        screening = store.from_grid_path(grid_path).read_grid(grid_path)['properties']['screening']
+        bounds = dict(zip(screening['names'], screening['bounds']))
+        params = {xpath: f'{bounds[xpath][0]}, {bounds[xpath][1]}' for xpath in screening['names']
+                  if xpath in cls.influential(grid_path, threshold, store)}
+        with open(param_file_path, 'w') as param_file:
+            toml.dump(params, param_file)
+        return param_file_path
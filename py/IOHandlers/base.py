@@ -1,14 +1,16 @@
 from abc import abstractmethod
 import toml
 import re
-from utils import DISTRIBUTIONS, RandomList
+import utils
 import os
+import tracing
 
 class BaseHandler():
     def __init__(self, data_file_path=None, param_file_path=None):
         self.data_file_path = data_file_path
         if self.data_file_path is not None:
-            self.data = self.load_data_file(self.data_file_path)
+            with tracing.span(f'{type(self).__name__}.load_data_file', 'io'):
+                self.data = self.load_data_file(self.data_file_path)
 
         self.param_file_path = param_file_path
         if self.param_file_path is not None:
@@ -37,10 +39,10 @@ class BaseHandler():
                 match = re.findall(r'(.*?)\((.*)\)', value)  # match distribution declaration
                 if match:
                     arguments = [float(x) for x in argument_string.split(',')]
-                    param_value = DISTRIBUTIONS[distribution](*arguments)  # generate distribution
+                    param_value = utils.DISTRIBUTIONS[distribution](*arguments)  # generate distribution
                     params[key] = param_value
             elif type(value) is list:
-                params[key] = RandomList(value)
+                params[key] = utils.RandomList(value)
         return params
     """
 
@@ -51,6 +53,11 @@ class BaseHandler():
             os.mkdir(directory)
         self.write_data(path)
 
+    def write_instances(self, params_list, paths, workers=1):
+        # handlers that can write many variants faster override this
+        for param_instances, path in zip(params_list, paths):
+            self._write_instance(param_instances, path)
+
     @abstractmethod
     def apply_param_instances_to_data(self):
         pass
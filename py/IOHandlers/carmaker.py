@@ -1,3 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
+import os
 import re
 
 from .base import BaseHandler
@@ -28,44 +32,123 @@ class CarMakerHandler(BaseHandler):
 
     def write_data(self, path):
         with open(path, 'w') as testrun_file:
-            testrun_file.write(self.data['#INFOFILE_HEADER'])
-            indentation = False  # This line is added by Para.Dis. Add indentation to the testrun file where it is needed.
-            for k, v in self.data.items():
-                if indentation == True:
-                    testrun_file.write('\t')
-                    _write_single_line(k, v, testrun_file)
-                    indentation = False
-                    continue
-                if k == '#INFOFILE_HEADER':
-                    continue
-                if type(v) is list and len(v):
-                    if v == [[]]:
-                        indentation = True
-                    if type(v[0]) is list:
-                        _write_multirow_line(k, v, testrun_file)
-                    else:
-                        _write_array(k, v, testrun_file)
-                else:
-                    _write_single_line(k, v, testrun_file)
+            testrun_file.write(_render_data(self.data))
+
+    def write_instances(self, params_list, paths, workers=1):
+        # all variants from one pre-rendered template, self.data is not changed
+        template = TestrunTemplate(self.data, params_list[0] if params_list else {})
+        template.write_many(params_list, paths, workers)
 
     def get_data_value(self, data_key):
         return self.data.xpath(data_key)[0]
 
 
-def _write_single_line(parameter_key, value, testrun_file):
-    testrun_file.write(f'{parameter_key} = {value}\n')
+class TestrunTemplate():
+    # Testrun rendered once, line by line. A variant only renders the lines of the varied parameters again,
+    # everything else is shared. The template keeps its own copy of the data.
+    def __init__(self, data, parameter_keys):
+        self._data = copy.deepcopy(data)
+        self.header = self._data['#INFOFILE_HEADER']
+        self._keys, self._lines, self._indented = [], [], []
+        for key, line, indented in _render_items(self._data):
+            self._keys.append(key)
+            self._lines.append(line)
+            self._indented.append(indented)
+        self._index = {key: index for index, key in enumerate(self._keys)}
+        self._slots = {}
+        for parameter_key in parameter_keys:
+            self._slot(parameter_key)
+
+    def _slot(self, parameter_key):
+        # (line index, data key, array indices) of a parameter key like 'Traffic.0.Init.Road[0]'
+        if parameter_key not in self._slots:
+            data_key, indices = _split_parameter_key(parameter_key)
+            self._slots[parameter_key] = (self._index[data_key], data_key, indices)
+        return self._slots[parameter_key]
+
+    def render(self, param_instances):
+        lines = list(self._lines)
+        values = {}
+        for parameter_key, value in param_instances.items():
+            index, data_key, indices = self._slot(parameter_key)
+            if not indices:
+                values[index] = (data_key, value)
+                continue
+            if index not in values:
+                values[index] = (data_key, copy.deepcopy(self._data[data_key]))
+            target = values[index][1]
+            for position in indices[:-1]:
+                target = target[position]
+            target[indices[-1]] = value
+        for index, (data_key, value) in values.items():
+            lines[index] = _render_item(data_key, value, self._indented[index])
+        return self.header + ''.join(lines)
+
+    def write(self, param_instances, path):
+        with open(path, 'w') as testrun_file:
+            testrun_file.write(self.render(param_instances))
+
+    def write_many(self, params_list, paths, workers=1):
+        for directory in {os.path.dirname(path) for path in paths}:
+            if not os.path.exists(directory):
+                os.mkdir(directory)
+        if workers <= 1:
+            for param_instances, path in zip(params_list, paths):
+                self.write(param_instances, path)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.write, params_list, paths))
+
+
+def _split_parameter_key(parameter_key):
+    # 'my.parameter[0][1]' -> ('my.parameter', [0, 1]), same as apply_param_instances_to_data
+    if '[' not in parameter_key:
+        return parameter_key, []
+    return re.findall('(.*?)\[', parameter_key)[0], list(map(int, re.findall('\[([0-9]+)\]', parameter_key)))
+
+
+def _render_data(data):
+    return data['#INFOFILE_HEADER'] + ''.join(line for _, line, _ in _render_items(data))
+
+
+def _render_items(data):
+    # (key, text, indented) of every parameter in file order
+    items = []
+    indentation = False  # This line is added by Para.Dis. Add indentation to the testrun file where it is needed.
+    for k, v in data.items():
+        if indentation == True:
+            items.append((k, _render_item(k, v, True), True))
+            indentation = False
+            continue
+        if k == '#INFOFILE_HEADER':
+            continue
+        if type(v) is list and v == [[]]:
+            indentation = True
+        items.append((k, _render_item(k, v, False), False))
+    return items
 
 
-def _write_multirow_line(parameter_key, value_matrix, testrun_file):
-    testrun_file.write(f'{parameter_key}:\n')
-    for value_row in value_matrix:
-        if len(value_row) == 0:
-            continue
-        testrun_file.write(f'\t{" ".join([str(value) for value in value_row])}\n')
+def _render_item(parameter_key, value, indented):
+    if indented:
+        return '\t' + _single_line(parameter_key, value)
+    if type(value) is list and len(value):
+        if type(value[0]) is list:
+            return _multirow_line(parameter_key, value)
+        return _array(parameter_key, value)
+    return _single_line(parameter_key, value)
+
 
+def _single_line(parameter_key, value):
+    return f'{parameter_key} = {value}\n'
 
-def _write_array(parameter_key, values, testrun_file):
-    testrun_file.write(f'{parameter_key} = {" ".join([str(value) for value in values])}\n')
+
+def _multirow_line(parameter_key, value_matrix):
+    rows = ''.join(f'\t{" ".join([str(value) for value in value_row])}\n' for value_row in value_matrix if len(value_row))
+    return f'{parameter_key}:\n' + rows
+
+
+def _array(parameter_key, values):
+    return f'{parameter_key} = {" ".join([str(value) for value in values])}\n'
 
 
 def _parse_carmaker_data(lines):
@@ -110,15 +193,19 @@ def _parse_multirow_line(line):
     return values
 
 
+# every string _parse_value turns into a number looks like this, others are strings without trying
+_NUMBER = re.compile(r'-?(\d+(\.\d+)?(e[+-]?\d+)?|inf|nan)')
+
+
+@functools.lru_cache(maxsize=65536)
 def _parse_value(value):
-    try:
-        if str(float(value)) == value:
-            return float(value)
-    except:
-        pass
+    if not _NUMBER.fullmatch(value):
+        return value  # value is assumed String
+    if str(float(value)) == value:
+        return float(value)
     try:
         if str(int(value)) == value:
             return int(value)
-    except:
+    except ValueError:
         pass
-    return value  # value is assumed String
+    return value
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import shutil
+
+from .carmaker import CarMakerHandler, TestrunTemplate
+
+
+class TestrunStore():
+    # Testruns of a study that keeps one base testrun instead of a testrun per instance ('testruns' of the
+    # discretizers set to 'lazy' or 'temporary'). The testrun of an instance is the base with the parameter
+    # combination of the instance applied, written to the instance path when it is simulated and, for 'temporary',
+    # removed once its result is in the metadata. Other studies have all testruns written, then nothing happens here.
+    # The base is named by the hash of the testrun ('<testrun>.<hash>.base'), an edited testrun gets a new base and
+    # every instance keeps the base and the parameters it was generated with.
+    MODES = ('write', 'lazy', 'temporary')
+
+    def __init__(self, metadata):
+        properties = metadata.read_properties()
+        self.metadata = metadata
+        self.base_path = properties.get('base_testrun')
+        self.mode = properties.get('testruns', 'write')
+        self.parameters = properties.get('parameters', [])
+        self._templates = {} # (base path, parameters) -> TestrunTemplate
+        self._written = {} # key -> testrun path written by this store
+
+    @classmethod
+    def write_base(cls, metadata, io_handler, mode):
+        # path of the base testrun of the current testrun, None if the testruns are written
+        if mode not in cls.MODES:
+            raise ValueError(f'testruns has to be one of {cls.MODES}, not {mode}')
+        if mode == 'write':
+            return None
+        with open(io_handler.data_file_path, 'rb') as testrun_file:
+            digest = hashlib.sha1(testrun_file.read()).hexdigest()[:12]
+        base_path = metadata.study_dir + '\\' + os.path.basename(io_handler.data_file_path) + '.' + digest + '.base'
+        if not os.path.exists(base_path):
+            shutil.copyfile(io_handler.data_file_path, base_path)
+        metadata.write_properties({'base_testrun': base_path, 'testruns': mode})
+        return base_path
+
+    def overrides(self, instance):
+        # {xpath: value} of the instance, everything else comes from the base testrun
+        return dict(zip(instance['properties'].get('parameters', self.parameters), instance['properties']['parameter_cb']))
+
+    def render(self, instance):
+        # content of the testrun of an instance, the same for every call. Instances written before the base was kept
+        # per instance use the base of the study.
+        base_path = instance['properties'].get('base_testrun', self.base_path)
+        parameters = instance['properties'].get('parameters', self.parameters)
+        template = self._templates.get((base_path, tuple(parameters)))
+        if template is None:
+            template = TestrunTemplate(CarMakerHandler(base_path, None).data, parameters)
+            self._templates[(base_path, tuple(parameters))] = template
+        return template.render(self.overrides(instance))
+
+    def text(self, instance):
+        # content of the testrun, read if it is written, newlines as '\n' in both cases
+        path = instance['properties']['path']
+        if self.base_path is None or os.path.exists(path):
+            with open(path) as testrun_file:
+                return testrun_file.read()
+        return self.render(instance)
+
+    def materialize(self, key, instance):
+        path = instance['properties']['path']
+        if self.base_path is None or os.path.exists(path):
+            return path
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as testrun_file:
+            testrun_file.write(self.render(instance))
+        self._written[key] = path
+        return path
+
+    def release(self, key):
+        path = self._written.pop(key, None)
+        if path is not None and self.mode == 'temporary' and os.path.exists(path):
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path)) # the grid directory, once its last testrun is gone
+            except OSError:
+                pass
+
+    def jobs(self, instances):
+        # (key, testrun path) of (key, instance) pairs, every testrun is written when the job is taken
+        for key, instance in instances:
+            yield key, self.materialize(key, instance)
@@ -0,0 +1,123 @@
+from abc import abstractmethod
+import copy
+import re
+
+
+def instance_key(parameter_cb):
+    # key of a parameter combination, the same string names the 'instances/[x].toml' file
+    return str(list(parameter_cb))
+
+def grid_name(grid_path):
+    return re.split(r'[\\/]', grid_path)[-1]
+
+def plain(value):
+    # toml accepts sets and numpy scalars, json does not
+    if isinstance(value, (set, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if hasattr(value, 'tolist'):  # numpy scalars and arrays
+        return value.tolist()
+    return value
+
+def merge(data, updates):
+    # nested update, only the given fields are replaced
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            merge(data[key], value)
+        else:
+            data[key] = copy.deepcopy(value)
+    return data
+
+
+class BaseStore():
+    def __init__(self, study_dir):
+        self.study_dir = study_dir
+
+    @classmethod
+    def from_grid_path(cls, grid_path):
+        return cls(grid_path[:-len(grid_name(grid_path)) - 1])
+
+    def grid_path(self, grid_ID):
+        return self.study_dir + '\\grid{:02}.toml'.format(grid_ID)
+
+    def instances_path(self):
+        return self.study_dir + '\\instances.toml'
+
+    def instance_path(self, key):
+        return self.study_dir + r'\\instances\\' + key + r'.toml'
+
+    def find_instance(self, parameter_cb):
+        key = instance_key(parameter_cb)
+        if key not in self.instance_keys():
+            return None
+        return self.read_instance(key)
+
+    def grid_instances(self, grid_path):
+        # {key: instance} of all instances of a grid, in grid order
+        grid = self.read_grid(grid_path)
+        return {key: self.read_instance(key) for key in grid['instances']}
+
+    def update_instances(self, updates):
+        # {key: updates}, stores that can write several instances at once override this
+        for key, instance_updates in updates.items():
+            self.update_instance(key, instance_updates)
+
+    def pending_instances(self, grid_path, flag):
+        # instances of a grid whose stage flag (e.g. 'ipg_result') is still 0
+        return {key: instance for key, instance in self.grid_instances(grid_path).items() if instance['properties'][flag] == 0}
+
+    def copy_to(self, target):
+        # used as importer/exporter between backends
+        target.write_properties(self.read_properties())
+        target.add_instances({key: self.read_instance(key) for key in self.instance_keys()})
+        for grid_path in self.grid_paths():
+            target.write_grid(grid_path, self.read_grid(grid_path))
+        return target
+
+    @abstractmethod
+    def read_properties(self):
+        pass
+
+    @abstractmethod
+    def write_properties(self, properties):
+        pass
+
+    @abstractmethod
+    def instance_keys(self):
+        pass
+
+    @abstractmethod
+    def read_instance(self, key):
+        pass
+
+    @abstractmethod
+    def add_instances(self, instances):
+        pass
+
+    @abstractmethod
+    def instance_versions(self, keys):
+        # {key: version}, the version changes whenever the instance is written (also by another process)
+        pass
+
+    @abstractmethod
+    def update_instance(self, key, updates):
+        pass
+
+    @abstractmethod
+    def grid_paths(self):
+        pass
+
+    @abstractmethod
+    def read_grid(self, grid_path):
+        pass
+
+    @abstractmethod
+    def write_grid(self, grid_path, data):
+        pass
+
+    @abstractmethod
+    def update_grid(self, grid_path, updates):
+        pass
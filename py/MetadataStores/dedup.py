@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+from IOHandlers.testruns import TestrunStore
+from MetadataStores.base import plain
+from MetadataStores.journal import StageJournal
+from MetadataStores.tomlfiles import TomlStore
+
+
+class ResultIndex():
+    # Results of simulation, detection and score shared by all studies, found by content hashes instead of
+    # instance keys. The simulation of an instance is identified by its testrun content (template and parameter
+    # values), out_quants and camera, the detection by the simulation and the detector, the score by the detection,
+    # out_quants and camera. CarMaker and YOLO are deterministic, so a hit is the result the stage would compute.
+    # Pngs and label files are kept in 'artifacts', least recently used entries are evicted above max_bytes.
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS results (hash TEXT PRIMARY KEY, stage TEXT, updates TEXT, artifact TEXT, size INTEGER, last_used REAL);
+    CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+    '''
+    STAGES = ('ipg_result', 'yolo_result', 'sc_result')
+    ARTIFACTS = {'ipg_result': 'ipgmovie', 'yolo_result': 'yolov5'} # results field holding the file of a stage
+
+    def __init__(self, index_dir, max_bytes=None):
+        self.index_dir = index_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(index_dir, 'artifacts'), exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(index_dir, 'index.sqlite'))
+        self._connection.executescript(self.SCHEMA)
+        self._file_hashes = {} # path -> (mtime, sha1)
+        self.hits = {stage: 0 for stage in self.STAGES}
+
+    def close(self):
+        self._connection.close()
+
+    def hashes(self, testrun_text, out_quants, camera_name, detector):
+        # {stage: hash} of one instance, every stage includes the hash of the stage before
+        simulation = _hash('ipg_result', testrun_text, list(out_quants), camera_name)
+        detection = _hash('yolo_result', simulation, detector)
+        score = _hash('sc_result', detection, list(out_quants), camera_name)
+        return {'ipg_result': simulation, 'yolo_result': detection, 'sc_result': score}
+
+    def detector_id(self, weights=None, **detector_kwargs):
+        # the weights are identified by their content, not their path
+        if weights is not None and os.path.exists(weights):
+            weights = self._file_hash(weights)
+        return {'weights': weights, **detector_kwargs}
+
+    def apply(self, grid_path, out_quants, camera_name, weights=None, store=TomlStore, **detector_kwargs):
+        # fills pending stages of the grid instances from the index, run before the stages. A stage is only
+        # taken over if the stages before it are finished, so every instance stays consistent.
+        metadata = store.from_grid_path(grid_path)
+        testruns = TestrunStore(metadata)
+        detector = self.detector_id(weights, **detector_kwargs)
+        journals = {stage: StageJournal(metadata, stage) for stage in self.STAGES}
+        for journal in journals.values():
+            journal.recover()
+        for key, instance in metadata.grid_instances(grid_path).items():
+            if all(instance['properties'][stage] == 1 for stage in self.STAGES):
+                continue
+            hashes = self.hashes(testruns.text(instance), out_quants, camera_name, detector)
+            for stage in self.STAGES:
+                if instance['properties'][stage] == 1:
+                    continue
+                updates = self._get(hashes[stage], stage, metadata)
+                if updates is None:
+                    break
+                journals[stage].commit(key, updates)
+                self.hits[stage] += 1
+        for journal in journals.values():
+            journal.clear()
+        self._connection.commit()
+
+    def publish(self, grid_path, out_quants, camera_name, weights=None, store=TomlStore, **detector_kwargs):
+        # adds the finished stages of the grid instances to the index, run after the stages
+        metadata = store.from_grid_path(grid_path)
+        testruns = TestrunStore(metadata)
+        detector = self.detector_id(weights, **detector_kwargs)
+        for instance in metadata.grid_instances(grid_path).values():
+            hashes = None
+            for stage in self.STAGES:
+                if instance['properties'][stage] != 1:
+                    break
+                hashes = hashes or self.hashes(testruns.text(instance), out_quants, camera_name, detector)
+                self._put(hashes[stage], stage, instance)
+        self._connection.commit()
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        # removes least recently used entries until the artifacts take at most max_bytes
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return
+        total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        rows = self._connection.execute('SELECT hash, artifact, size FROM results WHERE size > 0 ORDER BY last_used').fetchall()
+        with self._connection:
+            for result_hash, artifact, size in rows:
+                if total <= max_bytes:
+                    break
+                if os.path.exists(artifact):
+                    os.remove(artifact)
+                self._connection.execute('DELETE FROM results WHERE hash = ?', (result_hash,))
+                total -= size
+
+    def size(self):
+        return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def _get(self, result_hash, stage, metadata):
+        row = self._connection.execute('SELECT updates, artifact FROM results WHERE hash = ?', (result_hash,)).fetchone()
+        if row is None:
+            return None
+        updates, artifact = json.loads(row[0]), row[1]
+        if artifact:
+            if not os.path.exists(artifact):
+                self._connection.execute('DELETE FROM results WHERE hash = ?', (result_hash,))
+                return None
+            # the study gets its own link, so evicting the index never breaks a study
+            target = metadata.study_dir + '\\shared\\' + os.path.basename(artifact)
+            _link(artifact, target)
+            updates['results'][self.ARTIFACTS[stage]] = target
+        self._connection.execute('UPDATE results SET last_used = ? WHERE hash = ?', (time.time(), result_hash))
+        return updates
+
+    def _put(self, result_hash, stage, instance):
+        if self._connection.execute('SELECT 1 FROM results WHERE hash = ?', (result_hash,)).fetchone():
+            return
+        if stage == 'ipg_result':
+            updates = {'results': {'ipgmovie': '', 'ipgresult': instance['results']['ipgresult']}}
+        elif stage == 'yolo_result':
+            updates = {'results': {'yolov5': instance['results']['yolov5']}}
+        else:
+            updates = {'results': {'safetyscore': instance['results']['safetyscore']}}
+        artifact, size = '', 0
+        source = instance['results'].get(self.ARTIFACTS.get(stage, ''), '')
+        if source and os.path.exists(source):
+            artifact = os.path.join(self.index_dir, 'artifacts', result_hash + os.path.splitext(source)[1])
+            _link(source, artifact)
+            size = os.path.getsize(artifact)
+        elif stage == 'ipg_result':
+            return # without the png the simulation can not be shared
+        self._connection.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                 (result_hash, stage, json.dumps(plain(updates)), artifact, size, time.time()))
+
+    def _file_hash(self, path):
+        mtime = os.path.getmtime(path)
+        cached = self._file_hashes.get(path)
+        if cached is None or cached[0] != mtime:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as hashed_file:
+                for block in iter(lambda: hashed_file.read(1 << 20), b''):
+                    digest.update(block)
+            cached = (mtime, digest.hexdigest())
+            self._file_hashes[path] = cached
+        return cached[1]
+
+
+def _hash(*parts):
+    return hashlib.sha1(json.dumps(plain(list(parts)), sort_keys=True).encode('utf-8')).hexdigest()
+
+def _link(source, target):
+    # hard link if possible, the file is only stored once
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
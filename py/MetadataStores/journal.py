@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+
+from MetadataStores.base import plain
+import tracing
+
+
+class StageJournal():
+    # Append-only checkpoint of one pipeline stage (named by its flag, e.g. 'ipg_result').
+    # Results are journaled before they go into the metadata, so a killed run can apply finished
+    # work on restart instead of redoing it. Used as context manager, the journal is removed once
+    # the stage finished a grid without an exception.
+    def __init__(self, metadata, flag):
+        self.metadata = metadata
+        self.flag = flag
+        self.path = metadata.study_dir + '\\' + flag + '.journal'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.clear()
+
+    def pending(self, grid_path):
+        self.recover()
+        instances = self.metadata.pending_instances(grid_path, self.flag)
+        tracing.expect(self.flag, len(instances))
+        for key, instance in instances.items():
+            self._append({'event': 'begin', 'key': key})
+            yield key, instance
+
+    def begin(self, *keys):
+        tracing.expect(self.flag, len(keys))
+        self._append(*[{'event': 'begin', 'key': key} for key in keys])
+
+    def commit(self, key, updates):
+        updates = plain(updates)
+        updates.setdefault('properties', {})[self.flag] = 1
+        self._append({'event': 'done', 'key': key, 'updates': updates})
+        tracing.count(self.flag)
+        return self.metadata.update_instance(key, updates)
+
+    def commit_all(self, updates):
+        # {key: updates} of several instances, journaled with a single fsync and written in bulk
+        updates = {key: plain(instance_updates) for key, instance_updates in updates.items()}
+        for instance_updates in updates.values():
+            instance_updates.setdefault('properties', {})[self.flag] = 1
+        self._append(*[{'event': 'done', 'key': key, 'updates': instance_updates} for key, instance_updates in updates.items()])
+        self.metadata.update_instances(updates)
+        tracing.count(self.flag, len(updates))
+
+    def recover(self):
+        # applies finished but unsaved results, returns the keys that were interrupted while running
+        begun, done = [], {}
+        for entry in self.entries():
+            if entry['event'] == 'begin':
+                begun.append(entry['key'])
+            else:
+                done[entry['key']] = entry['updates']
+        keys = set(self.metadata.instance_keys())
+        for key, updates in done.items():
+            if key in keys:
+                self.metadata.update_instance(key, updates)
+        self.clear()  # everything finished is in the metadata now
+        return [key for key in begun if key not in done]
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue  # line was cut off by the interruption
+        return entries
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _append(self, *entries):
+        with open(self.path, 'a') as journal_file:
+            for entry in entries:
+                entry['time'] = str(datetime.now())
+                journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import numpy as np
+
+
+class ResultCache():
+    # Signals of every simulation, one uncompressed '.npz' per result with one array per signal.
+    # Results are addressed by the hash of the testrun file CarMaker simulated, which already holds the
+    # parameter combination, so the cache can be shared by studies and grids. np.load only reads the
+    # arrays that are accessed.
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._keys = {} # testrun path -> (mtime, key)
+
+    def key(self, testrun_path):
+        mtime = os.path.getmtime(testrun_path)
+        cached = self._keys.get(testrun_path)
+        if cached is None or cached[0] != mtime:
+            with open(testrun_path, 'rb') as testrun_file:
+                cached = (mtime, hashlib.sha1(testrun_file.read()).hexdigest())
+            self._keys[testrun_path] = cached
+        return cached[1]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, signals):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as result_file:
+            np.savez(result_file, **{name: np.asarray(samples) for name, samples in signals.items()})
+        os.replace(temp_path, path)
+
+    def get(self, key, names=None):
+        # {name: samples} of the result, None if it is not cached or misses one of the names
+        if key not in self:
+            return None
+        with np.load(self.path(key)) as result:
+            names = result.files if names is None else list(names)
+            if not set(names) <= set(result.files):
+                return None
+            return {name: result[name] for name in names}
+
+    def at(self, key, names, time=None, time_name='Time'):
+        # {name: value} at the given time (linear between samples), the last sample if time is None
+        signals = self.get(key, list(names) + ([time_name] if time is not None else []))
+        if signals is None:
+            return None
+        if time is None:
+            return {name: signals[name][-1] for name in names}
+        return {name: float(np.interp(time, signals[time_name], signals[name])) for name in names}
@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+
+from MetadataStores.base import BaseStore, grid_name, instance_key, plain
+from MetadataStores.tomlfiles import TomlStore
+
+
+class SqliteStore(BaseStore):
+    # all metadata of a study in one 'metadata.sqlite' next to where 'instances.toml' would be.
+    # Every field of an instance/grid is its own row, so updating a field never rewrites the rest.
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS properties (field TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS instances (key TEXT PRIMARY KEY, position INTEGER);
+    CREATE TABLE IF NOT EXISTS instance_fields (key TEXT, section TEXT, field TEXT, value TEXT, PRIMARY KEY (key, section, field));
+    CREATE TABLE IF NOT EXISTS instance_versions (key TEXT PRIMARY KEY, version INTEGER);
+    CREATE TABLE IF NOT EXISTS grids (name TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS grid_fields (name TEXT, section TEXT, field TEXT, value TEXT, PRIMARY KEY (name, section, field));
+    CREATE TABLE IF NOT EXISTS grid_instances (name TEXT, position INTEGER, key TEXT, PRIMARY KEY (name, position));
+    '''
+
+    def __init__(self, study_dir, db_name='metadata.sqlite'):
+        super().__init__(study_dir)
+        self.db_path = os.path.join(study_dir, db_name)
+        self._connection = sqlite3.connect(self.db_path)
+        self._connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    @classmethod
+    def import_toml(cls, study_dir):
+        return TomlStore(study_dir).copy_to(cls(study_dir))
+
+    def export_toml(self):
+        return self.copy_to(TomlStore(self.study_dir))
+
+    def read_properties(self):
+        rows = self._connection.execute('SELECT field, value FROM properties')
+        properties = {field: json.loads(value) for field, value in rows}
+        properties['path'] = self.instances_path()
+        return properties
+
+    def write_properties(self, properties):
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO properties VALUES (?, ?)',
+                [(field, json.dumps(plain(value))) for field, value in properties.items()])
+
+    def instance_keys(self):
+        return [key for key, in self._connection.execute('SELECT key FROM instances ORDER BY position')]
+
+    def find_instance(self, parameter_cb):
+        instances = self._read_instances([instance_key(parameter_cb)])
+        return next(iter(instances.values()), None)
+
+    def read_instance(self, key):
+        instances = self._read_instances([key])
+        if key not in instances:
+            raise KeyError(f'No instance {key} in {self.db_path}')
+        return instances[key]
+
+    def _read_instances(self, keys):
+        instances = {}
+        for start in range(0, len(keys), 500):  # sqlite limits the number of bound variables
+            chunk = keys[start:start + 500]
+            rows = self._connection.execute(
+                f'SELECT key, section, field, value FROM instance_fields WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            for key, section, field, value in rows:
+                _unflatten(instances.setdefault(key, {}), section, field, value)
+        return {key: instances[key] for key in keys if key in instances}
+
+    def instance_versions(self, keys):
+        # write counter of every instance, 0 if it was never written with this table
+        versions = dict.fromkeys(keys, 0)
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            versions.update(self._connection.execute(
+                f'SELECT key, version FROM instance_versions WHERE key IN ({",".join("?" * len(chunk))})', chunk))
+        return versions
+
+    def _bump_versions(self, keys):
+        self._connection.executemany('INSERT INTO instance_versions VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET version = version + 1',
+                                     [(key,) for key in keys])
+
+    def add_instances(self, instances):
+        # all instances in one transaction, one statement per table
+        with self._connection:
+            position = self._connection.execute('SELECT COUNT(*) FROM instances').fetchone()[0]
+            self._connection.executemany('INSERT OR IGNORE INTO instances VALUES (?, ?)', zip(instances, range(position, position + len(instances))))
+            self._connection.executemany('DELETE FROM instance_fields WHERE key = ?', [(key,) for key in instances])
+            self._connection.executemany('INSERT INTO instance_fields VALUES (?, ?, ?, ?)',
+                ((key, *row) for key, data in instances.items() for row in _flatten(data)))
+            self._bump_versions(instances)
+
+    def update_instance(self, key, updates):
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO instance_fields VALUES (?, ?, ?, ?)',
+                [(key, *row) for row in _flatten(updates)])
+            self._bump_versions([key])
+        return self.read_instance(key)
+
+    def update_instances(self, updates):
+        # one transaction for all instances
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO instance_fields VALUES (?, ?, ?, ?)',
+                [(key, *row) for key, instance_updates in updates.items() for row in _flatten(instance_updates)])
+            self._bump_versions(updates)
+
+    def grid_paths(self):
+        return [self.study_dir + '\\' + name for name, in self._connection.execute('SELECT name FROM grids ORDER BY name')]
+
+    def read_grid(self, grid_path):
+        name = grid_name(grid_path)
+        grid = {}
+        for section, field, value in self._connection.execute('SELECT section, field, value FROM grid_fields WHERE name = ?', (name,)):
+            _unflatten(grid, section, field, value)
+        if not grid:
+            raise KeyError(f'No grid {name} in {self.db_path}')
+        keys = self._connection.execute('SELECT key FROM grid_instances WHERE name = ? ORDER BY position', (name,))
+        grid['instances'] = {key: self.instance_path(key) for key, in keys}
+        return grid
+
+    def grid_instances(self, grid_path):
+        keys = [key for key, in self._connection.execute(
+            'SELECT key FROM grid_instances WHERE name = ? ORDER BY position', (grid_name(grid_path),))]
+        return self._read_instances(keys)
+
+    def write_grid(self, grid_path, data):
+        name = grid_name(grid_path)
+        data = dict(data)
+        keys = list(data.pop('instances'))
+        with self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO grids VALUES (?)', (name,))
+            for table in ('grid_fields', 'grid_instances'):
+                self._connection.execute(f'DELETE FROM {table} WHERE name = ?', (name,))
+            self._connection.executemany('INSERT INTO grid_fields VALUES (?, ?, ?, ?)', [(name, *row) for row in _flatten(data)])
+            self._connection.executemany('INSERT INTO grid_instances VALUES (?, ?, ?)', [(name, i, key) for i, key in enumerate(keys)])
+
+    def update_grid(self, grid_path, updates):
+        name = grid_name(grid_path)
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO grid_fields VALUES (?, ?, ?, ?)',
+                [(name, *row) for row in _flatten(updates)])
+        return self.read_grid(grid_path)
+
+
+def _flatten(data):
+    # (section, field, json value) rows, top-level scalars like 'title' get the section ''
+    rows = []
+    for section, content in data.items():
+        if isinstance(content, dict) and not content:
+            rows.append((section, '', 'null'))  # keeps empty sections such as 'evaluation'
+        elif isinstance(content, dict):
+            rows += [(section, field, _json(value)) for field, value in content.items()]
+        else:
+            rows.append(('', section, _json(content)))
+    return rows
+
+def _json(value):
+    # same text as json.dumps(plain(value)), scalars skip plain
+    if type(value) in _SCALARS:
+        return _ENCODE(value)
+    return _ENCODE(plain(value))
+
+_SCALARS = (str, int, float, bool, type(None))
+_ENCODE = json.JSONEncoder().encode
+
+def _unflatten(data, section, field, value):
+    if section == '':
+        data[field] = json.loads(value)
+    elif field == '':
+        data.setdefault(section, {})
+    else:
+        data.setdefault(section, {})[field] = json.loads(value)
@@ -0,0 +1,104 @@
+import glob
+import os
+import toml
+
+from MetadataStores.base import BaseStore, grid_name, merge
+import tracing
+
+
+def atomic_dump(data, path):
+    # write to a temporary file and rename it, so an interrupted run never leaves a truncated toml behind
+    temp_path = path + '.tmp'
+    with tracing.span('toml_write', 'metadata'):
+        with open(temp_path, 'w+') as toml_file:
+            toml.dump(data, toml_file)
+            toml_file.flush()
+            os.fsync(toml_file.fileno())
+        os.replace(temp_path, path)
+
+
+class TomlStore(BaseStore):
+    # the original layout: 'instances.toml', one 'instances/[x].toml' per parameter combination and one 'gridNN.toml' per grid
+    def __init__(self, study_dir):
+        super().__init__(study_dir)
+        self._index = None
+
+    def _load_index(self):
+        if self._index is None:
+            if os.path.exists(self.instances_path()):
+                self._index = toml.load(self.instances_path(), _dict=dict)
+            else:
+                self._index = {
+                "title": "instances",
+                'properties':{
+                'path': self.instances_path()
+                },
+                'instances':{}
+            }
+        return self._index
+
+    def _dump_index(self):
+        atomic_dump(self._index, self.instances_path())
+
+    def _path(self, key):
+        return self._load_index()['instances'].get(key, self.instance_path(key))
+
+    def _grid_file(self, grid_path):
+        return self.study_dir + '\\' + grid_name(grid_path)
+
+    def read_properties(self):
+        return dict(self._load_index()['properties'])
+
+    def write_properties(self, properties):
+        self._load_index()['properties'].update(properties)
+        self._index['properties']['path'] = self.instances_path()
+        self._dump_index()
+
+    def instance_keys(self):
+        return list(self._load_index()['instances'].keys())
+
+    def read_instance(self, key):
+        with tracing.span('toml_read', 'metadata'), open(self._path(key), 'r') as toml_file:
+            return toml.load(toml_file)
+
+    def instance_versions(self, keys):
+        # atomic_dump replaces the file, so every write gives a new inode and mtime
+        versions = {}
+        for key in keys:
+            try:
+                stat = os.stat(self._path(key))
+            except FileNotFoundError:
+                versions[key] = None
+                continue
+            versions[key] = (stat.st_ino, stat.st_mtime_ns)
+        return versions
+
+    def add_instances(self, instances):
+        if not os.path.exists(self.study_dir + '\\instances'):
+            os.mkdir(self.study_dir + '\\instances')
+        index = self._load_index()
+        for key, data in instances.items():
+            index['instances'][key] = self.instance_path(key)
+            atomic_dump(data, self.instance_path(key))
+        self._dump_index()
+
+    def update_instance(self, key, updates):
+        instance = merge(self.read_instance(key), updates)
+        atomic_dump(instance, self._path(key))
+        return instance
+
+    def grid_paths(self):
+        return sorted(glob.glob(self.study_dir + '\\grid[0-9][0-9].toml')) # same separator as grid_path
+
+    def read_grid(self, grid_path):
+        with tracing.span('toml_read', 'metadata'), open(self._grid_file(grid_path)) as toml_file:
+            return toml.load(toml_file)
+
+    def write_grid(self, grid_path, data):
+        data = dict(data, instances={key: self._path(key) for key in data['instances']})
+        atomic_dump(data, self._grid_file(grid_path))
+
+    def update_grid(self, grid_path, updates):
+        grid = merge(self.read_grid(grid_path), updates)
+        atomic_dump(grid, self._grid_file(grid_path))
+        return grid
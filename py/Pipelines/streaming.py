@@ -0,0 +1,241 @@
+import os
+import queue
+import threading
+import time
+from IOHandlers.testruns import TestrunStore
+from MetadataStores.base import merge
+from MetadataStores.journal import StageJournal
+from MetadataStores.tomlfiles import TomlStore
+from PngHandlers.yolo import ResidentYoloHandler, read_frame
+from Runners.carmaker import CarMakerRunner
+from ScoreCalculators.iou import IouScoreCalculator
+import tracing
+
+_END = object() # end of stream, passed down the queues
+_working = threading.local() # instance key a stage thread is working on, for error messages
+
+
+class PipelineError(Exception):
+    pass
+
+class _Aborted(Exception):
+    pass
+
+
+class StreamingPipeline():
+    # Simulation, detection and scoring of a grid at the same time. Every instance goes from CarMaker straight into
+    # the detector queue, and from there into the score queue. Both queues are bounded, so a slow stage holds back
+    # the ones before it. The stages only compute; the calling thread writes all metadata through the stage journals.
+    # IPGMovie can only export to a file, so every png is decoded once right after the export and the frame goes
+    # to the detector with the instance. keep_pngs=False removes the png once its detection is committed.
+    STAGES = ('ipg_result', 'yolo_result', 'sc_result')
+
+    def __init__(self, runner, queue_size=16, batch_size=8, score_workers=2, weights=None, device='cpu', imgsz=(640, 640),
+                 conf_thres=0.0001, iou_thres=0.45, name='exp', keep_pngs=True, log_level=1):
+        self.runner = runner # CarMakerRunner or CarMakerPool
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.score_workers = score_workers
+        self.detector_kwargs = {'weights': weights, 'device': device, 'imgsz': imgsz}
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.name = name
+        self.keep_pngs = keep_pngs
+        self._log_level = log_level
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def run(self, grid_path, out_quants=['Vhcl.Fr1.x', 'Vhcl.Fr1.y','Vhcl.Fr1.z'], camera_name='Dev_Xu', mode='save_all', store=TomlStore):
+        metadata = store.from_grid_path(grid_path)
+        journals = {stage: StageJournal(metadata, stage) for stage in self.STAGES}
+        testruns = TestrunStore(metadata)
+        for journal in journals.values():
+            journal.recover()
+        # instances enter the pipeline at the first stage they have not finished yet
+        simulate = metadata.pending_instances(grid_path, 'ipg_result')
+        detect = {key: instance for key, instance in metadata.pending_instances(grid_path, 'yolo_result').items() if key not in simulate}
+        score = {key: instance for key, instance in metadata.pending_instances(grid_path, 'sc_result').items()
+                 if key not in simulate and key not in detect}
+        if not (simulate or detect or score):
+            return self.stats
+
+        detector = ResidentYoloHandler.load_detector(**self.detector_kwargs) if simulate or detect else None
+        self._abort = threading.Event()
+        self._events = queue.Queue() # (stage, key, updates) for the calling thread, unbounded so stages never wait on it
+        self._queues = {'yolo_result': queue.Queue(self.queue_size), 'sc_result': queue.Queue(self.queue_size)}
+        self.stats = {stage: {'count': 0, 'busy': 0.0, 'queue_depths': []} for stage in self.STAGES}
+        threads = [threading.Thread(target=self._guard, args=('ipg_result', self._simulate, simulate, detect, out_quants, camera_name, mode, testruns)),
+                   threading.Thread(target=self._guard, args=('yolo_result', self._detect, detector, score))]
+        threads += [threading.Thread(target=self._guard, args=('sc_result', self._score, out_quants, camera_name)) for _ in range(self.score_workers)]
+
+        pngs = {key: instance['results']['ipgmovie'] for key, instance in detect.items()} # until detected
+        start = time.perf_counter()
+        entering = {'ipg_result': simulate, 'yolo_result': detect, 'sc_result': score}
+        passing = 0 # instances that enter at an earlier stage and pass this one
+        for stage in self.STAGES:
+            journals[stage].begin(*entering[stage])
+            tracing.expect(stage, passing)
+            passing += len(entering[stage])
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        error = None
+        running = len(threads)
+        try:
+            while running:
+                stage, key, updates = self._events.get()
+                if stage is None:
+                    running -= 1
+                elif stage == 'error':
+                    error = error or updates
+                    self._abort.set()
+                else:
+                    journals[stage].commit(key, updates)
+                    if stage == 'ipg_result':
+                        testruns.release(key)
+                        pngs[key] = updates['results']['ipgmovie']
+                    elif stage == 'yolo_result' and not self.keep_pngs:
+                        self._remove(pngs.pop(key, ''))
+        except BaseException:
+            self._abort.set()
+            raise
+        finally:
+            self._summarize(time.perf_counter() - start)
+        if error is not None:
+            raise PipelineError(f'{error[0]} failed on instance {error[1]}, run again to resume') from error[2]
+        for journal in journals.values():
+            journal.clear()
+        return self.stats
+
+    def print_stats(self):
+        for stage, stats in self.stats.items():
+            print(f'{stage:12s} {stats["count"]:5d} instances {stats["throughput"]:8.2f} /s busy {stats["busy"]:8.1f} s '
+                  f'queue mean {stats["mean_queue"]:5.1f} max {stats["max_queue"]:3d}')
+
+    def _simulate(self, simulate, detect, out_quants, camera_name, mode, testruns):
+        for key, instance in detect.items():
+            self._put('yolo_result', (key, instance, None)) # simulated in an earlier run, the detector reads the png
+        for key, results in self._timed('ipg_result', self.runner.stream_movies(self._jobs(simulate, testruns), out_quants, camera_name, mode)):
+            updates = CarMakerRunner._movie_results(results)
+            frame = read_frame(updates['results']['ipgmovie'])
+            self._events.put(('ipg_result', key, updates))
+            self._put('yolo_result', (key, merge(simulate[key], updates), frame))
+        self._put('yolo_result', _END)
+
+    def _detect(self, detector, score):
+        for key, instance in score.items():
+            self._put('sc_result', (key, instance))
+        items = self._queues['yolo_result']
+        ended = False
+        while not ended:
+            # block for the first instance, then take what is already waiting up to batch_size
+            batch = [self._get('yolo_result')]
+            while len(batch) < self.batch_size and batch[-1] is not _END:
+                try:
+                    batch.append(items.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _END:
+                ended = True
+                batch.pop()
+            if not batch:
+                break
+            start = time.perf_counter()
+            _working.key = [key for key, _, _ in batch]
+            detections = detector.detect([instance['results']['ipgmovie'] if frame is None else frame for _, instance, frame in batch],
+                                         self.conf_thres, self.iou_thres)
+            updates = [{'results': {'yolov5': ResidentYoloHandler._write_detections(instance, det, self.name)}}
+                       for (_, instance, _), det in zip(batch, detections)]
+            self._count('yolo_result', len(batch), time.perf_counter() - start)
+            for (key, instance, _), update in zip(batch, updates):
+                self._events.put(('yolo_result', key, update))
+                self._put('sc_result', (key, merge(instance, update)))
+        for _ in range(self.score_workers):
+            self._put('sc_result', _END)
+
+    def _score(self, out_quants, camera_name):
+        while True:
+            item = self._get('sc_result')
+            if item is _END:
+                return
+            key, instance = item
+            _working.key = key
+            start = time.perf_counter()
+            with tracing.span('score', 'score'):
+                sc = IouScoreCalculator._score_instance(instance, out_quants, camera_name)
+            self._count('sc_result', 1, time.perf_counter() - start)
+            self._events.put(('sc_result', key, {'results': {'safetyscore': sc}}))
+
+    def _guard(self, stage, target, *args):
+        # every stage thread reports its end, or the first error, to the calling thread
+        _working.key = None
+        try:
+            target(*args)
+        except _Aborted:
+            pass
+        except BaseException as E:
+            self._events.put(('error', None, (stage, _working.key, E)))
+        finally:
+            self._events.put((None, None, None))
+
+    @staticmethod
+    def _remove(png_path):
+        try:
+            os.remove(png_path)
+        except OSError:
+            pass # already gone, or never written
+
+    @staticmethod
+    def _jobs(simulate, testruns):
+        for key, path in testruns.jobs(simulate.items()):
+            _working.key = key # a CarMakerPool reports failed instances itself
+            yield key, path
+
+    def _timed(self, stage, results):
+        results = iter(results)
+        while True:
+            start = time.perf_counter()
+            try:
+                result = next(results)
+            except StopIteration:
+                return
+            self._count(stage, 1, time.perf_counter() - start)
+            yield result
+
+    def _count(self, stage, count, busy):
+        with self._lock:
+            self.stats[stage]['count'] += count
+            self.stats[stage]['busy'] += busy
+
+    def _put(self, stage, item):
+        items = self._queues[stage]
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                items.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.stats[stage]['queue_depths'].append(items.qsize())
+        tracing.gauge(f'queue {stage}', items.qsize())
+
+    def _get(self, stage):
+        items = self._queues[stage]
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _summarize(self, wall_time):
+        for stats in self.stats.values():
+            depths = stats.pop('queue_depths', [])
+            stats['wall'] = wall_time
+            stats['throughput'] = stats['count'] / wall_time if wall_time else 0.0
+            stats['mean_queue'] = sum(depths) / len(depths) if depths else 0.0
+            stats['max_queue'] = max(depths) if depths else 0
+        if self._log_level <= 1:
+            self.print_stats()
@@ -1,4 +1,5 @@
 from abc import abstractmethod
+import tracing
 
 
 class PngBaseHandler():
@@ -6,11 +7,11 @@ class PngBaseHandler():
         pass
     
     @classmethod
-    def evaluate_pngs(cls, grid_path):
-        return cls._evaluate_pngs(grid_path)
+    def evaluate_pngs(cls, grid_path, **handler_kwargs):
+        with tracing.span(f'{cls.__name__}.evaluate_pngs', 'detector'):
+            return cls._evaluate_pngs(grid_path, **handler_kwargs)
 
     @classmethod
     @abstractmethod
-    def _evaluate_pngs(cls, grid_path):
+    def _evaluate_pngs(cls, grid_path, **handler_kwargs):
         pass
-    
\ No newline at end of file
@@ -1,31 +1,170 @@
 from cProfile import label
 from PngHandlers.base import PngBaseHandler
+import contextlib
+import itertools
 import os
-import toml
+import sys
+from MetadataStores.journal import StageJournal
+from MetadataStores.tomlfiles import TomlStore
+import tracing
+
+YOLOV5_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'third_party', 'yolov5')
 
 class yoloHandler(PngBaseHandler):
     @classmethod
-    def _evaluate_pngs(cls, grid_path, exceutable_path='python C:\Arbeit\parameter-discretization\py\\third_party\yolov5\detect.py'):
-        with open(grid_path) as toml_file:
-            grid = toml.load(toml_file)
-            for key, value in grid['instances'].items():
-                with open(value, 'r') as toml_file:
-                    instance = toml.load(toml_file)
-                with open(value, 'w') as toml_file:
-                    if instance['properties']['yolo_result'] == 0:
-                        png_path = instance['results']['ipgmovie']
-                        txt_path = os.path.dirname(png_path)
-                        dir_path = cls._evaluate_png(png_path, txt_path, exceutable_path)
-                        label_path = os.path.join(dir_path, 'labels', os.path.basename(instance['properties']['path']))
-                        label_path += '.txt'
-                        instance['properties']['yolo_result'] = 1
-                        instance['results']['yolov5'] = label_path
-                    toml.dump(instance, toml_file)
+    def _evaluate_pngs(cls, grid_path, exceutable_path='python C:\Arbeit\parameter-discretization\py\\third_party\yolov5\detect.py', store=TomlStore):
+        with StageJournal(store.from_grid_path(grid_path), 'yolo_result') as journal:
+            for key, instance in journal.pending(grid_path):
+                png_path = instance['results']['ipgmovie']
+                txt_path = os.path.dirname(png_path)
+                dir_path = cls._evaluate_png(png_path, txt_path, exceutable_path)
+                label_path = os.path.join(dir_path, 'labels', os.path.basename(instance['properties']['path']))
+                label_path += '.txt'
+                journal.commit(key, {'results': {'yolov5': label_path}})
     
     @staticmethod
     def _evaluate_png(png_path, txt_path, exceutable_path, name='exp'):
         executable_path = exceutable_path + f' --save-txt --source {png_path}\
                             --project {txt_path} --name {name} --conf-thres 0.0001 --save-conf --exist-ok' 
-        os.system(executable_path)
+        with tracing.span('yolo_process', 'detector'):
+            os.system(executable_path)
         return os.path.join(txt_path, name)
 
+
+class ResidentYoloHandler(PngBaseHandler):
+    # Same results as yoloHandler, but YOLOv5 runs inside this process. The model is loaded once per
+    # (weights, device) and stays loaded across grids, all pending pngs of a grid are sent through it in batches.
+    _detectors = {}
+
+    @classmethod
+    def _evaluate_pngs(cls, grid_path, weights=None, device='cpu', batch_size=8, imgsz=(640, 640), conf_thres=0.0001, iou_thres=0.45, name='exp', store=TomlStore):
+        detector = cls.load_detector(weights, device, imgsz)
+        with StageJournal(store.from_grid_path(grid_path), 'yolo_result') as journal:
+            pending = journal.pending(grid_path)
+            while True:
+                batch = list(itertools.islice(pending, batch_size))
+                if not batch:
+                    break
+                png_paths = [instance['results']['ipgmovie'] for _, instance in batch]
+                detections = detector.detect(png_paths, conf_thres, iou_thres)
+                for (key, instance), det in zip(batch, detections):
+                    label_path = cls._write_detections(instance, det, name)
+                    journal.commit(key, {'results': {'yolov5': label_path}})
+
+    @staticmethod
+    def _write_detections(instance, det, name='exp'):
+        # label file next to the png, where detect.py would put it
+        dir_path = os.path.join(os.path.dirname(instance['results']['ipgmovie']), name)
+        label_path = os.path.join(dir_path, 'labels', os.path.basename(instance['properties']['path']))
+        label_path += '.txt'
+        _write_labels(label_path, det)
+        return label_path
+
+    @classmethod
+    def load_detector(cls, weights=None, device='cpu', imgsz=(640, 640)):
+        if weights is None:
+            weights = os.path.join(YOLOV5_ROOT, 'yolov5s.pt')  # same default as detect.py
+        key = (os.path.abspath(weights), str(device), tuple(imgsz))
+        if key not in cls._detectors:
+            cls._detectors[key] = YoloDetector(weights, device, imgsz)
+        return cls._detectors[key]
+
+    @classmethod
+    def release_detectors(cls):
+        cls._detectors.clear()
+
+
+class YoloDetector():
+    def __init__(self, weights, device='cpu', imgsz=(640, 640)):
+        with yolov5_namespace() as yolov5:
+            import torch
+            self._torch = torch
+            self.device = yolov5['utils.torch_utils'].select_device(device)
+            self.model = yolov5['models.common'].DetectMultiBackend(weights, device=self.device, data=os.path.join(YOLOV5_ROOT, 'data', 'coco128.yaml'))
+            self.stride = self.model.stride
+            self.imgsz = yolov5['utils.general'].check_img_size(list(imgsz), s=self.stride)
+            self.model.warmup(imgsz=(1, 3, *self.imgsz))
+        self._letterbox = yolov5['utils.augmentations'].letterbox
+        self._nms = yolov5['utils.general'].non_max_suppression
+        self._scale_coords = yolov5['utils.general'].scale_coords
+        self._xyxy2xywh = yolov5['utils.general'].xyxy2xywh
+
+    def detect(self, images, conf_thres=0.0001, iou_thres=0.45, max_det=1000):
+        # images: png paths or frames already decoded by read_frame (BGR arrays).
+        # returns one (n, 6) array per image with rows [cls, x_center, y_center, width, height, conf], normalised like detect.py --save-txt --save-conf
+        with tracing.span('detect', 'detector', batch=len(images)):
+            return self._detect(images, conf_thres, iou_thres, max_det)
+
+    def _detect(self, images, conf_thres, iou_thres, max_det):
+        import numpy as np
+        frames = [read_frame(image) if isinstance(image, str) else image for image in images]
+        images = []
+        for im0 in frames:
+            im = self._letterbox(im0, self.imgsz, stride=self.stride, auto=self.model.pt)[0]
+            im = np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])  # HWC to CHW, BGR to RGB
+            images.append((im, im0))
+
+        # letterbox keeps the aspect ratio, so pngs of one grid share a shape; batch per shape to be safe
+        detections = [None] * len(images)
+        shapes = {}
+        for index, (im, _) in enumerate(images):
+            shapes.setdefault(im.shape, []).append(index)
+        torch = self._torch
+        with torch.no_grad():
+            for indices in shapes.values():
+                batch = torch.from_numpy(np.stack([images[i][0] for i in indices])).to(self.device).float() / 255
+                pred = self._nms(self.model(batch), conf_thres, iou_thres, max_det=max_det)
+                for i, det in zip(indices, pred):
+                    im0 = images[i][1]
+                    gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
+                    rows = []
+                    if len(det):
+                        det[:, :4] = self._scale_coords(batch.shape[2:], det[:, :4], im0.shape).round()
+                        for *xyxy, conf, cls in reversed(det):
+                            xywh = (self._xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()
+                            rows.append([float(cls), *xywh, float(conf)])
+                    detections[i] = np.array(rows, dtype=float).reshape(-1, 6)
+        return detections
+
+
+def read_frame(png_path):
+    # BGR array of a png, as detect.py reads it
+    import cv2
+    im0 = cv2.imread(png_path)
+    if im0 is None:
+        raise FileNotFoundError(f'Image Not Found {png_path}')
+    return im0
+
+def _write_labels(label_path, det):
+    # detect.py writes no label file if nothing is detected, IouScoreCalculator scores missing files with 0
+    if os.path.exists(label_path):
+        os.remove(label_path)
+    if not len(det):
+        return
+    os.makedirs(os.path.dirname(label_path), exist_ok=True)
+    with open(label_path, 'w') as txt_file:
+        for line in det:
+            txt_file.write(('%g ' * len(line)).rstrip() % tuple(line) + '\n')
+
+
+_yolov5_modules = {}
+
+@contextlib.contextmanager
+def yolov5_namespace():
+    # yolov5 imports its own top-level 'utils' and 'models' packages, which clash with py/utils.py.
+    # Swap them into sys.modules only while yolov5 code is imported or unpickled.
+    def owned(name):
+        return name.split('.')[0] in ('utils', 'models')
+    saved = {name: module for name, module in sys.modules.items() if owned(name)}
+    for name in saved:
+        del sys.modules[name]
+    sys.modules.update(_yolov5_modules)
+    sys.path.insert(0, YOLOV5_ROOT)
+    try:
+        import utils.augmentations, utils.general, utils.torch_utils, models.common, models.yolo
+        yield {name: module for name, module in sys.modules.items() if owned(name)}
+    finally:
+        sys.path.remove(YOLOV5_ROOT)
+        for name in [name for name in sys.modules if owned(name)]:
+            _yolov5_modules[name] = sys.modules.pop(name)
+        sys.modules.update(saved)
@@ -1,14 +1,17 @@
 from abc import abstractmethod
+import tracing
 
 class BaseRunner():
     def __init__(self):
         pass
 
     def evaluate_instances(self, instances, **runner_kwargs):
-        return self._evaluate_instances(instances, **runner_kwargs)
+        with tracing.span(f'{type(self).__name__}.evaluate_instances', 'runner'):
+            return self._evaluate_instances(instances, **runner_kwargs)
 
     def evaluate_instance(self, instance, **runner_kwargs):
-        return self._evaluate_instance(instance, **runner_kwargs)
+        with tracing.span(f'{type(self).__name__}.evaluate_instance', 'runner'):
+            return self._evaluate_instance(instance, **runner_kwargs)
 
     @abstractmethod
     def _evaluate_instances(self, instances, **runner_kwargs):
@@ -1,15 +1,15 @@
+import contextlib
 import os
+import re
 import socket
 import time
-import toml
 from .base import BaseRunner
-from third_party.cmerg.erg import  ERG
-
-class CarMakerCommandError(Exception):
-    pass
-
-class TclTransmissionError(Exception):
-    pass
+from MetadataStores.journal import StageJournal
+from MetadataStores.tomlfiles import TomlStore
+from .erg import MappedERG
+from IOHandlers.testruns import TestrunStore
+import tracing
+from .tcl import CarMakerCommandError, TclTransmissionError, TERMINATOR, parse_reply
 
 class CarMakerRunner(BaseRunner):
     SIMSTATUSES = {-1:'Preprocessing',
@@ -23,7 +23,7 @@ class CarMakerRunner(BaseRunner):
                 -10:'Starting application',
                 -11:'Simulink initialization'}
 
-    def __init__(self, executable_path=None, keep_alive=False, convert_results=True, log_level=0):
+    def __init__(self, executable_path=None, keep_alive=False, convert_results=True, log_level=0, tcp_cmd_port=1024, launch=True, result_cache=None):
         super().__init__()
 
         # define aliases for standard methods
@@ -36,12 +36,18 @@ class CarMakerRunner(BaseRunner):
             self._executable_path = executable_path
         else:
             self._executable_path = r"C:\IPG\carmaker\win64-10.0\bin\CM.exe"
-        self._tcp_cmd_port = 1024
+        self._tcp_cmd_port = tcp_cmd_port
+        self._launch = launch # False connects to an already running CarMaker (or Runners.fakecarmaker) on tcp_cmd_port
         self._host = 'localhost'
         self._buffer = 4096
         self._RAISE_ON_TCL_ERROR = True
+        self._socket = None
+        self._received = b'' # start of the next reply
+        self._session = None # open CarMakerSession, if any
+        self.timings = {} # phase -> list of seconds, collected by every session of this runner
         self._keep_alive = keep_alive
         self._convert_results = convert_results
+        self.result_cache = result_cache # ResultCache, keeps the signals of every simulation
         self._log_level = log_level
         if self._keep_alive:
             self.startup() # start runner at init, since it should never be shut down
@@ -49,35 +55,36 @@ class CarMakerRunner(BaseRunner):
     def _send_command(self, command):
         if self._log_level <= 0:
             print(f'TCL -> {command}')
-        self._socket.send(bytes(f'{command}\n', 'utf-8'))
-        reply = self._socket.recv(self._buffer)
-        reply = reply.decode('utf-8').replace('\r\n','')
-        tcl_error = reply[:1]
-        if tcl_error == 'O':
-            pass # received Ok
-        elif tcl_error == '':
-            pass # nothing received
-        elif tcl_error == 'E':
-            if self._RAISE_ON_TCL_ERROR:
-                raise CarMakerCommandError(f'Unknown CarMaker Command:\n{command}')
-        else:
-            raise TclTransmissionError(f"Unknown TCL return code either 'E' or 'O' expected. \n Received: '{tcl_error}'")
-        reply = reply[1:] # Strip E/O message
+        self._socket.sendall(bytes(f'{command}\n', 'utf-8'))
+        reply = parse_reply(command, self._receive_reply(), self._RAISE_ON_TCL_ERROR)
         if self._log_level <= 0:
             print(f'TCL <- {reply}')
         return reply
 
+    def _receive_reply(self):
+        # one reply without its terminator, a long reply can arrive in several pieces. b'' if the connection is closed
+        while TERMINATOR not in self._received:
+            data = self._socket.recv(self._buffer)
+            if not data:
+                self._received = b''
+                return b''
+            self._received += data
+        reply, self._received = self._received.split(TERMINATOR, 1)
+        return reply
+
     def startup(self):
-        executable_cmd = f'{self._executable_path} -cmdport {self._tcp_cmd_port} -apphost localhost' # use localhost
-        if self._log_level <= 1:
-            print(f'Executing: {executable_cmd}')
-        os.system(executable_cmd)
+        if self._launch:
+            executable_cmd = f'{self._executable_path} -cmdport {self._tcp_cmd_port} -apphost localhost' # use localhost
+            if self._log_level <= 1:
+                print(f'Executing: {executable_cmd}')
+            os.system(executable_cmd)
         if self._log_level <= 1:
             print('Establishing TCP connection', end='')
         for _ in range(100):
             try:
                 self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self._socket.connect((self._host, self._tcp_cmd_port))
+                self._received = b''
                 print('')
                 break
             except:
@@ -88,41 +95,58 @@ class CarMakerRunner(BaseRunner):
             print(f'Project directory: {self.project_path}')
             print(f'CarMaker Ready')
 
-    def _evaluate_instance(self, testrun_path, out_quants=[], mode='save_all'):
-        if not self._keep_alive: # assume that runner is shut down at this point, TODO: needs check to see if runner ist really shut down
-            self.startup()
-        # self.loadtestrun(testrun_path) #TODO fix \\ -> \\\\ escape for paths
-        self.loadtestrun(testrun_path.replace('\\','\\\\')) #quick and dirty hack for the above problem
-        self.outquantsdelall()
-        self.outquantsadd(out_quants)
-        self.savemode(mode)
-        self.setresultfname('%o/%r/%D/%f_%T%?_s')# default is %t instead of %f. %t uses the whole source file path, with is unreadable
-        self.startsim()
+    def is_alive(self, timeout=5):
+        # health check: CarMaker answers a cheap command within timeout seconds, a closed connection replies nothing
         try:
-            self.waitforstatus_running(10000)
-            self.waitforstatus_idle()
-            erg_path = self.getlastresultfname()
-            erg_path = os.path.join(self.project_path,erg_path)
-            if self._convert_results:
-                erg = ERG(erg_path)
-                simulation_result = {signal_name: signal.data for signal_name, signal in erg.signals.items()}
-        except BaseException as E:
-            simulation_result = None
+            self._socket.settimeout(timeout)
+            return self.projectinfo_version() != ''
+        except CarMakerCommandError:
+            return True
+        except (AttributeError, OSError, TclTransmissionError, ValueError):
+            return False
         finally:
-            if not self._keep_alive:
-                if self._log_level <= 1:
-                    print('quit')
-                self.application_shutdown()
-                self.gui_quit()
-            return simulation_result
+            try:
+                self._socket.settimeout(None)
+            except (AttributeError, OSError):
+                pass
+
+    def shutdown(self):
+        # best effort, the application may already be gone
+        try:
+            self.application_shutdown()
+            self.gui_quit()
+        except (AttributeError, OSError, CarMakerCommandError, TclTransmissionError):
+            pass
+        try:
+            self._socket.close()
+        except (AttributeError, OSError):
+            pass
+
+    def restart(self):
+        self.shutdown()
+        self.startup()
+
+    def session(self, camera_name=None, max_reconnects=3):
+        # with runner.session(camera_name) as session: one warm CarMaker application for a whole sweep.
+        # Inside an open session the runner methods reuse it instead of starting CarMaker again.
+        if self._session is not None:
+            if camera_name:
+                self._session.camera_name = camera_name
+            return contextlib.nullcontext(self._session)
+        return CarMakerSession(self, camera_name, max_reconnects)
+
+    def _evaluate_instance(self, testrun_path, out_quants=[], mode='save_all'):
+        with self.session() as session:
+            return session.simulate_testrun(testrun_path, out_quants, mode)
 
     def _evaluate_instances(self, testrun_paths, out_quants=[], mode='save_all'):
         erg_paths = {}
-        for testrun_id, testrun_path in enumerate(testrun_paths):
-            if self._log_level <= 1:
-                print(f'Simulating Testrun {testrun_id}/{len(testrun_paths)}')
-            erg_path = self._evaluate_instance(testrun_path, out_quants, mode)
-            erg_paths[testrun_path] = erg_path
+        with self.session() as session:
+            for testrun_id, testrun_path in enumerate(testrun_paths):
+                if self._log_level <= 1:
+                    print(f'Simulating Testrun {testrun_id}/{len(testrun_paths)}')
+                erg_path = session.simulate_testrun(testrun_path, out_quants, mode)
+                erg_paths[testrun_path] = erg_path
         return erg_paths
 
     def simulate_testrun_dir(self, testrun_dir_path, out_quants=[], mode='save_all'):
@@ -133,62 +157,40 @@ class CarMakerRunner(BaseRunner):
 
     # added for simulate movies.
     def _evaluate_movie(self, testrun_path, out_quants, camera_name='Dev_Xu', mode='save_all'):
-        if not self._keep_alive: # assume that runner is shut down at this point, TODO: needs check to see if runner ist really shut down
-            self.startup()
-        _, testrun_basepath = testrun_path.split('TestRun\\')
-        self.loadtestrun(testrun_path.replace('\\','\\\\')) #quick and dirty hack for the above problem
-        self.savemode(mode)
-        self.movie_start()
-        for _ in range(1000000): # make sure the IPGmovie is running
-            if self.movie_attach() == 1:
-                break
-        self.select_camera(camera_name)
-        self.outquantsdelall()
-        self.outquantsadd(out_quants)
-        self.setresultfname('%o/%r/%D/%f_%T%?_s')# default is %t instead of %f. %t uses the whole source file path, with is unreadable
-        self.startsim()
-
-        self.waitforstatus_running(10000)
-        self.waitforstatus_idle()
-            # evaluate movie
-        if not os.path.exists(f'{self.project_path}/png'):
-            os.mkdir(f'{self.project_path}/png')
-        movie_path = f'{self.project_path}/png/{testrun_basepath}.png'
-        self.png_export(movie_path, 0, 'end', 'end')
-            
-            # evaluate result
-        erg_path = self.getlastresultfname()
-        erg_path = os.path.join(self.project_path,erg_path)
-        if self._convert_results:
-            erg = ERG(erg_path)
-            simulation_result = {signal_name: signal.data for signal_name, signal in erg.signals.items()}
-
-        if not self._keep_alive:
-            if self._log_level <= 1:
-                print('quit')
-            self.application_shutdown()
-            self.gui_quit()
-        return movie_path, simulation_result
-    
-    def _evaluate_movies(self, grid_path, out_quants=['Vhcl.Fr1.x', 'Vhcl.Fr1.y','Vhcl.Fr1.z'], camera_name='Dev_Xu', mode='save_all'):
-        with open(grid_path) as toml_file:
-            grid = toml.load(toml_file)
-            for key, value in grid['instances'].items():
-                with open(value, 'r') as toml_file:
-                    instance = toml.load(toml_file)
-                with open(value, 'w') as toml_file:
-                    try:
-                        if instance['properties']['ipg_result'] == 0:
-                            testrun_path = instance['properties']['path']
-                            results = self._evaluate_movie(testrun_path, out_quants, camera_name, mode)
-                            instance['results']['ipgmovie'] = results[0]
-                            instance['results']['ipgresult'] = {key.replace('""',''): value[-1] for key,value in results[1].items()}
-                            instance['properties']['ipg_result'] = 1
-                        toml.dump(instance, toml_file)
-                    except:
-                        # Indicate which metadata is being modified when the program is interrupted
-                        raise ValueError('this instance metadata ' + str(value) + ' is damaged') 
-                    
+        with self.session(camera_name) as session:
+            return session.simulate_movie(testrun_path, out_quants, mode)
+
+    def _evaluate_movies(self, grid_path, out_quants=['Vhcl.Fr1.x', 'Vhcl.Fr1.y','Vhcl.Fr1.z'], camera_name='Dev_Xu', mode='save_all', store=TomlStore):
+        metadata = store.from_grid_path(grid_path)
+        testruns = TestrunStore(metadata)
+        with tracing.span(f'{type(self).__name__}.simulate_movies', 'runner'), \
+                StageJournal(metadata, 'ipg_result') as journal, self.session(camera_name) as session:
+            interrupted = journal.recover()
+            if interrupted and self._log_level <= 1:
+                print(f'Resuming, interrupted instances: {interrupted}')
+            for key, instance in journal.pending(grid_path):
+                try:
+                    testrun_path = testruns.materialize(key, instance)
+                    results = session.simulate_movie(testrun_path, out_quants, mode)
+                except BaseException as E:
+                    # Indicate which parameter combination was simulated when the program was interrupted
+                    raise ValueError('simulation of instance ' + str(key) + ' was interrupted, run again to resume') from E
+                journal.commit(key, self._movie_results(results))
+                testruns.release(key)
+
+    def stream_movies(self, jobs, out_quants, camera_name='Dev_Xu', mode='save_all'):
+        # jobs: iterable of (job_id, testrun_path), yields (job_id, (movie_path, simulation_result)) as they finish
+        with self.session(camera_name) as session:
+            for job_id, testrun_path in jobs:
+                yield job_id, session.simulate_movie(testrun_path, out_quants, mode)
+
+    @staticmethod
+    def _movie_results(results):
+        # metadata updates for the (movie_path, simulation_result) returned by _evaluate_movie
+        movie_path, simulation_result = results
+        return {'results': {'ipgmovie': movie_path,
+                            'ipgresult': {name.replace('""',''): value[-1] for name,value in simulation_result.items()}}}
+
     def startsim(self):
         self._send_command(f'StartSim')
 
@@ -284,8 +286,175 @@ class CarMakerRunner(BaseRunner):
         movie_attach = int(self._send_command(f'Movie attach'))
         return movie_attach
 
+    def wait_movie_attached(self, timeout=60, interval=0.1):
+        # make sure the IPGmovie is running
+        deadline = time.time() + timeout
+        while self.movie_attach() != 1:
+            if time.time() > deadline:
+                raise TimeoutError(f'IPGMovie not attached after {timeout} s')
+            time.sleep(interval)
+
     def select_camera(self, camera_name):
         self._send_command(f'Movie camera select ' + camera_name)
+
+
+class CarMakerSession():
+    # Keeps one CarMaker application with an attached IPGMovie for many testruns. Settings that did not change since
+    # the last testrun are not sent again. A dropped connection is reopened and the testrun simulated again.
+    PHASES = ('startup', 'load', 'sim', 'export', 'results')
+
+    def __init__(self, runner, camera_name=None, max_reconnects=3, attach_timeout=60):
+        self.runner = runner
+        self.camera_name = camera_name
+        self.max_reconnects = max_reconnects
+        self.attach_timeout = attach_timeout
+        self.reconnects = 0
+        self.timings = {phase: [] for phase in self.PHASES} # phase -> list of seconds
+        self._socket = None # connection the warm state below belongs to
+        self._movie = False
+        self._mode = None
+        self._out_quants = None
+
+    def __enter__(self):
+        self.runner._session = self
+        return self
+
+    def __exit__(self, *exc_info):
+        self.runner._session = None
+        if not self.runner._keep_alive and self._socket is not None:
+            if self.runner._log_level <= 1:
+                print('quit')
+            self.runner.shutdown()
+        if self.runner._log_level <= 1:
+            self.print_timings()
+        return False
+
+    def simulate_testrun(self, testrun_path, out_quants=[], mode='save_all'):
+        return self._run(self._simulate_testrun, testrun_path, out_quants, mode)
+
+    def simulate_movie(self, testrun_path, out_quants, mode='save_all'):
+        return self._run(self._simulate_movie, testrun_path, out_quants, mode)
+
+    def timing_summary(self):
+        return {phase: {'count': len(durations), 'total': sum(durations), 'mean': sum(durations) / len(durations)}
+                for phase, durations in self.timings.items() if durations}
+
+    def print_timings(self):
+        for phase, summary in self.timing_summary().items():
+            print(f'{phase:8s} {summary["count"]:5d} x {summary["mean"]:8.3f} s = {summary["total"]:9.1f} s')
+
+    def _simulate_testrun(self, testrun_path, out_quants, mode):
+        runner = self.runner
+        cache = runner.result_cache
+        if cache is not None and runner._convert_results:
+            signals = cache.get(cache.key(testrun_path), out_quants or None)
+            if signals is not None:
+                return signals # simulated before, possibly by another study
+        self._ensure(movie=False)
+        with self._phase('load'):
+            runner.loadtestrun(testrun_path.replace('\\','\\\\')) #quick and dirty hack for the above problem
+            self._configure(out_quants, mode)
+        try:
+            self._simulate()
+            return self._results(testrun_path=testrun_path, out_quants=out_quants)
+        except Exception:
+            if not runner.is_alive():
+                raise # let _run reconnect
+            return None
+
+    def _simulate_movie(self, testrun_path, out_quants, mode):
+        runner = self.runner
+        _, testrun_basepath = re.split(r'TestRun[\\/]', testrun_path, maxsplit=1)
+        self._ensure(movie=True)
+        with self._phase('load'):
+            runner.loadtestrun(testrun_path.replace('\\','\\\\')) #quick and dirty hack for the above problem
+            self._configure(out_quants, mode)
+            if self.camera_name:
+                runner.select_camera(self.camera_name) # cheap, and safe if loading a testrun resets the view
+        self._simulate()
+        with self._phase('export'):
+            if not os.path.exists(f'{runner.project_path}/png'):
+                os.mkdir(f'{runner.project_path}/png')
+            movie_path = f'{runner.project_path}/png/{testrun_basepath}.png'
+            runner.png_export(movie_path, 0, 'end', 'end')
+        return movie_path, self._results(last=1, testrun_path=testrun_path, out_quants=out_quants) # only the final state goes into the metadata
+
+    def _simulate(self):
+        runner = self.runner
+        with self._phase('sim'):
+            runner.startsim()
+            runner.waitforstatus_running(10000)
+            runner.waitforstatus_idle()
+
+    def _results(self, last=None, testrun_path=None, out_quants=()):
+        # {signal name: samples}, the whole signals are mapped from the ERG file, the last samples are copied
+        runner = self.runner
+        with self._phase('results'):
+            erg_path = runner.getlastresultfname()
+            erg_path = os.path.join(runner.project_path,erg_path)
+            cache = runner.result_cache if testrun_path is not None else None
+            if not runner._convert_results and cache is None:
+                return erg_path
+            erg = MappedERG(erg_path)
+            if cache is not None:
+                names = [name for name in ['Time', *out_quants] if name in erg] if out_quants else None
+                cache.put(cache.key(testrun_path), erg.window(names))
+            if not runner._convert_results:
+                return erg_path
+            if last is not None:
+                return erg.last(n=last)
+            return {signal_name: erg[signal_name] for signal_name in erg.signals}
+
+    def _run(self, simulate, *args):
+        try:
+            return simulate(*args)
+        except (OSError, TclTransmissionError, ValueError):
+            if self.reconnects >= self.max_reconnects or self.runner.is_alive():
+                raise
+        self.reconnects += 1
+        if self.runner._log_level <= 1:
+            print(f'CarMaker session lost, reconnecting ({self.reconnects}/{self.max_reconnects})')
+        with self._phase('startup'):
+            self.runner.restart()
+        return simulate(*args)
+
+    def _ensure(self, movie):
+        runner = self.runner
+        if self._socket is None or self._socket is not runner._socket: # first testrun, or restarted by someone else
+            with self._phase('startup'):
+                if not runner.is_alive():
+                    runner.startup()
+                runner.setresultfname('%o/%r/%D/%f_%T%?_s')# default is %t instead of %f. %t uses the whole source file path, with is unreadable
+            self._socket = runner._socket
+            self._movie = False
+            self._mode = None
+            self._out_quants = None
+        if movie and not self._movie:
+            with self._phase('startup'):
+                runner.movie_start()
+                runner.wait_movie_attached(self.attach_timeout)
+            self._movie = True
+
+    def _configure(self, out_quants, mode):
+        runner = self.runner
+        if mode != self._mode:
+            runner.savemode(mode)
+            self._mode = mode
+        if list(out_quants) != self._out_quants:
+            runner.outquantsdelall()
+            runner.outquantsadd(out_quants)
+            self._out_quants = list(out_quants)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        start = time.perf_counter()
+        try:
+            with tracing.span(name, 'carmaker', port=self.runner._tcp_cmd_port):
+                yield
+        finally:
+            duration = time.perf_counter() - start
+            self.timings[name].append(duration)
+            self.runner.timings.setdefault(name, []).append(duration)
     
  
 # cm = CarMakerRunner()
@@ -0,0 +1,107 @@
+import os
+import re
+import numpy as np
+
+# numpy types of the ERG data types, see third_party/cmerg
+TYPES = {'Float': 'f4', 'Double': 'f8', 'LongLong': 'i8', 'ULongLong': 'u8', 'Long': 'i4', 'ULong': 'u4', 'Int': 'i4', 'UInt': 'u4',
+         'Short': 'i2', 'UShort': 'u2', 'Char': 'i1', 'UChar': 'u1'}
+TYPES.update({f'{size} Bytes': f'S{size}' for size in range(1, 8)})
+HEADER = 16 # bytes in front of the first record
+
+# 'Key = value' lines of the info file, continuation lines (starting with a tab) are not needed here
+_ENTRY = re.compile(r'^[ \t]*"?([^=\n]*?)"?[ \t]*=[ \t]*(.*?)[ \t]*$', re.M)
+_SIGNAL = re.compile(r'File\.At\.(\d+)\.(Name|Type)$')
+_QUANTITY = re.compile(r'Quantity\.(.+)\.(Unit|Factor|Offset)$')
+
+
+class ERGSignal():
+    def __init__(self, name, data_type, unit='', factor=None, offset=None):
+        self.name = name
+        self.data_type = data_type
+        self.unit = unit
+        self.factor = factor
+        self.offset = offset
+
+
+def read_info(info_path):
+    # (byteorder, {name: ERGSignal} in record order) of an '.erg.info' file
+    with open(info_path) as info_file:
+        entries = dict(_ENTRY.findall(info_file.read()))
+    byteorder = '>' if entries.get('File.ByteOrder') == 'BigEndian' else '<'
+    columns = {}
+    quantities = {}
+    for key, value in entries.items():
+        match = _SIGNAL.match(key)
+        if match:
+            columns.setdefault(int(match.group(1)), {})[match.group(2)] = value
+            continue
+        match = _QUANTITY.match(key)
+        if match:
+            quantities.setdefault(match.group(1), {})[match.group(2)] = value
+    signals = {}
+    for _, column in sorted(columns.items()):
+        quantity = quantities.get(column['Name'], {})
+        factor = float(quantity['Factor']) if 'Factor' in quantity else None
+        offset = float(quantity.get('Offset', 0.0)) if factor is not None else None
+        signals[column['Name']] = ERGSignal(column['Name'], column['Type'], quantity.get('Unit', ''), factor, offset)
+    return byteorder, signals
+
+
+class MappedERG():
+    # ERG result file mapped into memory instead of read: signals are views into the file, only the pages that
+    # are accessed are read. erg[name] are the raw samples like cmerg's signal.data.
+    def __init__(self, erg_path):
+        self.name = erg_path
+        self.byteorder, self.signals = read_info(str(erg_path) + '.info')
+        self.dtype = np.dtype([(name, self._type(signal.data_type)) for name, signal in self.signals.items()])
+        records = (os.path.getsize(erg_path) - HEADER) // self.dtype.itemsize if self.dtype.itemsize else 0
+        if records > 0:
+            self.records = np.memmap(erg_path, dtype=self.dtype, mode='r', offset=HEADER, shape=(records,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype) # np.memmap can not map empty files
+
+    def _type(self, data_type):
+        numpy_type = TYPES[data_type]
+        return numpy_type if numpy_type.startswith('S') or numpy_type[1] == '1' else self.byteorder + numpy_type
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, name):
+        return name in self.signals
+
+    def __getitem__(self, name):
+        return self.records[name]
+
+    def signal(self, name, scaled=False):
+        samples = self.records[name]
+        signal = self.signals[name]
+        if scaled and signal.factor is not None:
+            return samples * signal.factor + signal.offset
+        return samples
+
+    def last(self, names=None, n=1):
+        # {name: last n samples}, reads only the last n records
+        return self._slice(names, max(len(self.records) - n, 0), len(self.records))
+
+    def window(self, names=None, start=None, stop=None, time='Time'):
+        # {name: samples} with start <= time < stop, the time signal is searched instead of read
+        times = self.records[time]
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        end = len(times) if stop is None else int(np.searchsorted(times, stop, side='left'))
+        return self._slice(names, first, end)
+
+    def _slice(self, names, first, end):
+        # copies, so the results do not keep the file mapped
+        records = self.records[first:end]
+        return {name: np.array(records[name]) for name in (list(self.signals) if names is None else names)}
+
+    def close(self):
+        # views handed out before keep the file mapped until they are gone
+        self.records = np.empty(0, dtype=self.dtype)
@@ -0,0 +1,193 @@
+import argparse
+import os
+import re
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+import zlib
+import numpy as np
+
+# Stand-in for the CarMaker command port. It answers the TCL commands CarMakerRunner sends with the same
+# 'O<reply>' / 'E<reply>' protocol and writes synthetic ERG/info results and IPGMovie pngs, so runners can be
+# exercised without a CarMaker license:
+#   FakeCarMaker(tcp_cmd_port=1025).start()  or  python fakecarmaker.py -cmdport 1025 -apphost localhost
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeCarMaker():
+    def __init__(self, tcp_cmd_port=1024, host='localhost', project_path=None, sim_time=0.0, signals=None, png_size=(768, 576), samples=100,
+                 reply_chunk=None, delays=None):
+        self.tcp_cmd_port = tcp_cmd_port
+        self.host = host
+        self.project_path = project_path if project_path else tempfile.mkdtemp(prefix='fakecarmaker_')
+        self.sim_time = sim_time # seconds a simulation takes
+        self.signals = signals if signals else zero_signals # signals(testrun_path, out_quants, samples) -> {name: array}
+        self.png_size = png_size
+        self.samples = samples
+        self.reply_chunk = reply_chunk # bytes per write, splits replies like a slow connection
+        self.delays = delays if delays else {} # {command prefix: seconds} before the reply, to test timeouts
+        self.commands = [] # every received command, for tests
+        self.testrun_path = None
+        self.out_quants = []
+        self.status = -2
+        self.last_result = ''
+        self._results = 0
+        self._server = None
+        self._thread = None
+        self._connections = set()
+
+    def start(self):
+        fake = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake._connections.add(self.connection)
+                for line in self.rfile:
+                    command = line.decode('utf-8').strip()
+                    if not command:
+                        continue
+                    ok, reply = fake.execute(command)
+                    try:
+                        fake._reply(self.wfile, command, bytes(f'{"O" if ok else "E"}{reply}\r\n\r\n', 'utf-8'))
+                    except OSError:
+                        break # client is gone
+                    if command == 'GUI quit':
+                        break
+        self._server = _Server((self.host, self.tcp_cmd_port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # also drops open connections, so a stopped fake looks like a crashed CarMaker to its clients
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for connection in list(self._connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+                connection.close()
+            except OSError:
+                pass
+        self._connections.clear()
+
+    def serve_forever(self):
+        self.start()
+        self._thread.join()
+
+    def execute(self, command):
+        self.commands.append(command)
+        words = command.split(' ')
+        if command == 'ProjectInfo path':
+            return True, self.project_path
+        if command == 'ProjectInfo version':
+            return True, '10.0'
+        if words[0] in ('Application', 'GUI', 'SaveMode', 'SetResultFName', 'QuantSubscribe', 'PopupCtrl'):
+            return True, ''
+        if words[0] == 'LoadTestRun':
+            self.testrun_path = _unescape(command.split(' ', 1)[1].strip('"'))
+            return True, ''
+        if words[0] == 'OutQuantsDelAll':
+            self.out_quants = []
+            return True, ''
+        if words[0] in ('OutQuantsAdd', 'OutQuantsDel'):
+            quants = re.findall(r'\{(.*)\}', command)[0].split()
+            if words[0] == 'OutQuantsAdd':
+                self.out_quants += [quant for quant in quants if quant not in self.out_quants]
+            else:
+                self.out_quants = [quant for quant in self.out_quants if quant not in quants]
+            return True, ''
+        if words[0] == 'StartSim':
+            if self.testrun_path is None:
+                return False, ''
+            self.status = 0
+            return True, ''
+        if words[0] == 'StopSim':
+            self.status = -2
+            return True, ''
+        if words[0] == 'SimStatus':
+            return True, str(self.status)
+        if words[0] == 'WaitForStatus':
+            if words[1] == 'idle' and self.status == 0:
+                time.sleep(self.sim_time)
+                self._write_result()
+                self.status = -2
+            return True, '0'
+        if words[0] == 'GetLastResultFName':
+            return True, self.last_result
+        if words[0] == 'Movie':
+            if words[1] == 'attach':
+                return True, '1'
+            if words[1] == 'export':
+                write_png(_unescape(words[3]), self.png_size)
+                return True, ''
+            return True, ''
+        return False, ''
+
+    def _reply(self, wfile, command, reply):
+        time.sleep(max([seconds for prefix, seconds in self.delays.items() if command.startswith(prefix)], default=0))
+        chunk = self.reply_chunk or len(reply)
+        for start in range(0, len(reply), chunk):
+            wfile.write(reply[start:start + chunk])
+            wfile.flush()
+
+    def _write_result(self):
+        self._results += 1
+        name = os.path.basename(self.testrun_path.replace('\\', '/'))
+        self.last_result = f'SimOutput/fake/{name}_{self._results}.erg'
+        erg_path = os.path.join(self.project_path, self.last_result)
+        os.makedirs(os.path.dirname(erg_path), exist_ok=True)
+        signals = {'Time': np.linspace(0, 0.01 * (self.samples - 1), self.samples)}
+        signals.update(self.signals(self.testrun_path, self.out_quants, self.samples))
+        write_erg(erg_path, signals)
+
+
+def zero_signals(testrun_path, out_quants, samples):
+    return {quant: np.zeros(samples) for quant in out_quants}
+
+def write_erg(erg_path, signals):
+    # Double signals, 16 byte header like CarMaker, one blank line between the signal definitions of the info file
+    lines = ['#INFOFILE1.1 - Do not remove this line!', 'File.Format = erg', 'File.ByteOrder = LittleEndian',
+             f'File.DateInSeconds = {int(time.time())}', '']
+    for index, name in enumerate(signals, 1):
+        lines += [f'File.At.{index}.Name = {name}', f'File.At.{index}.Type = Double', '']
+    with open(erg_path + '.info', 'w') as info_file:
+        info_file.write('\n'.join(lines))
+    records = np.rec.fromarrays([np.asarray(data, dtype='<f8') for data in signals.values()], names=list(signals))
+    with open(erg_path, 'wb') as erg_file:
+        erg_file.write(b'CM-ERG'.ljust(16, b'\0'))
+        erg_file.write(records.tobytes())
+
+def write_png(png_path, size=(768, 576)):
+    # grey RGB frame, written without an imaging library
+    width, height = size
+    os.makedirs(os.path.dirname(png_path) or '.', exist_ok=True)
+    raw = (b'\0' + b'\x80' * (3 * width)) * height
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    with open(png_path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+                       + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def _unescape(path):
+    # CarMakerRunner doubles backslashes for TCL
+    path = path.replace('\\\\', '\\')
+    if os.sep == '/':
+        path = path.replace('\\', '/')
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-cmdport', type=int, default=1024)
+    parser.add_argument('-apphost', default='localhost')
+    parser.add_argument('-project', default=None)
+    parser.add_argument('-simtime', type=float, default=0.0)
+    args = parser.parse_args()
+    FakeCarMaker(args.cmdport, args.apphost, args.project, args.simtime).serve_forever()
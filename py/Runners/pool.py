@@ -0,0 +1,123 @@
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .base import BaseRunner
+from .carmaker import CarMakerRunner
+from IOHandlers.testruns import TestrunStore
+from MetadataStores.journal import StageJournal
+from MetadataStores.tomlfiles import TomlStore
+import tracing
+
+class CarMakerPool(BaseRunner):
+    # Runs N CarMaker applications on the command ports first_cmd_port, first_cmd_port+1, ... and hands every
+    # pending instance to the next free one. A worker that stops answering is restarted and its instance requeued.
+    def __init__(self, executable_path=None, workers=2, first_cmd_port=1024, convert_results=True, log_level=1, launch=True, max_restarts=3, retries=1, result_cache=None):
+        super().__init__()
+
+        # define aliases for standard methods
+        self.simulate_testruns = self._evaluate_instances
+        self.simulate_movies = self._evaluate_movies
+
+        self._log_level = log_level
+        self._max_restarts = max_restarts
+        self._retries = retries
+        self.restarts = {}
+        self.workers = [CarMakerRunner(executable_path, keep_alive=True, convert_results=convert_results, log_level=log_level,
+                                       tcp_cmd_port=first_cmd_port + i, launch=launch, result_cache=result_cache) for i in range(workers)]
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+    def _evaluate_instance(self, testrun_path, out_quants=[], mode='save_all'):
+        return self.workers[0]._evaluate_instance(testrun_path, out_quants, mode)
+
+    def _evaluate_instances(self, testrun_paths, out_quants=[], mode='save_all'):
+        simulation_results = {}
+        jobs = ((testrun_path, testrun_path) for testrun_path in testrun_paths)
+        with self._sessions():
+            for testrun_path, result in self._dispatch(jobs, lambda worker, path: worker._evaluate_instance(path, out_quants, mode)):
+                simulation_results[testrun_path] = result
+        return simulation_results
+
+    def _evaluate_movies(self, grid_path, out_quants=['Vhcl.Fr1.x', 'Vhcl.Fr1.y','Vhcl.Fr1.z'], camera_name='Dev_Xu', mode='save_all', store=TomlStore):
+        metadata = store.from_grid_path(grid_path)
+        testruns = TestrunStore(metadata)
+        with tracing.span(f'{type(self).__name__}.simulate_movies', 'runner'), StageJournal(metadata, 'ipg_result') as journal:
+            jobs = testruns.jobs(journal.pending(grid_path))
+            # results come back to this thread, so the metadata is only ever written from here
+            for key, results in self.stream_movies(jobs, out_quants, camera_name, mode):
+                journal.commit(key, CarMakerRunner._movie_results(results))
+                testruns.release(key)
+
+    def stream_movies(self, jobs, out_quants, camera_name='Dev_Xu', mode='save_all'):
+        # same as CarMakerRunner.stream_movies, results arrive in the order the workers finish
+        with self._sessions(camera_name):
+            yield from self._dispatch(jobs, lambda worker, path: worker._evaluate_movie(path, out_quants, camera_name, mode))
+
+    def _sessions(self, camera_name=None):
+        # one warm session per worker for the whole sweep, crashed workers are restarted by _recover instead
+        sessions = contextlib.ExitStack()
+        for worker in self.workers:
+            sessions.enter_context(worker.session(camera_name, max_reconnects=0))
+        return sessions
+
+    def _dispatch(self, jobs, evaluate):
+        # yields (job_id, result) as workers finish; jobs is consumed lazily, one job per free worker.
+        # A failed worker is recovered in the executor as well, the other workers keep getting jobs meanwhile.
+        jobs = iter(jobs)
+        free = list(self.workers)
+        running = {} # future -> (job, worker), job is None while the worker is recovered
+        requeued = []
+        attempts = {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=len(self.workers)) as executor:
+            while True:
+                while free:
+                    if requeued:
+                        job = requeued.pop(0)
+                    else:
+                        job = next(jobs, None)
+                        if job is None:
+                            break
+                    worker = free.pop(0)
+                    running[executor.submit(evaluate, worker, job[1])] = (job, worker)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, worker = running.pop(future)
+                    if job is None:
+                        if future.exception() is None and future.result():
+                            free.append(worker) # otherwise the worker is dropped from the pool
+                        continue
+                    if future.exception() is None:
+                        free.append(worker)
+                        yield job[0], future.result()
+                        continue
+                    attempts[job[0]] = attempts.get(job[0], 0) + 1
+                    if self._log_level <= 1:
+                        print(f'Worker {worker._tcp_cmd_port} failed on {job[0]}: {future.exception()!r}')
+                    if attempts[job[0]] <= self._retries:
+                        requeued.append(job)
+                    else:
+                        failed[job[0]] = future.exception()
+                    running[executor.submit(self._recover, worker)] = (None, worker)
+        if requeued or failed or next(jobs, None) is not None:
+            raise ValueError(f'CarMaker pool could not simulate {sorted(map(str, failed)) + [str(job[0]) for job in requeued]}, run again to resume')
+
+    def _recover(self, worker):
+        # True once the worker answers again, runs in the dispatch executor
+        if worker.is_alive():
+            return True
+        port = worker._tcp_cmd_port
+        while self.restarts.get(port, 0) < self._max_restarts:
+            self.restarts[port] = self.restarts.get(port, 0) + 1
+            if self._log_level <= 1:
+                print(f'Restarting CarMaker on port {port} ({self.restarts[port]}/{self._max_restarts})')
+            try:
+                worker.restart()
+            except Exception:
+                continue
+            if worker.is_alive():
+                return True
+        return False
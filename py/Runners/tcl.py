@@ -0,0 +1,204 @@
+import asyncio
+import collections
+import contextlib
+import os
+
+# asyncio client of the CarMaker command port. Every reply is 'O<result>' or 'E<message>' followed by an empty
+# line, so replies are split at TERMINATOR and not at whatever a single recv returns.
+#   async with TclClient(1024) as client:
+#       await client.command('ProjectInfo version', timeout=5)
+TERMINATOR = b'\r\n\r\n'
+
+class CarMakerCommandError(Exception):
+    pass
+
+class TclTransmissionError(Exception):
+    pass
+
+
+def parse_reply(command, reply, raise_on_error=True):
+    # result of one reply without its terminator, b'' if the connection was closed
+    reply = reply.decode('utf-8').replace('\r\n','')
+    tcl_error = reply[:1]
+    if tcl_error == 'O':
+        pass # received Ok
+    elif tcl_error == '':
+        pass # nothing received
+    elif tcl_error == 'E':
+        if raise_on_error:
+            raise CarMakerCommandError(f'Unknown CarMaker Command:\n{command}')
+    else:
+        raise TclTransmissionError(f"Unknown TCL return code either 'E' or 'O' expected. \n Received: '{tcl_error}'")
+    return reply[1:] # Strip E/O message
+
+
+class TclClient():
+    # One connection to one CarMaker. Commands are pipelined: command() sends at once and waits for its own reply,
+    # CarMaker answers in the order the commands arrived. A command that times out or is cancelled keeps its place
+    # in the queue and its late reply is dropped, so the connection stays usable. Several clients on different
+    # ports run concurrently in one event loop, see simulate_testruns.
+    def __init__(self, tcp_cmd_port=1024, host='localhost', timeout=None, log_level=1, raise_on_error=True, limit=2**24):
+        self.tcp_cmd_port = tcp_cmd_port
+        self.host = host
+        self.timeout = timeout # seconds per command, None waits forever
+        self.project_path = None
+        self._log_level = log_level
+        self._raise_on_error = raise_on_error
+        self._limit = limit # longest reply in bytes
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._waiting = collections.deque() # (command, future) in the order they were sent
+        self._error = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+        return False
+
+    async def connect(self, attempts=100, interval=0.1):
+        for attempt in range(attempts):
+            try:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.tcp_cmd_port, limit=self._limit)
+                break
+            except OSError:
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(interval)
+        self._error = None
+        self._receiver = asyncio.ensure_future(self._receive())
+        self.project_path = await self.command('ProjectInfo path')
+        if self._log_level <= 1:
+            print(f'CarMaker on port {self.tcp_cmd_port} ready, project directory: {self.project_path}')
+        return self
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(OSError):
+                await self._writer.wait_closed()
+            self._writer = None
+        if self._receiver is not None:
+            self._receiver.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._receiver
+            self._receiver = None
+        self._fail(ConnectionResetError(f'connection to CarMaker on port {self.tcp_cmd_port} closed'))
+
+    async def command(self, command, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        future = self._send(command)
+        await self._writer.drain()
+        reply = await asyncio.wait_for(future, timeout) # on timeout wait_for cancels the future, _receive drops its reply
+        reply = parse_reply(command, reply, self._raise_on_error)
+        if self._log_level <= 0:
+            print(f'TCL <- {reply}')
+        return reply
+
+    async def commands(self, commands, timeout=None):
+        # all commands in one write, replies in order. A failing command does not stop the others.
+        futures = [self._send(command) for command in commands]
+        await self._writer.drain()
+        timeout = self.timeout if timeout is None else timeout
+        replies = await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        return [parse_reply(command, reply, self._raise_on_error) for command, reply in zip(commands, replies)]
+
+    async def simulate(self, testrun_path, out_quants=(), mode='save_all', timeout=None):
+        # path of the ERG file of one simulation. Everything up to the start is sent in one round trip,
+        # timeout only limits the simulation itself. A simulation that times out or is cancelled is stopped.
+        await self.commands([f'LoadTestRun "{testrun_path}"'.replace('\\','\\\\'), f'SaveMode {mode}', 'OutQuantsDelAll',
+                             f'OutQuantsAdd {{{" ".join(out_quants)}}}', 'StartSim', 'WaitForStatus running 10000'])
+        try:
+            await self.command('WaitForStatus idle', timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if self._receiver is not None and not self._receiver.done():
+                self._send('StopSim').cancel() # reply is not waited for
+            raise
+        return os.path.join(self.project_path, await self.command('GetLastResultFName'))
+
+    def _send(self, command):
+        if self._receiver is None or self._receiver.done():
+            raise self._error or ConnectionResetError(f'not connected to CarMaker on port {self.tcp_cmd_port}')
+        if self._log_level <= 0:
+            print(f'TCL -> {command}')
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((command, future))
+        self._writer.write(bytes(f'{command}\n', 'utf-8'))
+        return future
+
+    async def _receive(self):
+        try:
+            while True:
+                reply = await self._reader.readuntil(TERMINATOR)
+                if not self._waiting:
+                    raise TclTransmissionError(f'Reply without command received: {reply!r}')
+                _, future = self._waiting.popleft()
+                if not future.done():
+                    future.set_result(reply[:-len(TERMINATOR)])
+        except asyncio.IncompleteReadError:
+            self._error = ConnectionResetError(f'CarMaker on port {self.tcp_cmd_port} closed the connection')
+        except asyncio.LimitOverrunError:
+            self._error = TclTransmissionError(f'Reply longer than {self._limit} bytes')
+        except (OSError, TclTransmissionError) as error:
+            self._error = error
+        finally:
+            self._fail(self._error or ConnectionResetError(f'connection to CarMaker on port {self.tcp_cmd_port} closed'))
+
+    def _fail(self, error):
+        while self._waiting:
+            _, future = self._waiting.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+
+async def stream_testruns(tcp_cmd_ports, testrun_paths, out_quants=(), mode='save_all', timeout=None, host='localhost', log_level=1):
+    # (testrun path, ERG path or exception) as the CarMakers on tcp_cmd_ports finish, one connection per port.
+    # The testrun of a lost connection goes back to the queue for the other CarMakers, only when no connection
+    # is left the remaining testruns get the connection error.
+    queue = asyncio.Queue()
+    for testrun_path in testrun_paths:
+        queue.put_nowait(testrun_path)
+    count = queue.qsize()
+    results = asyncio.Queue()
+    alive = len(tcp_cmd_ports)
+
+    async def work(client):
+        nonlocal alive
+        while True:
+            testrun_path = await queue.get()
+            try:
+                result = await client.simulate(testrun_path, out_quants, mode, timeout)
+            except (asyncio.TimeoutError, CarMakerCommandError) as error: # TimeoutError is an OSError
+                result = error
+            except (OSError, TclTransmissionError) as error:
+                alive -= 1
+                if log_level <= 1:
+                    print(f'Lost CarMaker on port {client.tcp_cmd_port} at {testrun_path}: {error!r}')
+                if alive:
+                    queue.put_nowait(testrun_path)
+                    return
+                await results.put((testrun_path, error))
+                while not queue.empty():
+                    await results.put((queue.get_nowait(), error))
+                return
+            await results.put((testrun_path, result))
+
+    async with contextlib.AsyncExitStack() as clients:
+        workers = [asyncio.ensure_future(work(await clients.enter_async_context(TclClient(port, host, log_level=log_level))))
+                   for port in tcp_cmd_ports]
+        try:
+            for _ in range(count):
+                yield await results.get()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+def simulate_testruns(tcp_cmd_ports, testrun_paths, out_quants=(), mode='save_all', timeout=None, host='localhost', log_level=1):
+    # {testrun path: ERG path or exception}, blocking wrapper of stream_testruns
+    async def collect():
+        return {testrun_path: result async for testrun_path, result in
+                stream_testruns(tcp_cmd_ports, testrun_paths, out_quants, mode, timeout, host, log_level)}
+    return asyncio.run(collect())
@@ -1,4 +1,6 @@
 from abc import abstractmethod
+from MetadataStores.tomlfiles import TomlStore
+import tracing
 
 
 class BaseScoreCalculator():
@@ -6,16 +8,16 @@ class BaseScoreCalculator():
         pass
     
     @classmethod
-    def parse_results(cls, grid_path, out_quants, camera_name):
-        return cls._parse_results(grid_path, out_quants, camera_name)
+    def parse_results(cls, grid_path, out_quants, camera_name, **calculator_kwargs):
+        with tracing.span(f'{cls.__name__}.parse_results', 'score'):
+            return cls._parse_results(grid_path, out_quants, camera_name, **calculator_kwargs)
     
-    def interpolation(self, n=2):
-        pass
-        """
-        for path, score in self.parse_results():
-            score[0]    
-        return self._interpolation()
-        """  
+    @staticmethod
+    def interpolation(grid_path, method='linear', store=TomlStore):
+        # safety score of arbitrary parameter combinations from the scored instances of the grid
+        from Surrogates.grid import GridSurrogate
+        return GridSurrogate.from_grid(grid_path, method, store)
+
     @classmethod      
     @abstractmethod
     def _parse_results(cls, grid_path):
@@ -1,72 +1,118 @@
 import math
+import os
 import numpy as np
 
-def transform_matrix_carmera(camera_name, camera_cfg_filpath = r"C:\Arbeit\Carmaker_test\Movie\Camera.cfg"):
-    breakinfo = 0
+CAMERA_CFG = r"C:\Arbeit\Carmaker_test\Movie\Camera.cfg" # used when no path is given, can be set once for all modules
+
+
+class CameraModel():
+    # Pinhole camera of IPGMovie: R rotates camera into world coordinates (roll, pitch, yaw in degrees from
+    # Camera.cfg), T is the camera position and f the focal length. Models are parsed once per camera and
+    # Camera.cfg, and parsed again when the file changes.
+    _models = {} # (cfg path, camera name, fov) -> (mtime, model)
+
+    def __init__(self, R, T, f):
+        self.R = np.asarray(R, dtype=float)
+        self.T = np.asarray(T, dtype=float)
+        self.f = f
+
+    @classmethod
+    def load(cls, camera_name, camera_cfg_filpath=None, fov=50):
+        camera_cfg_filpath = camera_cfg_filpath or CAMERA_CFG
+        mtime = os.path.getmtime(camera_cfg_filpath)
+        key = (camera_cfg_filpath, camera_name, fov)
+        cached = cls._models.get(key)
+        if cached is None or cached[0] != mtime:
+            intrinsic = transform_matrix_carmera(camera_name, camera_cfg_filpath)
+            cached = (mtime, cls(intrinsic['R'], intrinsic['T'], fov_f(fov)))
+            cls._models[key] = cached
+        return cached[1]
+
+    def to_camera(self, points):
+        # (N, 3) world points in camera coordinates, x along the optical axis
+        return (np.asarray(points, dtype=float) - self.T) @ self.R
+
+    def project(self, points):
+        # (N, 2) normalised image coordinates (0..1 inside the png) of (N, 3) world points
+        joint_cam = self.to_camera(np.reshape(points, (-1, 3)))
+        return np.stack(camera_pic(self.f, joint_cam.T), axis=1)
+
+
+def read_camera_cfg(camera_name, camera_cfg_filpath=None):
+    # {'Pos': [x, y, z], 'dist': d, 'rot': [roll, pitch, yaw]} of the camera, from the line naming it to its 'rot'
+    camera_cfg_filpath = camera_cfg_filpath or CAMERA_CFG
+    config = {}
+    found = False
     with open(camera_cfg_filpath) as camera_txt:
         for line in camera_txt:
-            if breakinfo == 0:
-                if '=' in line:
-                    check_camera_name = line.split('=')[1].strip()
-                    if check_camera_name == camera_name:
-                        breakinfo = 1
-            else:
-                if '=' in line:
-                    check_letter = line.split('=')[0].split('.')[2].strip()
-                    if check_letter == 'Pos':
-                        pos = line.split('=')[1].strip().split(' ')
-                        pos = [float(pos[0]), float(pos[1]), float(pos[2])]
-                    if check_letter == 'dist':
-                        dist = line.split('=')[1].strip()
-                        dist = float(dist)
-                    if check_letter == 'rot':
-                        rot = line.split('=')[1].strip().split(' ')
-                        rot = [float(rot[0]), float(rot[1]), float(rot[2])]
-                        break
-        R = Rotation(rot)
-        T = [-(dist-pos[0]), pos[1], pos[2]]
-        human36m_camera_intrinsic = {'R':R, 'T':T}
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            if not found:
+                found = value.strip() == camera_name
+                continue
+            fields = key.split('.')
+            check_letter = fields[2].strip() if len(fields) > 2 else ''
+            if check_letter in ('Pos', 'rot'):
+                config[check_letter] = [float(item) for item in value.strip().split(' ')[:3]]
+            if check_letter == 'dist':
+                config[check_letter] = float(value.strip())
+            if check_letter == 'rot':
+                break
+    if not found:
+        raise KeyError(f'camera {camera_name} not in {camera_cfg_filpath}')
+    return config
+
+def transform_matrix_carmera(camera_name, camera_cfg_filpath = None):
+    config = read_camera_cfg(camera_name, camera_cfg_filpath)
+    pos, dist, rot = config['Pos'], config['dist'], config['rot']
+    R = Rotation(rot)
+    T = [-(dist-pos[0]), pos[1], pos[2]]
+    human36m_camera_intrinsic = {'R':R, 'T':T}
     return human36m_camera_intrinsic
 
 def Rotation(rot):
-    r = rot[0] 
+    r = rot[0]
     p = rot[1]
     y = rot[2]
-    
+
     y = y*np.pi/180.0
     p = p*np.pi/180.0
-    r = r*np.pi/180.0        
-    
-    Rr = np.matrix([[1.0, 0.0, 0.0],[0.0, np.cos(r), -np.sin(r)],[0.0, np.sin(r), np.cos(r)]])
-    Rp = np.matrix([[np.cos(p), 0.0, np.sin(p)],[0.0, 1.0, 0.0],[-np.sin(p), 0.0, np.cos(p)]])
-    Ry = np.matrix([[np.cos(y), -np.sin(y), 0.0],[np.sin(y), np.cos(y), 0.0],[0.0, 0.0, 1.0]])
-    return Ry*Rp*Rr
+    r = r*np.pi/180.0
+
+    Rr = np.array([[1.0, 0.0, 0.0],[0.0, np.cos(r), -np.sin(r)],[0.0, np.sin(r), np.cos(r)]])
+    Rp = np.array([[np.cos(p), 0.0, np.sin(p)],[0.0, 1.0, 0.0],[-np.sin(p), 0.0, np.cos(p)]])
+    Ry = np.array([[np.cos(y), -np.sin(y), 0.0],[np.sin(y), np.cos(y), 0.0],[0.0, 0.0, 1.0]])
+    return Ry@Rp@Rr
 
 def ground_truth(joint_world, human36m_camera_intrinsic, camera_name):
+    # world to camera coordinates, R maps camera into world coordinates so its transpose is applied
     camera_intrinsic = human36m_camera_intrinsic
     joint_world = np.asarray(joint_world)
     R = np.asarray(camera_intrinsic["R"])
     T = np.asarray(camera_intrinsic["T"])
-    joint_cam = np.dot(R, (joint_world - T).T).T
+    joint_cam = (joint_world - T) @ R
     return joint_cam
 
 def fov_f(fov, monitor_size=15.6, monitor_resolution=(1920, 1080), scale=1.25, png_resolution=(768, 576)):
     inch_m = 2.54/100
     ppi = math.sqrt(monitor_resolution[0]**2 + monitor_resolution[1]**2)/monitor_size
     ipp = 1/ppi
-    if png_resolution[0] >= png_resolution[1]: 
+    if png_resolution[0] >= png_resolution[1]:
         f = png_resolution[0]*ipp*inch_m*scale/(2*math.tan((fov/2)/180*math.pi))
     else:
         f = png_resolution[1]*ipp*inch_m*scale/(2*math.tan((fov/2)/180*math.pi))
     return f
 
 def camera_pic(f, point):
+    # point: (x, y, z) in camera coordinates, each may be an array
     coor_x = ((f*point[1]/point[0])+0.1726/2)/0.1726
     coor_y = (0.1293/2-f*point[2]/point[0])/0.1293
     return (coor_x, coor_y)
 
 def camera(joint_world, camera_name, fov=50):
-    human36m_camera_intrinsic = transform_matrix_carmera(camera_name, camera_cfg_filpath = r"C:\Arbeit\Carmaker_test\Movie\Camera.cfg")
-    joint_cam = ground_truth(joint_world, human36m_camera_intrinsic, camera_name)
-    f = fov_f(fov)
-    return (camera_pic(f,joint_cam))
\ No newline at end of file
+    # (x, y) in the image of one world point, (N, 2) for (N, 3) points
+    projected = CameraModel.load(camera_name, fov=fov).project(joint_world)
+    if np.ndim(joint_world) == 1:
+        return tuple(projected[0])
+    return projected
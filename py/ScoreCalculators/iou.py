@@ -1,72 +1,116 @@
 import os
 import numpy as np
-import toml
 
 from ScoreCalculators.base import BaseScoreCalculator
 from ScoreCalculators.camera import camera
-
-class rec():
-    def __init__(self, x_center, y_center, width, height):
-        self.x_center = x_center
-        self.y_center = y_center
-        self.width = width
-        self.height = height
-    def transform(self):
-        x1 = self.x_center - self.width/2
-        x2 = self.x_center + self.width/2
-        y1 = self.y_center - self.height/2
-        y2 = self.y_center + self.height/2
-        return x1, x2, y1, y2
+from IOHandlers.testruns import TestrunStore
+from MetadataStores.journal import StageJournal
+from MetadataStores.tomlfiles import TomlStore
 
 class IouScoreCalculator(BaseScoreCalculator):
     def __init__(self):
         pass
     
     @classmethod
-    def _parse_results(cls, grid_path, out_quants, camera_name='Dev_Xu'):
-        with open(grid_path) as toml_file:
-            grid = toml.load(toml_file)
-            for key, value in grid['instances'].items():
-                with open(value, 'r') as toml_file:
-                    instance = toml.load(toml_file)
-                with open(value, 'w') as toml_file:
-                    if instance['properties']['sc_result'] == 0:
-                        txt_path = instance['results']['yolov5']
-                        world_x = float(instance['results']['ipgresult'][out_quants[0]])
-                        world_y = float(instance['results']['ipgresult'][out_quants[1]])
-                        world_z = float(instance['results']['ipgresult'][out_quants[2]])
-                        sc = cls._parse_result(txt_path, world_x, world_y, world_z, camera_name)
-                        instance['results']['safetyscore'] = sc
-                        instance['properties']['sc_result'] = 1
-                    toml.dump(instance, toml_file)
+    def _parse_results(cls, grid_path, out_quants, camera_name='Dev_Xu', store=TomlStore, chunk_size=10000):
+        # all pending instances are scored at once, an interruption loses at most one chunk
+        metadata = store.from_grid_path(grid_path)
+        with StageJournal(metadata, 'sc_result') as journal:
+            journal.recover()
+            pending = list(metadata.pending_instances(grid_path, 'sc_result').items())
+            for start in range(0, len(pending), chunk_size):
+                chunk = pending[start:start + chunk_size]
+                journal.begin(*[key for key, _ in chunk])
+                world = [[float(instance['results']['ipgresult'][quant]) for quant in out_quants[:3]] for _, instance in chunk]
+                scores = cls.score_batch([instance['results']['yolov5'] for _, instance in chunk], world, camera_name)
+                journal.commit_all({key: {'results': {'safetyscore': float(sc)}} for (key, _), sc in zip(chunk, scores)})
+
+    @classmethod
+    def rescore(cls, grid_path, out_quants, result_cache, camera_name='Dev_Xu', time=None, store=TomlStore):
+        # safety score of every detected instance again, with GT from the ResultCache instead of CarMaker.
+        # time: GT at this simulation time instead of the end of the simulation
+        metadata = store.from_grid_path(grid_path)
+        with StageJournal(metadata, 'sc_result') as journal:
+            journal.recover()
+            detected = {key: instance for key, instance in metadata.grid_instances(grid_path).items() if instance['properties']['yolo_result'] == 1}
+            testruns = TestrunStore(metadata) # removed testruns are written again for their hash
+            world = []
+            for key, instance in detected.items():
+                cached = result_cache.at(result_cache.key(testruns.materialize(key, instance)), out_quants, time)
+                testruns.release(key)
+                if cached is None:
+                    raise KeyError(f'no cached result with {out_quants} for instance {key}, simulate it again')
+                world.append([float(cached[quant]) for quant in out_quants[:3]])
+            journal.begin(*detected)
+            scores = cls.score_batch([instance['results']['yolov5'] for instance in detected.values()], world, camera_name)
+            journal.commit_all({key: {'results': {'safetyscore': float(sc)}} for key, sc in zip(detected, scores)})
+        from Evaluaters.GCI import GCIEvaluater
+        GCIEvaluater.invalidate(metadata, detected)
+
+    @classmethod
+    def _score_instance(cls, instance, out_quants, camera_name='Dev_Xu'):
+        txt_path = instance['results']['yolov5']
+        world_x = float(instance['results']['ipgresult'][out_quants[0]])
+        world_y = float(instance['results']['ipgresult'][out_quants[1]])
+        world_z = float(instance['results']['ipgresult'][out_quants[2]])
+        return cls._parse_result(txt_path, world_x, world_y, world_z, camera_name)
     
+    @classmethod
+    def _parse_result(cls, txt_path, world_x, world_y, world_z, camera_name):
+        return float(cls.score_batch([txt_path], [[world_x, world_y, world_z]], camera_name)[0])
+
+    @classmethod
+    def score_batch(cls, txt_paths, world, camera_name):
+        # safety score of many instances: the highest IoU * confidence of their detections with the GT box, 0 without label file
+        labels, owners = load_labels(txt_paths)
+        world = np.asarray(world, dtype=float).reshape(-1, 3)
+        detected = np.unique(owners) # the camera is only needed where something was detected
+        gt = np.zeros((len(world), 4))
+        if len(detected):
+            gt[detected] = cls._gt_boxes(world[detected], camera_name)
+        gt = gt[owners]
+        iou = iou_batch(labels[:, 1] - labels[:, 3]/2, labels[:, 1] + labels[:, 3]/2, labels[:, 2] - labels[:, 4]/2, labels[:, 2] + labels[:, 4]/2,
+                        gt[:, 0], gt[:, 1], gt[:, 2], gt[:, 3])
+        scores = np.zeros(len(txt_paths))
+        np.fmax.at(scores, owners, iou * labels[:, 5]) # fmax skips nan like the comparison did
+        return scores
+
     @staticmethod
-    def _parse_result(txt_path, world_x, world_y, world_z, camera_name):
-        if not os.path.exists(txt_path):
-            iou = 0
-            sc = 0 
-        else:
-            coor_rightup = camera([world_x, world_y+0.9, world_z+1.49], camera_name) # Fog version
-            coor_leftbot = camera([world_x, world_y-0.9, world_z], camera_name) #
-            #coor_rightup = camera([world_x, world_y+0.9, world_z+0.86], camera_name) # Two cars version
-            #coor_leftbot = camera([world_x, world_y-0.9, world_z-0.83], camera_name) #
-            sc = 0
-            with open(txt_path) as txt_result:
-                for line in txt_result:
-                    if line:
-                        coordinates = line.split()[1:6] 
-                        coordinates = list(map(float, coordinates)) 
-                        confidence = coordinates[4]
-                        rec_instacne = rec(coordinates[0], coordinates[1], coordinates[2], coordinates[3]).transform()
-                        iou = Iou(rec_instacne[0], rec_instacne[1], rec_instacne[2], rec_instacne[3],\
-                                  coor_leftbot[0], coor_rightup[0], coor_rightup[1], coor_leftbot[1])
-                        sc_new = iou * confidence
-                        if sc_new > sc: 
-                            sc = sc_new
-        return sc
-    
+    def _gt_boxes(world, camera_name):
+        # (xmin, xmax, ymin, ymax) in the image of the car at every world position, all corners in one projection
+        rightup = world + [0, 0.9, 1.49] # Fog version
+        leftbot = world + [0, -0.9, 0] #
+        #rightup = world + [0, 0.9, 0.86] # Two cars version
+        #leftbot = world + [0, -0.9, -0.83] #
+        corners = np.asarray(camera(np.concatenate([rightup, leftbot]).reshape(-1, 3), camera_name)).reshape(2, len(world), 2)
+        return np.stack([corners[1, :, 0], corners[0, :, 0], corners[0, :, 1], corners[1, :, 1]], axis=1)
+
+
+def load_labels(txt_paths):
+    # YOLO label lines (class x_center y_center width height confidence) of all files as (N, 6) array,
+    # and the index of the file of every line. Missing files have no lines.
+    labels, owners = [], []
+    for index, txt_path in enumerate(txt_paths):
+        if not txt_path or not os.path.exists(txt_path):
+            continue
+        with open(txt_path) as txt_result:
+            values = np.array(txt_result.read().split(), dtype=float).reshape(-1, 6)
+        labels.append(values)
+        owners.append(np.full(len(values), index))
+    if not labels:
+        return np.empty((0, 6)), np.empty(0, dtype=np.int64)
+    return np.concatenate(labels), np.concatenate(owners).astype(np.int64)
+
+def iou_batch(axmin, axmax, aymin, aymax, bxmin, bxmax, bymin, bymax):
+    # Iou for arrays of boxes, same formula
+    width = np.minimum(axmin,bxmin) + (axmax-axmin) + (bxmax-bxmin) - np.maximum(axmax,bxmax)
+    height = np.minimum(aymin,bymin) + (aymax-aymin) + (bymax-bymin) - np.maximum(aymax,bymax)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = width*height/((aymax-aymin)*(axmax-axmin) + (aymax-aymin)*(axmax-axmin) - width*height)
+    return np.maximum(iou, 0)
+
 def Iou(axmin, axmax, aymin, aymax, bxmin, bxmax, bymin, bymax):
     width = min(axmin,bxmin) + (axmax-axmin) + (bxmax-bxmin) - max(axmax,bxmax)
     height = min(aymin,bymin) + (aymax-aymin) + (bymax-bymin) - max(aymax,bymax)
     return max(width*height/(
-        (aymax-aymin)*(axmax-axmin) + (aymax-aymin)*(axmax-axmin) - width*height), 0)  
\ No newline at end of file
+        (aymax-aymin)*(axmax-axmin) + (aymax-aymin)*(axmax-axmin) - width*height), 0)
\ No newline at end of file
@@ -0,0 +1,123 @@
+from MetadataStores.tomlfiles import TomlStore
+import numpy as np
+
+class GridSurrogate():
+    # Safety score of arbitrary parameter combinations, interpolated from the scored instances of a grid.
+    # The scores are kept on the tensor product of the parameter values of all instances (nan where no instance
+    # is scored), 'linear' is multilinear interpolation in numpy, the other methods ('cubic', 'pchip', ...) go
+    # through scipy's RegularGridInterpolator. Queries outside the parameter space are clamped to its border.
+    def __init__(self, names, axes, values, keys=(), method='linear'):
+        self.names = list(names)
+        self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+        self.values = np.asarray(values, dtype=float).reshape([len(axis) for axis in self.axes])
+        self.keys = set(keys) # instance keys already in values, update() only reads the others
+        self.method = method
+        self._interpolator = None
+
+    @classmethod
+    def from_grid(cls, grid_path, method='linear', store=TomlStore):
+        metadata = store.from_grid_path(grid_path)
+        names = metadata.read_grid(grid_path)['properties']['parameters']
+        surrogate = cls(names, [np.empty(0)] * len(names), np.empty([0] * len(names)), method=method)
+        return surrogate.update(grid_path, store)
+
+    def update(self, grid_path, store=TomlStore):
+        # adds the instances of a (refined) grid which are scored and not known yet
+        metadata = store.from_grid_path(grid_path)
+        keys, points, scores = [], [], []
+        for key in metadata.read_grid(grid_path)['instances']:
+            if key in self.keys:
+                continue
+            instance = metadata.read_instance(key)
+            if instance['properties']['sc_result'] != 1:
+                continue
+            keys.append(key)
+            points.append(instance['properties']['parameter_cb'][:len(self.axes)])
+            scores.append(float(instance['results']['safetyscore']))
+        if keys:
+            self.add_points(np.array(points, dtype=float), np.array(scores, dtype=float))
+            self.keys.update(keys)
+        return self
+
+    def add_points(self, points, scores):
+        # points: (n, n_params), the axes are extended by new parameter values, known scores are moved over
+        points = np.asarray(points, dtype=float).reshape(len(scores), len(self.axes))
+        axes = [_merge_axis(axis, points[:, dim]) for dim, axis in enumerate(self.axes)]
+        values = np.full([len(axis) for axis in axes], np.nan)
+        old = [_locate(axis, old_axis) for axis, old_axis in zip(axes, self.axes)]
+        values[np.ix_(*old)] = self.values
+        values[tuple(_locate(axis, points[:, dim]) for dim, axis in enumerate(axes))] = scores
+        self.axes, self.values = axes, values
+        self._interpolator = None
+
+    def __call__(self, points):
+        # points: (n, n_params) array, a single parameter combination or [{xpath: value}, ...]
+        if not self.values.size:
+            raise ValueError('the surrogate has no scored instances yet')
+        points = self._points(points)
+        if self.method == 'nearest':
+            return self.values[tuple(_locate(axis, x) for axis, x in zip(self.axes, points.T))]
+        if self.method == 'linear':
+            return self._linear(points)
+        if self._interpolator is None:
+            from scipy.interpolate import RegularGridInterpolator # only the higher order methods need scipy
+            self._interpolator = RegularGridInterpolator(self.axes, self.values, method=self.method)
+        lower = [axis[0] for axis in self.axes]
+        upper = [axis[-1] for axis in self.axes]
+        return self._interpolator(np.clip(points, lower, upper))
+
+    def _points(self, points):
+        if isinstance(points, dict):
+            points = [points]
+        if len(points) and isinstance(points[0], dict):
+            points = [[point[name] for name in self.names] for point in points]
+        return np.asarray(points, dtype=float).reshape(-1, len(self.axes))
+
+    def _linear(self, points):
+        # weights of the 2**n_params corners of the cell around every point
+        lower, weights = [], []
+        for axis, x in zip(self.axes, points.T):
+            if len(axis) == 1:
+                lower.append(np.zeros(len(x), dtype=np.int64))
+                weights.append(np.zeros(len(x)))
+                continue
+            index = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, len(axis) - 2)
+            lower.append(index)
+            weights.append(np.clip((x - axis[index]) / (axis[index + 1] - axis[index]), 0.0, 1.0))
+        result = np.zeros(len(points))
+        for corner in np.ndindex(*[2 if len(axis) > 1 else 1 for axis in self.axes]):
+            weight = np.ones(len(points))
+            for dim, side in enumerate(corner):
+                weight *= weights[dim] if side else 1.0 - weights[dim]
+            # corners with zero weight must not turn a result into nan
+            value = self.values[tuple(index + side for index, side in zip(lower, corner))]
+            result += np.where(weight == 0.0, 0.0, weight * value)
+        return result
+
+    def save(self, path):
+        arrays = {'axis_' + str(dim): axis for dim, axis in enumerate(self.axes)}
+        np.savez(path, names=np.array(self.names, dtype=str), values=self.values, keys=np.array(sorted(self.keys), dtype=str),
+                 method=np.array(self.method), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            names = data['names'].tolist()
+            axes = [data['axis_' + str(dim)] for dim in range(len(names))]
+            return cls(names, axes, data['values'], data['keys'].tolist(), str(data['method']))
+
+
+def _merge_axis(axis, x, rtol=1e-9):
+    # sorted union of the axis and the new values, values closer than rtol of the range count as the same
+    merged = np.unique(np.concatenate([axis, x]))
+    if len(merged) < 2:
+        return merged
+    keep = np.concatenate([[True], np.diff(merged) > rtol * (merged[-1] - merged[0])])
+    return merged[keep]
+
+def _locate(axis, x):
+    # index of the closest axis value of every x
+    index = np.clip(np.searchsorted(axis, x), 1, max(len(axis) - 1, 1))
+    if len(axis) < 2:
+        return np.zeros(len(x), dtype=np.int64)
+    return np.where(np.abs(x - axis[index - 1]) <= np.abs(axis[index] - x), index - 1, index)
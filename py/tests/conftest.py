@@ -0,0 +1,60 @@
+import contextlib
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Benchmarks.pipeline import CAMERA_NAME, OUT_QUANTS, _detect_synthetic, _signals, _write_study
+from MetadataStores.sqlite import SqliteStore
+from MetadataStores.tomlfiles import TomlStore
+from Runners.fakecarmaker import FakeCarMaker
+from ScoreCalculators import camera
+from ScoreCalculators.iou import IouScoreCalculator
+
+# Studies of the benchmark (one testrun, 'Traffic.<i>.Init.Road[0]' between 10 and 200, the distance of
+# Traffic.0 is what the camera sees) simulated by FakeCarMaker, with the synthetic detection instead of YOLO.
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+def free_ports(n):
+    # first of n consecutive free ports, like the command ports of a CarMakerPool
+    while True:
+        first = free_port()
+        try:
+            with contextlib.ExitStack() as probes:
+                for port in range(first, first + n):
+                    probe = probes.enter_context(socket.socket())
+                    probe.bind(('localhost', port))
+            return first
+        except OSError:
+            continue
+
+
+@pytest.fixture(params=[TomlStore, SqliteStore], ids=['toml', 'sqlite'])
+def store(request):
+    return request.param
+
+@pytest.fixture
+def study(tmp_path, monkeypatch):
+    # handler of a study with one parameter, dims() gives one with more
+    monkeypatch.setattr(camera, 'CAMERA_CFG', str(tmp_path / 'Camera.cfg'))
+    return _write_study(str(tmp_path), 1)
+
+@pytest.fixture
+def fake(tmp_path):
+    fake = FakeCarMaker(free_port(), project_path=str(tmp_path), signals=_signals, samples=50).start()
+    yield fake
+    fake.stop()
+
+def score(runner, grid_path, store):
+    # simulate, detect and score a grid
+    runner.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    _detect_synthetic(grid_path, store)
+    IouScoreCalculator.parse_results(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
@@ -0,0 +1,51 @@
+import os
+
+from Benchmarks.pipeline import CAMERA_NAME, OUT_QUANTS, _write_study
+from Discretizers.fastdiscretizer import FastDiscretizer
+from MetadataStores.dedup import ResultIndex
+from Runners.carmaker import CarMakerRunner
+from conftest import score
+
+STAGES = ResultIndex.STAGES
+
+
+def _scored_study(handler, runner, index, store):
+    _, grid_path = FastDiscretizer.generate_instances(handler, 2, store=store)
+    score(runner, grid_path, store)
+    index.publish(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    return grid_path
+
+def _results(grid_path, store):
+    return [(instance['properties']['parameter_cb'], instance['results']['ipgresult'], instance['results']['safetyscore'])
+            for instance in store.from_grid_path(grid_path).grid_instances(grid_path).values()]
+
+def test_same_testruns_reuse_all_stages(study, fake, store, tmp_path):
+    runner = CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2)
+    index = ResultIndex(str(tmp_path / 'index'))
+    first = _scored_study(study, runner, index, store)
+    simulated = fake.commands.count('StartSim')
+    # another study with the same testrun content in another directory
+    _, second = FastDiscretizer.generate_instances(_write_study(str(tmp_path / 'other'), 1), 2, store=store)
+    index.apply(second, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert index.hits == {stage: 3 for stage in STAGES}
+    metadata = store.from_grid_path(second)
+    for stage in STAGES:
+        assert metadata.pending_instances(second, stage) == {}
+    assert _results(second, store) == _results(first, store)
+    assert all(os.path.exists(instance['results']['ipgmovie']) for instance in metadata.grid_instances(second).values())
+    assert fake.commands.count('StartSim') == simulated
+    index.close()
+
+def test_other_camera_or_evicted_results_miss(study, fake, store, tmp_path):
+    runner = CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2)
+    index = ResultIndex(str(tmp_path / 'index'))
+    _scored_study(study, runner, index, store)
+    _, other_camera = FastDiscretizer.generate_instances(_write_study(str(tmp_path / 'camera'), 1), 2, store=store)
+    index.apply(other_camera, OUT_QUANTS, 'OtherCamera', store=store)
+    assert index.hits == {stage: 0 for stage in STAGES}
+    index.evict(max_bytes=0)
+    assert index.size() == 0
+    _, evicted = FastDiscretizer.generate_instances(_write_study(str(tmp_path / 'evicted'), 1), 2, store=store)
+    index.apply(evicted, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert index.hits['ipg_result'] == 0 and index.hits['sc_result'] == 0 # no stage without the stage before
+    index.close()
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from Benchmarks.pipeline import _write_study
+from Discretizers.discretizer_base import Basediscretizer
+from Discretizers.fastdiscretizer import FastDiscretizer
+from Discretizers.tensordiscretizer import ParameterGrid, TensorDiscretizer
+from IOHandlers.carmaker import CarMakerHandler
+
+
+def _grids(handler, store, levels=(1, 2, 3)):
+    # {grid_ID: (instance keys, instance paths)}
+    grids = {}
+    for grid_ID in levels:
+        instances, grid_path = TensorDiscretizer.generate_instances(handler, grid_ID, store=store, testruns='lazy')
+        metadata = store.from_grid_path(grid_path)
+        keys = list(metadata.read_grid(grid_path)['instances'])
+        grids[grid_ID] = (keys, [metadata.read_instance(key)['properties']['path'] for key in keys])
+    return grids
+
+def test_tensor_grid_is_generated_without_point_dicts(tmp_path, store, monkeypatch):
+    handler = _write_study(str(tmp_path), 2)
+    def getitem(self, id):
+        raise AssertionError('generate_instances built a point dict')
+    monkeypatch.setattr(ParameterGrid, '__getitem__', getitem)
+    instances, grid_path = TensorDiscretizer.generate_instances(handler, 4, store=store, testruns='lazy')
+    assert len(store.from_grid_path(grid_path).read_grid(grid_path)['instances']) == 81
+
+@pytest.mark.parametrize('chunk_size', [1, 7])
+def test_chunks_give_the_same_grids(tmp_path, store, monkeypatch, chunk_size):
+    reference = _grids(_write_study(str(tmp_path / 'reference'), 2), store)
+    generate_grid = Basediscretizer._generate_grid.__func__
+    monkeypatch.setattr(Basediscretizer, '_generate_grid', classmethod(
+        lambda cls, *args, **kwargs: generate_grid(cls, *args, **kwargs, chunk_size=chunk_size)))
+    chunked = _grids(_write_study(str(tmp_path / 'chunked'), 2), store)
+    for grid_ID, (keys, paths) in reference.items():
+        assert chunked[grid_ID][0] == keys
+        assert [path.split('chunked')[1] for path in chunked[grid_ID][1]] == [path.split('reference')[1] for path in paths]
+    # only the 16 points grid 3 adds to the 9 of grid 2 are new instances of grid 3
+    assert sum(os.path.dirname(path).endswith('_3') for path in chunked[3][1]) == 16
+
+def _handler(handler, name, params):
+    # handler of the same testrun with another .param file
+    param_path = os.path.join(os.path.dirname(handler.param_file_path), name)
+    with open(param_path, 'w') as param_file:
+        param_file.write(''.join(f"'{xpath}' = '{bounds}'\n" for xpath, bounds in params.items()))
+    return CarMakerHandler(handler.data_file_path, param_path)
+
+def _instances(grid_path, store):
+    # {key: parameter_cb} of a grid
+    metadata = store.from_grid_path(grid_path)
+    return {key: instance['properties']['parameter_cb'] for key, instance in metadata.grid_instances(grid_path).items()}
+
+def test_other_bounds_do_not_link_earlier_points(tmp_path, store):
+    handler = _write_study(str(tmp_path), 1)
+    FastDiscretizer.generate_instances(handler, 2, store=store, testruns='lazy')
+    narrow = _handler(handler, 'narrow.param', {'Traffic.0.Init.Road[0]': '20, 40'})
+    instances, grid_path = FastDiscretizer.generate_instances(narrow, 2, store=store, testruns='lazy')
+    assert _instances(grid_path, store) == {'[20.0]': [20.0], '[30.0]': [30.0], '[40.0]': [40.0]}
+    assert [instance['instance_parameters']['Traffic.0.Init.Road[0]'] for instance in instances] == [20.0, 30.0, 40.0]
+    # the same parameter with the same value is the same instance
+    half = _handler(handler, 'half.param', {'Traffic.0.Init.Road[0]': '10, 100'})
+    _, grid_path = FastDiscretizer.generate_instances(half, 2, store=store, testruns='lazy')
+    assert list(_instances(grid_path, store)) == ['[10.0]', '[55.0]', '[100.0]']
+    assert len(store.from_grid_path(grid_path).instance_keys()) == 3 + 3 + 2
+
+def test_other_parameters_of_the_testrun_do_not_link_earlier_points(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    distance = _handler(handler, 'distance.param', {'Traffic.0.Init.Road[0]': '10, 200'})
+    FastDiscretizer.generate_instances(distance, 2, store=store, testruns='lazy')
+    other = _handler(handler, 'other.param', {'Traffic.1.Init.Road[0]': '20, 40'})
+    instances, grid_path = FastDiscretizer.generate_instances(other, 2, store=store, testruns='write')
+    assert _instances(grid_path, store) == {'[20.0]': [20.0], '[30.0]': [30.0], '[40.0]': [40.0]}
+    with open(instances[1]['instance_path']) as testrun_file:
+        assert 'Traffic.1.Init.Road = 30.0' in testrun_file.read()
+    # same values as the instances of distance.param, they would get their keys
+    same_values = _handler(handler, 'same.param', {'Traffic.1.Init.Road[0]': '10, 200'})
+    with pytest.raises(ValueError):
+        FastDiscretizer.generate_instances(same_values, 2, store=store, testruns='lazy')
+
+def test_positions_are_only_linked_to_instances_of_the_same_values(tmp_path, store):
+    handler = _write_study(str(tmp_path), 1)
+    _, grid_path = FastDiscretizer.generate_instances(handler, 2, store=store, testruns='lazy')
+    # positions of [10, 200] recorded for [20, 40], like an index without parameters and bounds
+    metadata = store.from_grid_path(grid_path)
+    narrow = _handler(handler, 'narrow.param', {'Traffic.0.Init.Road[0]': '20, 40'})
+    positions = metadata.read_properties()['positions']
+    metadata.write_properties({'positions': {Basediscretizer._signature(narrow.params): positions[Basediscretizer._signature(handler.params)]}})
+    _, grid_path = FastDiscretizer.generate_instances(narrow, 2, store=store, testruns='lazy')
+    assert list(_instances(grid_path, store)) == ['[20.0]', '[30.0]', '[40.0]']
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from Benchmarks.pipeline import CAMERA_NAME, OUT_QUANTS
+from Discretizers.fastdiscretizer import FastDiscretizer
+from MetadataStores.journal import StageJournal
+from MetadataStores import tomlfiles
+from Runners.carmaker import CarMakerRunner
+
+
+def test_recover_applies_journaled_results(study, store):
+    _, grid_path = FastDiscretizer.generate_instances(study, 2, store=store)
+    metadata = store.from_grid_path(grid_path)
+    first, second, third = metadata.instance_keys()[:3]
+    journal = StageJournal(metadata, 'ipg_result')
+    journal.begin(first, second, third)
+    journal._append({'event': 'done', 'key': first, 'updates': {'properties': {'ipg_result': 1}, 'results': {'ipgresult': {'Time': 1.0}}}})
+    with open(journal.path, 'a') as journal_file:
+        journal_file.write('{"event": "done", "key": "' + second) # cut off by the interruption
+    interrupted = StageJournal(store.from_grid_path(grid_path), 'ipg_result').recover()
+    assert interrupted == [second, third]
+    assert metadata.read_instance(first)['results']['ipgresult'] == {'Time': 1.0}
+    assert metadata.read_instance(first)['properties']['ipg_result'] == 1
+    assert not os.path.exists(journal.path)
+
+def test_interrupted_stage_resumes_without_redoing_work(study, fake, store):
+    _, grid_path = FastDiscretizer.generate_instances(study, 3, store=store)
+    metadata = store.from_grid_path(grid_path)
+    update_instance = type(metadata).update_instance
+    writes = []
+    def crash_on_third(self, key, updates):
+        writes.append(key)
+        if len(writes) == 3:
+            raise KeyboardInterrupt # killed between journal and metadata
+        return update_instance(self, key, updates)
+    runner = CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(type(metadata), 'update_instance', crash_on_third)
+        with pytest.raises(KeyboardInterrupt):
+            runner.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    journal = StageJournal(metadata, 'ipg_result')
+    assert os.path.exists(journal.path)
+    simulated = fake.commands.count('StartSim')
+    runner.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert fake.commands.count('StartSim') - simulated == 5 - 3 # the third result came from the journal
+    assert store.from_grid_path(grid_path).pending_instances(grid_path, 'ipg_result') == {}
+    assert not os.path.exists(journal.path)
+
+def test_interrupted_write_keeps_the_old_toml(tmp_path, monkeypatch):
+    path = str(tmp_path / 'grid01.toml')
+    tomlfiles.atomic_dump({'evaluation': {'p': [1.0]}}, path)
+    def interrupted(data, toml_file):
+        toml_file.write('[evaluation]\np = [')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(tomlfiles.toml, 'dump', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        tomlfiles.atomic_dump({'evaluation': {'p': [2.0]}}, path)
+    monkeypatch.undo()
+    assert tomlfiles.toml.load(path) == {'evaluation': {'p': [1.0]}}
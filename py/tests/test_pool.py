@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from Benchmarks.pipeline import CAMERA_NAME, OUT_QUANTS, _signals
+from Discretizers.fastdiscretizer import FastDiscretizer
+from Runners.fakecarmaker import FakeCarMaker
+from Runners.pool import CarMakerPool
+from conftest import free_ports
+
+
+@pytest.fixture
+def fakes(tmp_path):
+    first = free_ports(2)
+    fakes = [FakeCarMaker(first + i, project_path=str(tmp_path), sim_time=0.1, signals=_signals, samples=10).start() for i in range(2)]
+    yield fakes
+    for fake in fakes:
+        fake.stop()
+
+def _pool(fakes):
+    pool = CarMakerPool(workers=len(fakes), first_cmd_port=fakes[0].tcp_cmd_port, launch=False, log_level=2)
+    for worker in pool.workers:
+        worker.startup()
+    return pool
+
+def _crash(fake, after, down):
+    def crash():
+        time.sleep(after)
+        fake.stop()
+        time.sleep(down)
+        fake.start()
+    thread = threading.Thread(target=crash)
+    thread.start()
+    return thread
+
+def test_instance_of_dead_worker_is_requeued(study, fakes, store):
+    _, grid_path = FastDiscretizer.generate_instances(study, 4, store=store)
+    pool = _pool(fakes)
+    crash = _crash(fakes[1], 0.25, 0.2)
+    pool.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    crash.join()
+    metadata = store.from_grid_path(grid_path)
+    assert metadata.pending_instances(grid_path, 'ipg_result') == {}
+    assert pool.restarts == {fakes[1].tcp_cmd_port: 1}
+    pool.shutdown()
+
+def test_other_workers_run_while_one_restarts(study, fakes, store):
+    _, grid_path = FastDiscretizer.generate_instances(study, 5, store=store)
+    pool = _pool(fakes)
+    healthy, crashed = pool.workers
+    finished, restarting = [], []
+    evaluate, restart = healthy._evaluate_movie, crashed.restart
+    def timed_evaluate(*args, **kwargs):
+        result = evaluate(*args, **kwargs)
+        finished.append(time.perf_counter())
+        return result
+    def slow_restart():
+        start = time.perf_counter()
+        time.sleep(1.0)
+        restart()
+        restarting.append((start, time.perf_counter()))
+    healthy._evaluate_movie, crashed.restart = timed_evaluate, slow_restart
+    crash = _crash(fakes[1], 0.25, 0.2)
+    pool.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    crash.join()
+    (start, end), = restarting
+    assert sum(start < done < end for done in finished) >= 5
+    assert store.from_grid_path(grid_path).pending_instances(grid_path, 'ipg_result') == {}
+    pool.shutdown()
@@ -0,0 +1,41 @@
+from Benchmarks.pipeline import CAMERA_NAME, OUT_QUANTS
+from Discretizers.fastdiscretizer import FastDiscretizer
+from Evaluaters.GCI import GCIEvaluater
+from MetadataStores.results import ResultCache
+from Runners.carmaker import CarMakerRunner
+from ScoreCalculators.iou import IouScoreCalculator
+from conftest import score
+
+
+def _gci(grid_path, store):
+    GCIEvaluater.evaluation(grid_path, [10, 200], store=store)
+    return store.from_grid_path(grid_path).read_grid(grid_path)['evaluation']['GCI']
+
+def test_evaluation_after_rescore_uses_new_scores(study, fake, store, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    runner = CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2, result_cache=cache)
+    grid_paths = []
+    for grid_ID in (1, 2, 3):
+        _, grid_path = FastDiscretizer.generate_instances(study, grid_ID, store=store)
+        score(runner, grid_path, store)
+        grid_paths.append(grid_path)
+    before = _gci(grid_path, store)
+    for path in grid_paths:
+        IouScoreCalculator.rescore(path, OUT_QUANTS, cache, CAMERA_NAME, time=0.0, store=store)
+    after = _gci(grid_path, store)
+    GCIEvaluater.clear_cache()
+    assert after == _gci(grid_path, store)
+    assert after != before
+
+def test_invalidate_forgets_rescored_keys(study, fake, store, tmp_path):
+    runner = CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2, result_cache=ResultCache(str(tmp_path / 'cache')))
+    for grid_ID in (1, 2, 3):
+        _, grid_path = FastDiscretizer.generate_instances(study, grid_ID, store=store)
+        score(runner, grid_path, store)
+    GCIEvaluater.evaluation(grid_path, [10, 200], store=store)
+    metadata = store.from_grid_path(grid_path)
+    keys = list(metadata.read_grid(grid_path)['instances'])
+    prefix = (type(metadata).__name__, metadata.study_dir)
+    assert all(prefix + (key,) in GCIEvaluater._scores for key in keys)
+    GCIEvaluater.invalidate(metadata, keys[:2])
+    assert [prefix + (key,) in GCIEvaluater._scores for key in keys[:3]] == [False, False, True]
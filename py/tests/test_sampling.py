@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+from Benchmarks.pipeline import _write_study
+from Discretizers.samplingdiscretizer import SamplingDiscretizer, distribution_spec
+from IOHandlers.carmaker import CarMakerHandler
+
+
+def _new_instances(grid_path, store):
+    # instances whose testrun is in the directory of the grid
+    metadata = store.from_grid_path(grid_path)
+    suffix = '_' + str(int(grid_path[-7:-5]))
+    return [key for key, instance in metadata.grid_instances(grid_path).items()
+            if os.path.dirname(instance['properties']['path']).endswith(suffix)]
+
+@pytest.mark.parametrize('method', ['sobol', 'halton', 'random'])
+def test_sequences_reuse_the_samples_of_the_grid_before(tmp_path, store, method):
+    handler = _write_study(str(tmp_path), 3)
+    grids = [SamplingDiscretizer.generate_instances(handler, grid_ID, store=store, method=method, base_samples=8, testruns='lazy')[1]
+             for grid_ID in (1, 2, 3)]
+    metadata = store.from_grid_path(grids[-1])
+    keys = [list(metadata.read_grid(grid_path)['instances']) for grid_path in grids]
+    assert [len(grid) for grid in keys] == [8, 16, 32]
+    assert keys[1][:8] == keys[0] and keys[2][:16] == keys[1]
+    assert [len(_new_instances(grid_path, store)) for grid_path in grids] == [8, 8, 16]
+
+def test_lhs_draws_new_samples_for_every_size(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    _, first = SamplingDiscretizer.generate_instances(handler, 1, store=store, method='lhs', base_samples=8, testruns='lazy')
+    _, second = SamplingDiscretizer.generate_instances(handler, 2, store=store, method='lhs', base_samples=8, testruns='lazy')
+    assert len(_new_instances(second, store)) == 16
+
+def test_distributions_stay_within_the_bounds(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    instances, _ = SamplingDiscretizer.generate_instances(handler, 4, store=store, base_samples=32, testruns='lazy',
+                                                          distributions={'Traffic.0.Init.Road[0]': 'norm(50, 20)'})
+    values = np.array([list(instance['instance_parameters'].values()) for instance in instances])
+    assert values.min() >= 10 and values.max() <= 200
+    assert abs(np.median(values[:, 0]) - 50) < 10 # the other parameter is uniform around 105
+    assert abs(np.median(values[:, 1]) - 105) < 20
+
+def test_other_sampling_settings_in_the_same_study_raise(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    SamplingDiscretizer.generate_instances(handler, 1, store=store, base_samples=4, testruns='lazy')
+    with pytest.raises(ValueError):
+        SamplingDiscretizer.generate_instances(handler, 2, store=store, base_samples=4, seed=1, testruns='lazy')
+    with pytest.raises(ValueError):
+        SamplingDiscretizer.generate_instances(handler, 2, store=store, method='halton', base_samples=4, testruns='lazy')
+    assert distribution_spec('norm(50, 20)') == distribution_spec('norm(50.0,20)')
+
+def test_other_bounds_draw_new_samples(tmp_path, store):
+    handler = _write_study(str(tmp_path), 1)
+    SamplingDiscretizer.generate_instances(handler, 1, store=store, base_samples=4, testruns='lazy')
+    with open(handler.param_file_path, 'w') as param_file:
+        param_file.write("'Traffic.0.Init.Road[0]' = '20, 40'\n")
+    narrow = CarMakerHandler(handler.data_file_path, handler.param_file_path)
+    instances, grid_path = SamplingDiscretizer.generate_instances(narrow, 2, store=store, samples=4, testruns='lazy')
+    values = [instance['properties']['parameter_cb'][0] for instance in store.from_grid_path(grid_path).grid_instances(grid_path).values()]
+    assert len(values) == 4 and all(20 <= value <= 40 for value in values)
+    assert values == [instance['instance_parameters']['Traffic.0.Init.Road[0]'] for instance in instances]
+    assert len(_new_instances(grid_path, store)) == 4
@@ -0,0 +1,60 @@
+import pytest
+
+from Benchmarks.pipeline import _write_study
+from Discretizers.screeningdiscretizer import ScreeningDiscretizer
+from Evaluaters.sensitivity import SensitivityEvaluater
+from IOHandlers.carmaker import CarMakerHandler
+from Runners.carmaker import CarMakerRunner
+from conftest import score
+
+DISTANCE = 'Traffic.0.Init.Road[0]' # the only parameter the camera sees
+
+
+@pytest.fixture
+def screened(study, fake, store, tmp_path):
+    # morris screening of a study with 3 parameters, evaluated
+    handler = _write_study(str(tmp_path / 'screening'), 3)
+    _, grid_path = ScreeningDiscretizer.generate_instances(handler, store=store, method='morris', samples=6)
+    with pytest.raises(ValueError):
+        SensitivityEvaluater.evaluation(grid_path, None, store=store) # nothing is scored yet
+    score(CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2), grid_path, store)
+    SensitivityEvaluater.evaluation(grid_path, None, store=store)
+    return handler, grid_path
+
+def test_screening_finds_the_influential_parameter(screened, store):
+    handler, grid_path = screened
+    importance = SensitivityEvaluater.importance(grid_path, store)
+    assert next(iter(importance)) == DISTANCE and importance[DISTANCE] == 1.0
+    assert SensitivityEvaluater.influential(grid_path, store=store) == [DISTANCE]
+    assert SensitivityEvaluater.levels(grid_path, 5, store=store) == {DISTANCE: 5, 'Traffic.1.Init.Road[0]': 1, 'Traffic.2.Init.Road[0]': 1}
+
+def test_reduced_param_file_keeps_the_influential_bounds(screened, store, tmp_path):
+    handler, grid_path = screened
+    param_path = SensitivityEvaluater.write_param_file(grid_path, str(tmp_path / 'reduced.param'), store=store)
+    assert CarMakerHandler(handler.data_file_path, param_path).params == {DISTANCE: [10.0, 200.0]}
+
+def test_screening_keeps_the_sample_order(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    _, grid_path = ScreeningDiscretizer.generate_instances(handler, store=store, method='fast', samples=70, testruns='lazy')
+    metadata = store.from_grid_path(grid_path)
+    screening = metadata.read_grid(grid_path)['properties']['screening']
+    assert len(screening['keys']) == 140 and screening['names'] == list(handler.params)
+    assert set(screening['keys']) == set(metadata.read_grid(grid_path)['instances'])
+    with pytest.raises(ValueError):
+        ScreeningDiscretizer.generate_instances(handler, store=store, method='sobol')
+
+def test_other_bounds_and_levels_screen_new_points(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    _, first = ScreeningDiscretizer.generate_instances(handler, store=store, samples=2, testruns='lazy')
+    _, levels = ScreeningDiscretizer.generate_instances(handler, grid_ID=2, store=store, samples=2, num_levels=6, testruns='lazy')
+    with open(handler.param_file_path, 'w') as param_file:
+        param_file.write(''.join(f"'Traffic.{i}.Init.Road[0]' = '20, 40'\n" for i in range(2)))
+    narrow = CarMakerHandler(handler.data_file_path, handler.param_file_path)
+    instances, bounds = ScreeningDiscretizer.generate_instances(narrow, grid_ID=3, store=store, samples=2, testruns='lazy')
+    metadata = store.from_grid_path(bounds)
+    for grid_path, low, step in ((levels, 10, 38), (bounds, 20, 20 / 3)):
+        screening = metadata.read_grid(grid_path)['properties']['screening']
+        values = [metadata.read_instance(key)['properties']['parameter_cb'] for key in screening['keys']]
+        # every value is one of the num_levels levels between the bounds
+        assert all(abs((value - low) / step - round((value - low) / step)) < 1e-9 for point in values for value in point)
+    assert values == [list(instance['instance_parameters'].values()) for instance in instances]
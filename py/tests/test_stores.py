@@ -0,0 +1,48 @@
+from Discretizers.fastdiscretizer import FastDiscretizer
+from MetadataStores.sqlite import SqliteStore
+from MetadataStores.tomlfiles import TomlStore
+
+
+def _dump(metadata):
+    properties = metadata.read_properties()
+    properties.pop('path')
+    return {'properties': properties,
+            'instances': {key: metadata.read_instance(key) for key in metadata.instance_keys()},
+            'grids': {grid_path: metadata.read_grid(grid_path) for grid_path in metadata.grid_paths()}}
+
+def test_toml_study_round_trips_through_sqlite(study):
+    for grid_ID in (1, 2, 3):
+        _, grid_path = FastDiscretizer.generate_instances(study, grid_ID, store=TomlStore)
+    toml_store = TomlStore.from_grid_path(grid_path)
+    sqlite_store = SqliteStore.import_toml(toml_store.study_dir)
+    assert _dump(sqlite_store) == _dump(toml_store)
+    key = sqlite_store.instance_keys()[0]
+    sqlite_store.update_instance(key, {'properties': {'ipg_result': 1}, 'results': {'ipgresult': {'Time': 1.0}}})
+    sqlite_store.export_toml()
+    assert _dump(TomlStore(toml_store.study_dir)) == _dump(sqlite_store)
+
+def test_updates_only_replace_the_given_fields(study, store):
+    instances, grid_path = FastDiscretizer.generate_instances(study, 2, store=store)
+    metadata = store.from_grid_path(grid_path)
+    key = metadata.instance_keys()[1]
+    before = metadata.read_instance(key)
+    metadata.update_instances({key: {'results': {'ipgresult': {'Vhcl.Fr1.x': 2.0}}, 'properties': {'ipg_result': 1}}})
+    after = metadata.read_instance(key)
+    assert after['results']['ipgresult'] == {'Vhcl.Fr1.x': 2.0}
+    assert after['properties'] == dict(before['properties'], ipg_result=1)
+    assert metadata.pending_instances(grid_path, 'ipg_result').keys() == set(metadata.instance_keys()) - {key}
+    metadata.update_grid(grid_path, {'evaluation': {'p': [1.5]}})
+    assert metadata.read_grid(grid_path)['evaluation']['GCI'] == ''
+    assert list(metadata.grid_instances(grid_path)) == list(metadata.read_grid(grid_path)['instances'])
+
+def test_instance_versions_change_on_every_write(study, store):
+    _, grid_path = FastDiscretizer.generate_instances(study, 2, store=store)
+    metadata = store.from_grid_path(grid_path)
+    first, second = metadata.instance_keys()[:2]
+    before = metadata.instance_versions([first, second])
+    metadata.update_instance(first, {'results': {'safetyscore': 0.5}})
+    middle = metadata.instance_versions([first, second])
+    metadata.update_instances({first: {'results': {'safetyscore': 0.25}}})
+    after = store.from_grid_path(grid_path).instance_versions([first, second])
+    assert before[first] != middle[first] != after[first]
+    assert before[second] == middle[second] == after[second]
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from Benchmarks.pipeline import CAMERA_NAME, OUT_QUANTS, SYNTHETIC_BOX, _detect_synthetic, _write_study
+from Discretizers.fastdiscretizer import FastDiscretizer
+from MetadataStores.journal import StageJournal
+from Pipelines import streaming
+from Pipelines.streaming import PipelineError, StreamingPipeline
+from PngHandlers.yolo import ResidentYoloHandler
+from Runners.carmaker import CarMakerRunner
+from ScoreCalculators.iou import IouScoreCalculator
+from conftest import score
+
+# StreamingPipeline against FakeCarMaker, the detector gives the box of the synthetic detection for every png
+
+
+class _Detector():
+    def __init__(self):
+        self.images = []
+
+    def detect(self, images, conf_thres, iou_thres):
+        self.images += images
+        return [SYNTHETIC_BOX for _ in images]
+
+@pytest.fixture
+def detector(monkeypatch):
+    detector = _Detector()
+    monkeypatch.setattr(ResidentYoloHandler, 'load_detector', classmethod(lambda cls, **kwargs: detector))
+    monkeypatch.setattr(streaming, 'read_frame', lambda png_path: ('frame', png_path))
+    return detector
+
+@pytest.fixture
+def runner(fake):
+    return CarMakerRunner(launch=False, tcp_cmd_port=fake.tcp_cmd_port, log_level=2)
+
+def _scores(grid_path, store):
+    return {key: instance['results']['safetyscore'] for key, instance in store.from_grid_path(grid_path).grid_instances(grid_path).items()}
+
+def _journals(grid_path, store):
+    metadata = store.from_grid_path(grid_path)
+    return [stage for stage in StreamingPipeline.STAGES if os.path.exists(StageJournal(metadata, stage).path)]
+
+@pytest.fixture
+def reference(study, runner, store, tmp_path):
+    # scores of the same grid, stage after stage
+    _, grid_path = FastDiscretizer.generate_instances(_write_study(str(tmp_path / 'reference'), 1), 3, store=store)
+    score(runner, grid_path, store)
+    return _scores(grid_path, store)
+
+def test_pipeline_scores_like_the_stages(study, runner, store, detector, reference):
+    _, grid_path = FastDiscretizer.generate_instances(study, 3, store=store)
+    stats = StreamingPipeline(runner, batch_size=2, queue_size=2, keep_pngs=False, log_level=2).run(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert _scores(grid_path, store) == reference
+    assert {stage: stats[stage]['count'] for stage in StreamingPipeline.STAGES} == dict.fromkeys(StreamingPipeline.STAGES, 5)
+    assert all(image[0] == 'frame' for image in detector.images) and len(detector.images) == 5
+    assert _journals(grid_path, store) == []
+    for instance in store.from_grid_path(grid_path).grid_instances(grid_path).values():
+        assert instance['properties']['sc_result'] == 1
+        assert not os.path.exists(instance['results']['ipgmovie']) # keep_pngs=False
+        assert os.path.exists(instance['results']['yolov5'])
+
+def test_pipeline_resumes_simulated_and_detected_instances(study, runner, store, detector, reference):
+    _, grid_path = FastDiscretizer.generate_instances(study, 2, store=store)
+    runner.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    _detect_synthetic(grid_path, store) # grid 2 only has to be scored
+    _, grid_path = FastDiscretizer.generate_instances(study, 3, store=store)
+    runner.simulate_movies(grid_path, OUT_QUANTS, CAMERA_NAME, store=store) # the new points of grid 3 are detected
+    stats = StreamingPipeline(runner, log_level=2).run(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert _scores(grid_path, store) == reference
+    assert [stats[stage]['count'] for stage in StreamingPipeline.STAGES] == [0, 2, 5]
+    assert len(detector.images) == 2 and all(isinstance(image, str) for image in detector.images) # the pngs of the earlier run
+
+def test_score_error_stops_the_pipeline_and_keeps_the_journals(study, runner, store, detector, reference, monkeypatch):
+    _, grid_path = FastDiscretizer.generate_instances(study, 3, store=store)
+    score_instance = IouScoreCalculator._score_instance
+    def failing(instance, *args, **kwargs):
+        if instance['properties']['parameter_cb'] == [105.0]:
+            raise RuntimeError('score failed')
+        return score_instance(instance, *args, **kwargs)
+    monkeypatch.setattr(IouScoreCalculator, '_score_instance', staticmethod(failing))
+    pipeline = StreamingPipeline(runner, score_workers=1, log_level=2)
+    with pytest.raises(PipelineError, match=r'sc_result failed on instance \[105\.0\]'):
+        pipeline.run(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert 'sc_result' in _journals(grid_path, store)
+    assert store.from_grid_path(grid_path).read_instance('[105.0]')['properties']['sc_result'] == 0
+    monkeypatch.setattr(IouScoreCalculator, '_score_instance', staticmethod(score_instance))
+    pipeline.run(grid_path, OUT_QUANTS, CAMERA_NAME, store=store)
+    assert _scores(grid_path, store) == reference
+    assert _journals(grid_path, store) == []
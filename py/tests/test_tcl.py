@@ -0,0 +1,82 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from Runners.carmaker import CarMakerRunner
+from Runners.fakecarmaker import FakeCarMaker
+from Runners.tcl import CarMakerCommandError, TclClient, TclTransmissionError, stream_testruns
+from conftest import free_port
+
+LONG = 'x' * 20000
+
+
+@pytest.fixture
+def fakes(tmp_path):
+    fakes = [FakeCarMaker(free_port(), project_path=str(tmp_path), sim_time=0.1, reply_chunk=7, delays={'Slow': 0.5}) for _ in range(3)]
+    for fake in fakes:
+        execute = fake.execute
+        fake.execute = lambda command, execute=execute: (True, LONG) if command == 'Long' else execute(command)
+        fake.start()
+    yield fakes
+    for fake in fakes:
+        fake.stop()
+
+def _stop_later(fakes, after):
+    thread = threading.Thread(target=lambda: (time.sleep(after), [fake.stop() for fake in fakes]))
+    thread.start()
+    return thread
+
+def _stream(fakes, testrun_paths):
+    async def collect():
+        return {testrun_path: result async for testrun_path, result in
+                stream_testruns([fake.tcp_cmd_port for fake in fakes], testrun_paths, ['Car.v'], log_level=2)}
+    return asyncio.run(asyncio.wait_for(collect(), 30))
+
+def test_pipelined_replies_split_across_reads(fakes):
+    async def run():
+        async with TclClient(fakes[0].tcp_cmd_port, log_level=2) as client:
+            return await client.commands(['ProjectInfo version', 'Long', 'ProjectInfo version'])
+    assert asyncio.run(run()) == ['10.0', LONG, '10.0']
+
+def test_runner_reads_replies_split_across_reads(fakes):
+    runner = CarMakerRunner(launch=False, tcp_cmd_port=fakes[0].tcp_cmd_port, log_level=2, keep_alive=True)
+    runner.startup()
+    assert runner._send_command('Long') == LONG
+    assert runner.projectinfo_version() == '10.0'
+    runner.shutdown()
+
+def test_timeout_and_errors_keep_the_connection_usable(fakes):
+    async def run():
+        async with TclClient(fakes[0].tcp_cmd_port, log_level=2) as client:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.command('Slow', timeout=0.1)
+            assert await client.command('ProjectInfo version') == '10.0' # the late reply is dropped
+            with pytest.raises(CarMakerCommandError):
+                await client.command('Nonsense')
+            with pytest.raises(asyncio.TimeoutError):
+                await client.simulate('/x/TestRun/a', ['Car.v'], timeout=0.05)
+            assert await client.command('SimStatus') == '-2'
+    asyncio.run(run())
+    assert 'StopSim' in fakes[0].commands
+
+def test_testruns_of_a_lost_connection_go_to_the_others(fakes):
+    testrun_paths = [f'/x/TestRun/t{i}' for i in range(12)]
+    crash = _stop_later(fakes[2:], 0.15)
+    results = _stream(fakes, testrun_paths)
+    crash.join()
+    assert sorted(results) == sorted(testrun_paths)
+    assert all(isinstance(result, str) and os.path.exists(result) for result in results.values()), results
+    assert fakes[2].commands.count('StartSim') < 4
+
+def test_error_only_when_no_connection_is_left(fakes):
+    testrun_paths = [f'/x/TestRun/t{i}' for i in range(12)]
+    crash = _stop_later(fakes, 0.15)
+    results = _stream(fakes, testrun_paths)
+    crash.join()
+    assert sorted(results) == sorted(testrun_paths)
+    errors = [result for result in results.values() if isinstance(result, Exception)]
+    assert errors and all(isinstance(error, (OSError, TclTransmissionError)) for error in errors)
+    assert len(errors) + sum(isinstance(result, str) for result in results.values()) == 12
@@ -0,0 +1,53 @@
+import os
+
+from Benchmarks.pipeline import _write_study
+from Discretizers.fastdiscretizer import FastDiscretizer
+from Discretizers.tensordiscretizer import TensorDiscretizer
+from IOHandlers.carmaker import CarMakerHandler
+from IOHandlers import testruns
+
+
+def _edit(handler, line):
+    # handler of the testrun with a line appended
+    with open(handler.data_file_path, 'a') as testrun_file:
+        testrun_file.write(line)
+    return CarMakerHandler(handler.data_file_path, handler.param_file_path)
+
+def _written(tmp_path, store, line, grid_ID):
+    # {key: testrun} of the grid of a study that has all testruns written
+    handler = _edit(_write_study(str(tmp_path / 'written'), 1), line)
+    _, grid_path = FastDiscretizer.generate_instances(handler, grid_ID, store=store, testruns='write')
+    testruns = {}
+    for key, instance in store.from_grid_path(grid_path).grid_instances(grid_path).items():
+        with open(instance['properties']['path']) as testrun_file:
+            testruns[key] = testrun_file.read()
+    return testruns
+
+def test_edited_testrun_is_rendered_like_written_testruns(tmp_path, store):
+    handler = _write_study(str(tmp_path / 'lazy'), 1)
+    FastDiscretizer.generate_instances(handler, 2, store=store, testruns='lazy')
+    edited = _edit(handler, 'Env.Temperature = 35\n')
+    _, grid_path = FastDiscretizer.generate_instances(edited, 3, store=store, testruns='lazy')
+    metadata = store.from_grid_path(grid_path)
+    store_testruns = testruns.TestrunStore(metadata)
+    rendered = {key: store_testruns.render(instance) for key, instance in metadata.grid_instances(grid_path).items()}
+    written = _written(tmp_path, store, 'Env.Temperature = 35\n', 3)
+    # the new points of grid 3 come from the edited testrun, the points of grid 2 keep theirs
+    assert [key for key, text in rendered.items() if 'Env.Temperature = 35' in text] == ['[57.5]', '[152.5]']
+    assert rendered['[57.5]'] == written['[57.5]'] and rendered['[152.5]'] == written['[152.5]']
+    bases = {instance['properties']['base_testrun'] for instance in metadata.grid_instances(grid_path).values()}
+    assert len(bases) == 2 and all(os.path.exists(base) for base in bases)
+
+def test_param_files_of_a_testrun_render_their_own_parameters(tmp_path, store):
+    handler = _write_study(str(tmp_path), 2)
+    _, grid_path = TensorDiscretizer.generate_instances(handler, 1, store=store, testruns='lazy')
+    other_path = os.path.join(str(tmp_path), 'other.param')
+    with open(other_path, 'w') as param_file:
+        param_file.write("'Traffic.1.Init.Road[0]' = '20, 40'\n")
+    FastDiscretizer.generate_instances(CarMakerHandler(handler.data_file_path, other_path), 2, store=store, testruns='lazy')
+    metadata = store.from_grid_path(grid_path)
+    store_testruns = testruns.TestrunStore(metadata)
+    both = store_testruns.render(metadata.read_instance('[200.0, 10.0]'))
+    assert 'Traffic.0.Init.Road = 200.0' in both and 'Traffic.1.Init.Road = 10.0' in both
+    other = store_testruns.render(metadata.read_instance('[30.0]'))
+    assert 'Traffic.0.Init.Road = 50' in other and 'Traffic.1.Init.Road = 30.0' in other
@@ -0,0 +1,167 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+# Spans and counters of the pipeline. Nothing is recorded unless a Tracer is active, then span() and count()
+# cost one global lookup:
+#   with Tracer('trace.json', progress_interval=60):
+#       runner.simulate_movies(grid_path, out_quants, camera_name)
+# The trace file opens in chrome://tracing or https://ui.perfetto.dev.
+
+_tracer = None # active Tracer
+_NULL = contextlib.nullcontext()
+
+
+def span(name, category='', **args):
+    # with span('sim'): ... records how long the block took
+    if _tracer is None:
+        return _NULL
+    return _tracer.span(name, category, args)
+
+def count(name, value=1):
+    # finished work, e.g. count('ipg_result') per simulated instance
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+def gauge(name, value):
+    # current value, e.g. a queue length
+    if _tracer is not None:
+        _tracer.gauge(name, value)
+
+def expect(name, value):
+    # work that count(name) will report, for the progress
+    if _tracer is not None:
+        _tracer.expect(name, value)
+
+
+class Tracer():
+    # Collects spans as complete events and counters as counter events of the Chrome trace format, written to
+    # trace_path when the tracer is closed. Every progress_interval seconds the progress of every counter with
+    # expected work (done, instances/hour, ETA) and the gauges are printed.
+    def __init__(self, trace_path=None, progress_interval=None, log_level=1):
+        self.trace_path = trace_path
+        self.progress_interval = progress_interval
+        self._log_level = log_level
+        self.events = []
+        self.spans = {} # name -> [count, total seconds, max seconds]
+        self.counts = {}
+        self.expected = {}
+        self.gauges = {}
+        self._started = {} # counter -> time of its first expect
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last_progress = self._start
+
+    def __enter__(self):
+        global _tracer
+        self._previous = _tracer
+        _tracer = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _tracer
+        _tracer = self._previous
+        if self.trace_path:
+            self.write(self.trace_path)
+        if self._log_level <= 1:
+            self.print_summary()
+        return False
+
+    @contextlib.contextmanager
+    def span(self, name, category='', args=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {'name': name, 'cat': category, 'ph': 'X', 'ts': self._us(start), 'dur': (end - start) * 1e6,
+                     'pid': os.getpid(), 'tid': self._thread()}
+            if args:
+                event['args'] = {key: str(value) for key, value in args.items()}
+            with self._lock:
+                self.events.append(event)
+                stats = self.spans.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += end - start
+                stats[2] = max(stats[2], end - start)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+            self.events.append(self._counter(name, self.counts[name]))
+        self._progress()
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+            self.events.append(self._counter(name, value))
+        self._progress()
+
+    def expect(self, name, value):
+        with self._lock:
+            self.expected[name] = self.expected.get(name, 0) + value
+            self._started.setdefault(name, time.perf_counter())
+
+    def progress(self):
+        # {counter: {'done', 'expected', 'per_hour', 'eta' (seconds)}}
+        now = time.perf_counter()
+        progress = {}
+        for name, expected in self.expected.items():
+            done = min(self.counts.get(name, 0), expected)
+            elapsed = now - self._started[name]
+            per_hour = done / elapsed * 3600 if elapsed > 0 else 0.0
+            eta = (expected - done) / per_hour * 3600 if per_hour else float('nan')
+            progress[name] = {'done': done, 'expected': expected, 'per_hour': per_hour, 'eta': eta}
+        return progress
+
+    def print_progress(self):
+        parts = []
+        for name, stage in self.progress().items():
+            eta = str(timedelta(seconds=round(stage['eta']))) if stage['eta'] == stage['eta'] else '?'
+            parts.append(f'{name} {stage["done"]}/{stage["expected"]} {stage["per_hour"]:.0f}/h ETA {eta}')
+        parts += [f'{name} {value}' for name, value in self.gauges.items()]
+        print(' | '.join(parts))
+
+    def summary(self):
+        # {span name: {'count', 'total', 'mean', 'max'}} in seconds
+        return {name: {'count': n, 'total': total, 'mean': total / n, 'max': longest}
+                for name, (n, total, longest) in self.spans.items()}
+
+    def print_summary(self):
+        for name, stats in sorted(self.summary().items(), key=lambda item: -item[1]['total']):
+            print(f'{name:40s} {stats["count"]:7d} x {stats["mean"]:9.4f} s = {stats["total"]:10.2f} s (max {stats["max"]:.3f} s)')
+
+    def write(self, trace_path):
+        with self._lock:
+            events = list(self.events)
+        with open(trace_path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+    def _progress(self):
+        if self.progress_interval is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        self.print_progress()
+
+    def _counter(self, name, value):
+        return {'name': name, 'ph': 'C', 'ts': self._us(time.perf_counter()), 'pid': os.getpid(), 'args': {name: value}}
+
+    def _thread(self):
+        # thread names are recorded once per thread, as metadata events
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            with self._lock:
+                self._threads.add(tid)
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                                    'args': {'name': threading.current_thread().name}})
+        return tid
+
+    def _us(self, seconds):
+        return (seconds - self._start) * 1e6
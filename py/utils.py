@@ -1,15 +1,24 @@
+import functools
 import toml
-from scipy import stats
 import re
 import os
 
-DISTRIBUTIONS = dict()
-for key, value in stats.__dict__.items():
-    if issubclass(type(value),stats.rv_discrete) or issubclass(type(value),stats.rv_continuous):
-        DISTRIBUTIONS[key] = value
+@functools.lru_cache(maxsize=None)
+def distributions():
+    # {name: distribution} of scipy.stats, built on first use because importing scipy.stats takes about a second
+    from scipy import stats
+    return {key: value for key, value in stats.__dict__.items()
+            if issubclass(type(value),stats.rv_discrete) or issubclass(type(value),stats.rv_continuous)}
+
+def __getattr__(name):
+    # utils.DISTRIBUTIONS is built when it is first accessed
+    if name == 'DISTRIBUTIONS':
+        return distributions()
+    raise AttributeError(f"module 'utils' has no attribute '{name}'")
 
 class RandomList():
     def __init__(self, _list):
+        from scipy import stats
         self._list = _list
         self.dist = stats.randint(0,len(_list))
         self.dist.name = 'RandomList'
@@ -34,3 +43,8 @@ def create_path(pattern, original_file_path, id, date, grid_ID):
     pattern = pattern.replace('%/', os.path.sep)
     return os.path.abspath(pattern)
 
+def create_paths(pattern, original_file_path, ids, date, grid_ID):
+    # create_path of many ids, the pattern is only resolved once. '<' cannot be part of a path on Windows
+    template = create_path(pattern.replace('%x', '<id>'), original_file_path, 0, date, grid_ID)
+    return [template.replace('<id>', str(id)) for id in ids]
+